@@ -5,10 +5,11 @@ from pyjava.storage import streaming_tar
 import os
 import inspect
 import functools
+import threading
 
 from typing import Dict,Generator,Optional
 from dataclasses import dataclass
-from byzerllm.utils import (print_flush,format_prompt,format_prompt_jinja2)
+from byzerllm.utils import (print_flush,format_prompt,format_prompt_jinja2,get_signature)
 from .store import transfer_from_ob
 
 @dataclass
@@ -49,7 +50,13 @@ def common_init_model(model_refs: List[ClientObjectRef],
       else:
           print_flush(f"MODEL[{udf_name}] Normal mode: restore model from ray object store to {model_dir}")
           if not os.path.exists(model_dir):
-            transfer_from_ob(udf_name,model_refs,model_dir)
+            # `modelCacheDir` keeps a checksum-verified copy of the model on the node,
+            # `modelCacheVersion` must change whenever the model does, without it the cache is not used
+            transfer_from_ob(udf_name,model_refs,model_dir,
+                             cache_dir=conf.get("modelCacheDir",None),
+                             cache_key=conf.get("modelCacheKey",None),
+                             verify=conf.get("modelCacheVerify","sha256"),
+                             cache_version=conf.get("modelCacheVersion",None))
     else:
       print_flush(f"MODEL[{udf_name}]  Local mode: Load model from local path ({model_dir}), consume the model server to prevent socket server leak.")
       consume_model(conf)   
@@ -91,6 +98,32 @@ def log_to_file(msg:str,file_path:str):
         f.write(msg)
         f.write("\n")
 
+# (model name, template) -> the ByzerLLM client shared by the prompt functions
+# bound to a model name, so they keep the meta and the function impl caches warm
+_llm_pool: Dict[Any,Any] = {}
+_llm_pool_lock = threading.Lock()
+
+def _get_pooled_llm(model:str,template:str="auto"):
+    key = (model,template)
+    llm = _llm_pool.get(key,None)
+    if llm is not None:
+        return llm
+    with _llm_pool_lock:
+        llm = _llm_pool.get(key,None)
+        if llm is None:
+            llm = ByzerLLM()
+            llm.setup_default_model_name(model)
+            llm.setup_template(model,template)
+            _llm_pool[key] = llm
+    return llm
+
+def clear_llm_pool():
+    '''
+    drops the pooled clients, e.g. after the model was redeployed with another template
+    '''
+    with _llm_pool_lock:
+        _llm_pool.clear()
+
 class _PromptWraper():        
     def __init__(self,func,llm,render,check_result,options,*args,**kwargs) -> None:
         self.func = func
@@ -115,7 +148,7 @@ class _PromptWraper():
         args = self.args
         kwargs = self.kwargs           
                                  
-        signature = inspect.signature(func)                            
+        signature = get_signature(func)                            
         arguments = signature.bind(*args, **kwargs)
         arguments.apply_defaults()
         input_dict = {}
@@ -141,7 +174,7 @@ class _PromptWraper():
         args = self.args
         kwargs = self.kwargs
         
-        signature = inspect.signature(func)                       
+        signature = get_signature(func)                       
         arguments = signature.bind(*args, **kwargs)
         arguments.apply_defaults()
         input_dict = {}
@@ -162,9 +195,7 @@ class _PromptWraper():
                 return llm.prompt(render=render,check_result=check_result,options=self._options)(func)(**input_dict)
         
         if isinstance(llm,str):
-            _llm = ByzerLLM()
-            _llm.setup_default_model_name(llm)
-            _llm.setup_template(llm,"auto")
+            _llm = _get_pooled_llm(llm)
             
             if "self" in input_dict:
                 instance = input_dict.pop("self")                                                                 
@@ -217,7 +248,7 @@ class _PrompRunner:
         return self
     
     def prompt(self,*args, **kwargs):
-        signature = inspect.signature(self.func)                
+        signature = get_signature(self.func)                
         if self.instance:                                   
             arguments = signature.bind(self.instance,*args, **kwargs) 
         else:
@@ -304,7 +335,7 @@ class _PrompRunner:
         render = self.render
         check_result = self.check_result        
         
-        signature = inspect.signature(func)                       
+        signature = get_signature(func)                       
         if self.instance:                                   
             arguments = signature.bind(self.instance,*args, **kwargs) 
         else:
@@ -335,15 +366,13 @@ class _PrompRunner:
             return self._multi_turn_wrapper(llm,v,signature)
         
         if isinstance(llm,str):
-            _llm = ByzerLLM()
-            _llm.setup_default_model_name(llm)
-            _llm.setup_template(llm,"auto")  
+            _llm = _get_pooled_llm(llm)
             return_origin_response = True if self.response_markers else False       
             v = _llm.prompt(render=render,check_result=check_result,options=self._options,
                             return_origin_response=return_origin_response)(func)(**input_dict) 
             if not return_origin_response:
                 return v 
-            return self._multi_turn_wrapper(llm,v,signature)
+            return self._multi_turn_wrapper(_llm,v,signature)
                 
         else:
             raise ValueError("llm should be a lambda function or ByzerLLM instance or a string of model name")  
@@ -35,6 +35,12 @@ def get_agent_name(agent: Union[Agent,ClientActorHandle,str]) -> str:
 
     return agent_name    
 
+def get_agent_names(agents: List[Union[Agent,ClientActorHandle,str]]) -> List[str]:
+    """Return the names of the agents, the remote agents are asked concurrently."""
+    refs = {i:agent.get_name.remote() for i,agent in enumerate(agents) if not isinstance(agent,(Agent,str))}
+    remote_names = dict(zip(refs.keys(),ray.get(list(refs.values())))) if refs else {}
+    return [remote_names[i] if i in remote_names else get_agent_name(agent) for i,agent in enumerate(agents)]
+
 def run_agent_func(agent: Union[Agent,"ConversableAgent",ClientActorHandle], func_name: str, *args, **kwargs):
     """Run a function of an agent."""
     if isinstance(agent,Agent):
@@ -92,7 +98,7 @@ class Agents:
         if any([not isinstance(agent,Agent) for agent in agents]):
             raise ValueError("agents must be a list of Agent objects")
                 
-        group_parameters = ["messages","max_round","admin_name","func_call_filter"]
+        group_parameters = ["messages","max_round","admin_name","func_call_filter","overlap_broadcast"]
         group_parameters_dict = {}
         for parameter in group_parameters:
             if parameter in kwargs:
@@ -110,7 +116,7 @@ class Agents:
         from .groupchat import GroupChat
         from .groupchat import GroupChatManager
                 
-        group_parameters = ["messages","max_round","admin_name","func_call_filter"]
+        group_parameters = ["messages","max_round","admin_name","func_call_filter","overlap_broadcast"]
         group_parameters_dict = {}
         for parameter in group_parameters:
             if parameter in kwargs:
@@ -428,6 +428,36 @@ class ConversableAgent(Agent):
             ) 
         
     
+    def broadcast(
+        self,
+        message: Union[Dict, str],
+        recipients: List[Union[ClientActorHandle,Agent,str]],
+        request_reply: Optional[bool] = None,
+        silent: Optional[bool] = False,
+        wait: Optional[bool] = True,
+    ) -> List[ClientObjectRef]:
+        """Send the message to all the recipients.
+
+        The remote recipients receive the message concurrently. With wait=False the
+        ObjectRefs of the `receive` calls are returned instead of waiting for them,
+        the caller must ray.get them before relying on the recipients having the message.
+        """
+        refs = []
+        for recipient in recipients:
+            if not self._append_message(message, "assistant", recipient):
+                raise ValueError(
+                    "Message can't be converted into a valid ChatCompletion message. Either content or function_call must be provided."
+                )
+            if isinstance(recipient, Agent):
+                recipient.receive(message, self, request_reply, silent)
+            else:
+                t = ray.get_actor(recipient) if isinstance(recipient, str) else recipient
+                refs.append(t.receive.remote(message, self.get_name(), request_reply, silent))
+        if wait:
+            ray.get(refs)
+            return []
+        return refs
+
     def _process_received_message(self, message, sender, silent):
             raw_message = message
             if isinstance(message, ChatResponse):                
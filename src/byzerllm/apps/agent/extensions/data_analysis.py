@@ -13,7 +13,7 @@ from byzerllm.apps.agent import Agent,Agents,get_agent_name,run_agent_func,ChatR
 from byzerllm.apps.agent.user_proxy_agent import UserProxyAgent
 from byzerllm.apps.agent.extensions.data_analysis_pipeline_agent import DataAnalysisPipeline,DataAnalysisPipelineManager
 from byzerllm.apps.agent.extensions.simple_retrieval_client import SimpleRetrievalClient
-from byzerllm.apps.agent.store.memory_store import  MessageStore,MemoryStore,Message as ChatStoreMessage
+from byzerllm.apps.agent.store.memory_store import  MessageStore,MemoryStore,AsyncMemoryStore,Message as ChatStoreMessage
 from byzerllm.apps.agent.store.stores import Stores
 try:
     from termcolor import colored
@@ -64,7 +64,7 @@ class DataAnalysis:
                 try:
                     ray.get_actor(self.message_store)
                 except:
-                    ray.remote(MemoryStore).options(num_cpus=0.1,name=self.message_store, lifetime="detached").remote()
+                    ray.remote(AsyncMemoryStore).options(num_cpus=0.1,name=self.message_store, lifetime="detached").remote()
 
 
         if not ray.get(self.manager.check_pipeline_exists.remote(self.name)):
@@ -108,14 +108,26 @@ class DataAnalysis:
                                 human_input_mode="NEVER",
                                 max_consecutive_auto_reply=0,chat_wrapper=self.chat_wrapper)
         
-    def get_messages(self):
+    def _format_messages(self,messages):
         v = [] 
-        store = Stores("MESSAGE_STORE")
-        for item in store.get(self.name):            
+        for item in messages:            
             v.append(item.sender + " (to " + f"{item.receiver}):\n")
             v.append(f"{item.m['content']}")
             v.append("\n" + "-" * 80)
-        return "\n".join(v)    
+        return "\n".join(v)
+
+    def get_messages(self):
+        store = Stores("MESSAGE_STORE")
+        return self._format_messages(store.get(self.name))
+
+    def get_messages_since(self,offset:int=0,timeout:float=0.0):
+        '''
+        returns the messages after offset and the offset for the next call,
+        with timeout > 0 waits up to timeout seconds for new messages.
+        '''
+        store = Stores("MESSAGE_STORE")
+        messages, offset = store.get_since(self.name,offset,timeout)
+        return self._format_messages(messages), offset    
 
     def send_from_agent_to_agent(self,from_agent_name:str,to_agent_name:str,message:Dict[str,Any]):
         if self.data_analysis_pipeline is None:
@@ -150,9 +150,9 @@ Context is: {input_context}
             top_k = new_message["metadata"]["top_k"]    
         
         contents = self.simple_retrieval_client.search_content_chunks(owner=self.owner,q=new_message["content"],limit=top_k,return_json=False)
+        docs = self.simple_retrieval_client.get_docs([item["doc_id"] for item in contents],owner=self.owner)
         for item in contents:
-            temp = self.simple_retrieval_client.get_doc(item["doc_id"],owner=self.owner)
-            item["doc_url"] = temp["url"]                        
+            item["doc_url"] = docs.get(item["doc_id"],{}).get("url",None)
 
         input_context = json.dumps([{"content":x["raw_chunk"]} for x in contents],ensure_ascii=False,indent=4)
 
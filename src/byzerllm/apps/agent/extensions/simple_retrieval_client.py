@@ -9,6 +9,9 @@ from byzerllm.utils.client import LLMHistoryItem,LLMRequest
 from byzerllm.utils.retrieval import TableSettings,SearchQuery
 import uuid
 import json
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from langchain import PromptTemplate
 from langchain.text_splitter import RecursiveCharacterTextSplitter,Document
 try:
@@ -21,10 +24,16 @@ except ImportError:
 import jieba  
 
 class SimpleRetrievalClient:
-    def __init__(self,llm:ByzerLLM, retrieval: ByzerRetrieval,retrieval_cluster:str,retrieval_db:str,max_output_length=10000):
+    def __init__(self,llm:ByzerLLM, retrieval: ByzerRetrieval,retrieval_cluster:str,retrieval_db:str,max_output_length=10000,
+                 emb_batch_size:int=32,tokenize_workers:int=4,doc_cache_size:int=1024):
         self.retrieval_cluster = retrieval_cluster
         self.retrieval_db = retrieval_db
         self.max_output_length = max_output_length
+        self.emb_batch_size = emb_batch_size
+        self.tokenize_workers = tokenize_workers
+        # (owner,doc_id) -> doc, LRU
+        self.doc_cache = OrderedDict()
+        self.doc_cache_size = doc_cache_size
         self.llm = llm
         self.retrieval = retrieval                
         if self.llm.default_emb_model_name is None:
@@ -100,11 +109,11 @@ field(created_time,long,sort)
                 "content":self.search_tokenize(content),
                 "raw_content":content,
                 "auth_tag":"",
-                "created_time":int(time.time()*1000),
-                "chat_name_vector":self.emb(chat_name),
-                "content_vector":self.emb(content)}]    
+                "created_time":int(time.time()*1000)}]    
+        vectors = self.emb_batch([chat_name,content])
 
-        self.retrieval.build_from_dicts(self.retrieval_cluster,self.retrieval_db,"user_memory",data)
+        self.retrieval.build_from_arrays(self.retrieval_cluster,self.retrieval_db,"user_memory",data,
+                                         {"chat_name_vector":vectors[0:1],"content_vector":vectors[1:2]})
 
     def get_conversations(self,owner:str, chat_name:str,limit=1000)->List[Dict[str,Any]]:
         docs = self.retrieval.filter(self.retrieval_cluster,
@@ -123,38 +132,57 @@ field(created_time,long,sort)
         return chat_history    
 
 
-    def save_text_content(self,owner:str,title:str,content:str,url:str,auth_tag:str="",auto_chunking:bool=True):
-
+    def save_text_content(self,owner:str,title:str,content:str,url:str,auth_tag:str="",auto_chunking:bool=True)->Dict[str,Any]:
+        '''
+        the title, the content and all the chunks are embedded in batches of emb_batch_size
+        while a thread pool tokenizes them, then every table is written with one bulk build.
+        Returns the ingest throughput.
+        '''
         if not self.retrieval:
             raise Exception("retrieval is not setup")
 
-                        
-        text_content = [{"_id":generate_str_md5(content),
-            "title":self.search_tokenize(title),
-            "content":self.search_tokenize(content[0:10000]),
+        start = time.time()
+        content_chunks = self.split_text_into_chunks(content) if auto_chunking else []
+
+        with ThreadPoolExecutor(max_workers=self.tokenize_workers) as executor:
+            tokenized = executor.map(self.search_tokenize,[title,content[0:10000],auth_tag] + content_chunks)
+            emb_start = time.time()
+            vectors = self.emb_batch([title,content[0:2048]] + content_chunks)
+            emb_time = time.time() - emb_start
+            tokenized = list(tokenized)
+
+        doc_id = generate_str_md5(content)
+        self.doc_cache.pop((owner,doc_id),None)
+        created_time = int(time.time()*1000)
+        text_content = [{"_id":doc_id,
+            "title":tokenized[0],
+            "content":tokenized[1],
             "owner":owner,
             "raw_content":content[0:10000],
             "url":url,
-            "auth_tag":self.search_tokenize(auth_tag),
-            "title_vector":self.emb(title),
-            "content_vector":self.emb(content[0:2048]),
-            "created_time":int(time.time()*1000),
+            "auth_tag":tokenized[2],
+            "created_time":created_time,
             }]
-        self.retrieval.build_from_dicts(self.retrieval_cluster,self.retrieval_db,"text_content",text_content)
+        self.retrieval.build_from_arrays(self.retrieval_cluster,self.retrieval_db,"text_content",text_content,
+                                         {"title_vector":vectors[0:1],"content_vector":vectors[1:2]})
         
-        if auto_chunking:            
-            content_chunks= self.split_text_into_chunks(content)
-                        
-            text_content_chunks = [{"_id":f'''{text_content[0]["_id"]}_{i}''',
-                "doc_id":text_content[0]["_id"],
+        if content_chunks:
+            text_content_chunks = [{"_id":f'''{doc_id}_{i}''',
+                "doc_id":doc_id,
                 "owner":owner,
-                "chunk":self.search_tokenize(item),
+                "chunk":chunk_tokens,
                 "raw_chunk":item,
-                "chunk_vector":self.emb(item),
-                "created_time":int(time.time()*1000),
-                } for i,item in enumerate(content_chunks)]
+                "created_time":created_time,
+                } for i,(item,chunk_tokens) in enumerate(zip(content_chunks,tokenized[3:]))]
             
-            self.retrieval.build_from_dicts(self.retrieval_cluster,self.retrieval_db,"text_content_chunk",text_content_chunks)    
+            self.retrieval.build_from_arrays(self.retrieval_cluster,self.retrieval_db,"text_content_chunk",text_content_chunks,
+                                             {"chunk_vector":vectors[2:]})
+
+        total_time = time.time() - start
+        return {"chunks":len(content_chunks),
+                "emb_time":emb_time,
+                "total_time":total_time,
+                "chunks_per_second":len(content_chunks)/total_time if total_time > 0 else 0.0}
 
     
     def _owner_filter(self,owner:str):
@@ -216,6 +244,40 @@ field(created_time,long,sort)
                                         limit=1)])
         return docs[0] if docs else None
     
+    def _cache_doc(self,owner:str,doc_id:str,doc:Dict[str,Any]):
+        self.doc_cache[(owner,doc_id)] = doc
+        self.doc_cache.move_to_end((owner,doc_id))
+        while len(self.doc_cache) > self.doc_cache_size:
+            self.doc_cache.popitem(last=False)
+
+    def get_docs(self,doc_ids:List[str],owner:str)->Dict[str,Dict[str,Any]]:
+        '''
+        returns {doc_id:doc} of the docs found, the docs missing in the cache are
+        fetched with one filter query.
+        '''
+        docs = {}
+        missing = []
+        for doc_id in dict.fromkeys(doc_ids):
+            doc = self.doc_cache.get((owner,doc_id),None)
+            if doc is None:
+                missing.append(doc_id)
+            else:
+                self.doc_cache.move_to_end((owner,doc_id))
+                docs[doc_id] = doc
+
+        if missing:
+            found = self.retrieval.filter(self.retrieval_cluster,
+                            [SearchQuery(self.retrieval_db,"text_content",
+                                         filters={"and":[self._owner_filter(owner),
+                                                         {"or":[{"field":"_id","value":doc_id} for doc_id in missing]}]},
+                                        keyword=None,fields=[],
+                                        vector=[],vectorField=None,
+                                        limit=len(missing))])
+            for doc in found:
+                self._cache_doc(owner,doc["_id"],doc)
+                docs[doc["_id"]] = doc
+        return docs
+
     def get_doc_by_url(self,url:str,owner:str):
         docs = self.retrieval.search(self.retrieval_cluster,
                             [SearchQuery(self.retrieval_db,"text_content",
@@ -244,6 +306,17 @@ field(created_time,long,sort)
     def emb(self,s:str):        
         return self.llm.emb(self.llm.default_emb_model_name,LLMRequest(instruction=s))[0].output[0:1024] 
 
+    def emb_batch(self,texts:List[str])->np.ndarray:
+        '''
+        embeds the texts with one request per emb_batch_size texts, returns a float32 matrix
+        '''
+        vectors = []
+        for i in range(0,len(texts),self.emb_batch_size):
+            responses = self.llm.emb(self.llm.default_emb_model_name,LLMRequest(instruction=texts[i:i+self.emb_batch_size]),
+                                     return_ndarray=True)
+            vectors.append(np.stack([response.output[0:1024] for response in responses]))
+        return np.concatenate(vectors)
+
 
     def split_text_into_chunks(self,s:str):
         # self.llm.apply_sql_func(
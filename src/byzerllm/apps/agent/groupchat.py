@@ -8,7 +8,8 @@ from ray.util.client.common import ClientActorHandle, ClientObjectRef
 from ...utils.client import ByzerLLM,code_utils
 from byzerllm.utils.retrieval import ByzerRetrieval
 import json
-from . import get_agent_name, run_agent_func,ChatResponse
+import ray
+from . import get_agent_name, get_agent_names, run_agent_func,ChatResponse
 
 try:
     from termcolor import colored
@@ -32,6 +33,8 @@ class GroupChat:
         When set to True and when a message is a function call suggestion,
         the next speaker will be chosen from an agent which contains the corresponding function name
         in its `function_map`.
+    - overlap_broadcast: whether to select the next speaker while the message is still
+        being broadcast to the agents. Default is False.
     """
 
     agents: List[Union[Agent,ClientActorHandle,str]]
@@ -39,6 +42,7 @@ class GroupChat:
     max_round: int = 10
     admin_name: str = "Admin"
     func_call_filter: bool = True
+    overlap_broadcast: bool = False
 
     @property
     def agent_names(self) -> List[str]:
@@ -198,27 +202,43 @@ class GroupChatManager(ConversableAgent):
         message = messages[-1]
         speaker = sender
         groupchat = config
+        # the names of remote agents cost a round trip each, look them up once
+        agent_names = get_agent_names(groupchat.agents)
+
+        def name_of(agent):
+            for a,name in zip(groupchat.agents,agent_names):
+                if a is agent:
+                    return name
+            return get_agent_name(agent)
+
         for i in range(groupchat.max_round):
             print(colored(f"GroupChatManager run_chat: {i}","green"),flush=True)
+            speaker_name = name_of(speaker)
             # set the name to speaker's name if the role is not function
             if message["role"] != "function":
-                message["name"] = get_agent_name(speaker)
+                message["name"] = speaker_name
             groupchat.messages.append(message)
-            # broadcast the message to all agents except the speaker
-            for agent in groupchat.agents:
-                if get_agent_name(agent) != get_agent_name(speaker):
-                    self.send(message, agent, request_reply=False, silent=True)
+            # broadcast the message to all agents except the speaker, the remote agents receive it concurrently
+            pending = self.broadcast(message, 
+                                     [agent for agent,name in zip(groupchat.agents,agent_names) if name != speaker_name], 
+                                     request_reply=False, silent=True, wait=False)
             if i == groupchat.max_round - 1:
                 # the last round
+                ray.get(pending)
                 break
+            if not groupchat.overlap_broadcast:
+                ray.get(pending)
             try:
-                # select the next speaker
+                # select the next speaker, it only reads groupchat.messages so it can
+                # run while the agents are still receiving the message
                 speaker = groupchat.select_speaker(speaker, self)
+                ray.get(pending)
                 # let the speaker speak
                 reply = run_agent_func(speaker,"generate_reply",sender=self)
             except KeyboardInterrupt:
+                ray.get(pending)
                 # let the admin agent speak if interrupted
-                if groupchat.admin_name in groupchat.agent_names:
+                if groupchat.admin_name in agent_names:
                     # admin agent is one of the participants
                     speaker = groupchat.agent_by_name(groupchat.admin_name)
                     reply = run_agent_func(speaker,"generate_reply",sender=self)
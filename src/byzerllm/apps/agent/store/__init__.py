@@ -1,6 +1,6 @@
 
 import pydantic
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
 from abc import ABC, abstractmethod
 
 
@@ -24,3 +24,12 @@ class MessageStore(ABC):
     @abstractmethod
     def clear(self, id: str):
         pass
+
+    def get_since(self, id: str, offset: int = 0, timeout: float = 0.0) -> Tuple[List[Message], int]:
+        """Return the messages of the conversation from `offset` on and the offset to read next.
+
+        With timeout > 0 the call waits up to timeout seconds for new messages.
+        Stores without an incremental read fall back to slicing `get`.
+        """
+        v = self.get(id)
+        return v[offset:], len(v)
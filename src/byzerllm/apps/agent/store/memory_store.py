@@ -1,48 +1,226 @@
 from . import Message, MessageStore
+from collections import deque
+from itertools import islice
+from typing import Any, Deque, Dict, List, Tuple
+import asyncio
+import heapq
+import threading
 import time
 
+
+def _message_size(message: Message) -> int:
+    if message.m is None:
+        return 0
+    content = message.m.get("content", "")
+    return len(content) if isinstance(content, str) else 0
+
+
 class MemoryStore(MessageStore):
-    def __init__(self):
-        self.messages = {}
+    '''
+    Keeps the messages of every conversation (message.id) in memory.
+
+    Every conversation is a ring buffer of at most `max_messages` messages; a
+    message expires `ttl` seconds after it was put, a conversation after its
+    last put. The expiry uses the time the store received the message, not
+    message.timestamp, which is the monotonic clock of the sender's process.
+
+    Expired conversations are found with a heap ordered by expiry time with one
+    entry per conversation; an entry of a conversation that was active in the
+    meantime is pushed back with the new expiry time. The heap is swept at most
+    every `sweep_interval` seconds from put, so put and get are O(1) amortized
+    however many conversations are live.
+
+    The messages of a conversation are numbered from 0, `get_since` returns the
+    messages from an offset on, so a reader polling a conversation only gets
+    the new ones. Run it as an actor with AsyncMemoryStore.
+    '''
+    def __init__(self, ttl: float = 24*60*60, max_messages: int = 10000, sweep_interval: float = 60):
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.sweep_interval = sweep_interval
+        # id -> ring buffer of (receive time, message)
+        self.messages: Dict[str, Deque[Tuple[float, Message]]] = {}
+        # id -> offset of the first message in the ring buffer
+        self.start_offsets: Dict[str, int] = {}
+        self.last_active: Dict[str, float] = {}
+        self.expiry_heap: List[Tuple[float, str]] = []
+        self.in_heap = set()
+        self.next_sweep = time.monotonic() + sweep_interval
+        self.num_messages = 0
+        self.content_bytes = 0
+        self.expired_conversations = 0
+        self.dropped_messages = 0
+        self.lock = threading.RLock()
+        # the long-polling readers, few of them, so one condition for all the conversations
+        self.cond = threading.Condition(self.lock)
+
+    def _remove_left(self, id: str, v: Deque[Tuple[float, Message]]):
+        _, message = v.popleft()
+        self.start_offsets[id] += 1
+        self.num_messages -= 1
+        self.content_bytes -= _message_size(message)
+
+    def _expire_messages(self, id: str, now: float):
+        v = self.messages[id]
+        while v and now - v[0][0] > self.ttl:
+            self._remove_left(id, v)
+
+    def _remove(self, id: str):
+        v = self.messages.pop(id, None)
+        self.start_offsets.pop(id, None)
+        self.last_active.pop(id, None)
+        if v is not None:
+            self.num_messages -= len(v)
+            self.content_bytes -= sum(_message_size(message) for _, message in v)
 
     def put(self, message: Message):
-        if message.id not in self.messages:
-            self.messages[message.id] = []
-        v = self.messages[message.id]
-        v.append(message)
-        if message.m is None:
-            return self
-    
-        # clean up old messages
-        target = -1 
-        for idx,item in enumerate(v):
-            if time.monotonic() - item.timestamp > 24*60*60:
-                target = idx
-                break
-        if target >= 0:
-            v = v[target:]
-            self.messages[message.id] = v
-        
-        # clean up message groups
-        remove_keys = []
-        for key in list(self.messages.keys()):
-            if time.monotonic() -  self.messages[key][-1].timestamp  > 24*60*60:
-                remove_keys.append(key)
-
-        for key in remove_keys:
-            del self.messages[key]        
-
-        return self
-    
+        # returns nothing, as an actor method returning self would send the whole store back
+        with self.lock:
+            now = time.monotonic()
+            v = self.messages.get(message.id, None)
+            if v is None:
+                v = deque()
+                self.messages[message.id] = v
+                self.start_offsets[message.id] = 0
+                if message.id not in self.in_heap:
+                    self.in_heap.add(message.id)
+                    heapq.heappush(self.expiry_heap, (now + self.ttl, message.id))
+            elif len(v) >= self.max_messages:
+                self._remove_left(message.id, v)
+                self.dropped_messages += 1
+            v.append((now, message))
+            self.last_active[message.id] = now
+            self.num_messages += 1
+            self.content_bytes += _message_size(message)
+            self.cond.notify_all()
+            if message.m is not None:
+                self._expire_messages(message.id, now)
+            if now >= self.next_sweep:
+                self.sweep(now)
+
+    def sweep(self, now: float = None) -> int:
+        '''
+        drops the conversations without any put for ttl seconds, returns how many were dropped.
+        '''
+        with self.lock:
+            now = time.monotonic() if now is None else now
+            self.next_sweep = now + self.sweep_interval
+            removed = 0
+            while self.expiry_heap and self.expiry_heap[0][0] <= now:
+                _, id = heapq.heappop(self.expiry_heap)
+                if id not in self.last_active:
+                    # cleared or consumed, the entry is stale
+                    self.in_heap.discard(id)
+                    continue
+                expire_time = self.last_active[id] + self.ttl
+                if expire_time > now:
+                    heapq.heappush(self.expiry_heap, (expire_time, id))
+                    continue
+                self.in_heap.discard(id)
+                self._remove(id)
+                removed += 1
+            self.expired_conversations += removed
+            return removed
+
     def get(self, id: str):
-        v = self.messages.get(id,[])
-        if len(v)>0 and v[-1].m is None:
-            del self.messages[id]
-            return v
-        return v
-    
+        with self.lock:
+            v = self.messages.get(id, None)
+            if v is None:
+                return []
+            self._expire_messages(id, time.monotonic())
+            messages = [message for _, message in v]
+            if len(messages) > 0 and messages[-1].m is None:
+                self._remove(id)
+            return messages
+
+    def _end_offset(self, id: str) -> int:
+        return self.start_offsets[id] + len(self.messages[id])
+
+    def _has_new(self, id: str, offset: int) -> bool:
+        # an offset past the end means the conversation was cleared and started again
+        return id in self.messages and self._end_offset(id) != offset
+
+    def get_since(self, id: str, offset: int = 0, timeout: float = 0.0) -> Tuple[List[Message], int]:
+        with self.lock:
+            if timeout > 0 and not self._has_new(id, offset):
+                self.cond.wait_for(lambda: self._has_new(id, offset), timeout=timeout)
+
+            v = self.messages.get(id, None)
+            if v is None:
+                return [], offset
+            self._expire_messages(id, time.monotonic())
+            start = self.start_offsets[id]
+            end = self._end_offset(id)
+            if offset > end:
+                offset = start
+            # read from the right end, only the new messages are visited
+            n = end - max(offset, start)
+            messages = [message for _, message in islice(reversed(v), n)][::-1]
+            if len(messages) > 0 and messages[-1].m is None:
+                # the reader got the end of the conversation
+                self._remove(id)
+            return messages, end
+
     def clear(self, id: str):
-        if id in self.messages:
-            del self.messages[id]
-        
-    
\ No newline at end of file
+        with self.lock:
+            self._remove(id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "conversations": len(self.messages),
+                "messages": self.num_messages,
+                "content_bytes": self.content_bytes,
+                "expiry_heap_size": len(self.expiry_heap),
+                "expired_conversations": self.expired_conversations,
+                "dropped_messages": self.dropped_messages,
+            }
+
+
+class AsyncMemoryStore:
+    '''
+    A MemoryStore to run as an async actor, e.g.
+
+        ray.remote(AsyncMemoryStore).options(name="MESSAGE_STORE", lifetime="detached").remote()
+
+    The methods run on the event loop of the actor, so the store is never used by
+    two calls at once. A long-polling get_since waits on an asyncio.Condition
+    instead of holding a thread, the puts run while it waits.
+    '''
+    def __init__(self, ttl: float = 24*60*60, max_messages: int = 10000, sweep_interval: float = 60):
+        self.store = MemoryStore(ttl=ttl, max_messages=max_messages, sweep_interval=sweep_interval)
+        self.cond = None
+
+    def _cond(self) -> asyncio.Condition:
+        # created on first use, so it belongs to the event loop of the actor
+        if self.cond is None:
+            self.cond = asyncio.Condition()
+        return self.cond
+
+    async def put(self, message: Message):
+        self.store.put(message)
+        cond = self._cond()
+        async with cond:
+            cond.notify_all()
+
+    async def get(self, id: str):
+        return self.store.get(id)
+
+    async def get_since(self, id: str, offset: int = 0, timeout: float = 0.0) -> Tuple[List[Message], int]:
+        if timeout > 0 and not self.store._has_new(id, offset):
+            cond = self._cond()
+            async with cond:
+                try:
+                    await asyncio.wait_for(cond.wait_for(lambda: self.store._has_new(id, offset)), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        return self.store.get_since(id, offset)
+
+    async def clear(self, id: str):
+        self.store.clear(id)
+
+    async def sweep(self) -> int:
+        return self.store.sweep()
+
+    async def stats(self) -> Dict[str, Any]:
+        return self.store.stats()
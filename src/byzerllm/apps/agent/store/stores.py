@@ -18,7 +18,9 @@ class Stores:
         if isinstance(self.store,MessageStore):
             return self.store.put(message)
         else:
-            return self.store.put.remote(message)
+            # waits for the put: an async or threaded actor may run the calls
+            # of one caller out of order, and the messages must keep theirs
+            return ray.get(self.store.put.remote(message))
 
     def get(self, id):
         if isinstance(self.store,MessageStore):
@@ -30,4 +32,14 @@ class Stores:
         if isinstance(self.store,MessageStore):
             return self.store.clear(id)
         else:
-            return ray.get(self.store.clear.remote(id))     
\ No newline at end of file
+            return ray.get(self.store.clear.remote(id))
+
+    def get_since(self, id, offset:int=0, timeout:float=0.0):
+        if isinstance(self.store,MessageStore):
+            return self.store.get_since(id,offset,timeout)
+        elif not hasattr(self.store,"get_since"):
+            # a detached store actor started by an older version
+            v = self.get(id)
+            return v[offset:], len(v)
+        else:
+            return ray.get(self.store.get_since.remote(id,offset,timeout))
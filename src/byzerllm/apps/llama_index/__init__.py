@@ -16,10 +16,15 @@ def get_service_context(llm:ByzerLLM,**kargs):
 def get_storage_context(llm:ByzerLLM,retrieval:ByzerRetrieval,
                         chunk_collection:Optional[str]="default",
                         namespace:Optional[str]=None,                        
+                        flush_size:int=1,
+                        flush_interval:float=1.0,
                         **kargs):
     vector_store = ByzerAIVectorStore(llm=llm, retrieval=retrieval,chunk_collection=chunk_collection)
-    docstore = ByzerAIDocumentStore(llm=llm, retrieval=retrieval,namespace=namespace)
-    index_store = ByzerAIIndexStore(llm=llm, retrieval=retrieval,namespace=namespace)
+    # flush_size > 1 buffers the writes of the docstore and the index store, see ByzerAIKVStore
+    docstore = ByzerAIDocumentStore(llm=llm, retrieval=retrieval,namespace=namespace,
+                                    flush_size=flush_size,flush_interval=flush_interval)
+    index_store = ByzerAIIndexStore(llm=llm, retrieval=retrieval,namespace=namespace,
+                                    flush_size=flush_size,flush_interval=flush_interval)
     storage_context = StorageContext.from_defaults(
         docstore=docstore,
         vector_store=vector_store,
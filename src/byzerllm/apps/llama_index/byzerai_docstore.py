@@ -22,10 +22,20 @@ class ByzerAIDocumentStore(KVDocumentStore):
         retrieval:ByzerRetrieval,        
         namespace: Optional[str] = None,
         batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_size: int = 1,
+        flush_interval: float = 1.0,
     ) -> None:
         """Init a KVDocumentStore."""
         
         self._llm = llm
         self._retrieval = SimpleRetrieval(llm=llm, retrieval=retrieval)         
-        kv_store = ByzerAIKVStore(llm=llm, retrieval=retrieval)
-        super().__init__(kv_store, namespace=namespace, batch_size=batch_size)          
+        kv_store = ByzerAIKVStore(llm=llm, retrieval=retrieval, flush_size=flush_size, flush_interval=flush_interval)
+        super().__init__(kv_store, namespace=namespace, batch_size=batch_size)
+
+    def flush(self) -> None:
+        """Write and commit the buffered operations of the kv store."""
+        self._kvstore.flush()
+
+    def close(self) -> None:
+        """Flush the kv store and stop its flush timer."""
+        self._kvstore.close()
@@ -39,4 +39,4 @@ class ByzerAIEmbedding(BaseEmbedding):
 
     def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Get text embeddings."""
-        return [self._get_text_embedding(text) for text in texts]
+        return [r.output[0:1024] for r in self._llm.emb(None,texts)]
@@ -20,12 +20,22 @@ class ByzerAIIndexStore(KVIndexStore):
         self,
         llm:ByzerLLM,
         retrieval:ByzerRetrieval,        
-        namespace: Optional[str] = None        
+        namespace: Optional[str] = None,
+        flush_size: int = 1,
+        flush_interval: float = 1.0,
     ) -> None:
         """Init a KVDocumentStore."""
         
         self._llm = llm
         self._retrieval = SimpleRetrieval(llm=llm, retrieval=retrieval)         
-        kv_store = ByzerAIKVStore(llm=llm, retrieval=retrieval)
+        kv_store = ByzerAIKVStore(llm=llm, retrieval=retrieval, flush_size=flush_size, flush_interval=flush_interval)
         super().__init__(kv_store, namespace=namespace)  
         self._collection = f"{self._namespace}/index"
+
+    def flush(self) -> None:
+        """Write and commit the buffered operations of the kv store."""
+        self._kvstore.flush()
+
+    def close(self) -> None:
+        """Flush the kv store and stop its flush timer."""
+        self._kvstore.close()
@@ -1,4 +1,8 @@
+import atexit
 import json
+import logging
+import threading
+import weakref
 from typing import Any, Dict, List, Optional, Tuple, cast
 
 from llama_index.core.storage.kvstore.types import (
@@ -12,17 +16,152 @@ from byzerllm.utils.retrieval import ByzerRetrieval
 from byzerllm.apps.llama_index.simple_retrieval import SimpleRetrieval
 from byzerllm.utils.langutil import asyncfy_with_semaphore
 
+logger = logging.getLogger(__name__)
+
+# the stores with a write buffer, flushed when the process exits
+_open_stores: "weakref.WeakSet[ByzerAIKVStore]" = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_open_stores() -> None:
+    for store in list(_open_stores):
+        try:
+            store.close()
+        except Exception:
+            logger.exception("failed to flush the kv store at exit")
+
+
 class ByzerAIKVStore(BaseKVStore):
-   
+    """A KV store on the text_content table of Byzer-Retrieval.
+
+    By default every put and delete is written and committed before it returns,
+    and a failed write raises with nothing left behind.
+
+    With `flush_size` > 1 the puts and deletes are kept in a write buffer and
+    written with one build and one commit when `flush_size` operations are
+    buffered, `flush_interval` seconds after the first buffered operation, or
+    on `flush()`. The reads of this store see the buffered operations; other
+    processes see them after the flush, and the operations not flushed yet are
+    lost if the process dies. A failed flush is logged, the operations stay in
+    the buffer and are retried after `flush_interval` seconds, so the put which
+    triggered it does not raise; only `flush()` raises. With `flush_interval=0`
+    there is no retry: a failed flush raises and drops the operations, as an
+    unbuffered write does. Call `close()` when done with the store, the stores
+    still open are flushed when the process exits.
+    """
 
     def __init__(
         self,
         llm:ByzerLLM,
-        retrieval:ByzerRetrieval,                
+        retrieval:ByzerRetrieval,
+        flush_size: int = 1,
+        flush_interval: float = 1.0,
         **kwargs: Any,
     ) -> None:
         self._llm = llm
         self._retrieval = SimpleRetrieval(llm=llm, retrieval=retrieval, **kwargs)
+        self._flush_size = flush_size
+        self._flush_interval = flush_interval
+        # (collection, key) -> the doc to save, or None for a delete
+        self._buffer: Dict[Tuple[str, str], Optional[Dict[str, Any]]] = {}
+        # the operations being flushed, still visible to the reads until committed
+        self._flushing: Dict[Tuple[str, str], Optional[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        _open_stores.add(self)
+
+    def _buffered(self) -> bool:
+        return self._flush_size > 1 and self._flush_interval > 0
+
+    def _start_timer(self) -> None:
+        # called with self._lock held
+        if self._timer is None and self._buffered():
+            self._timer = threading.Timer(self._flush_interval, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_flush(self) -> None:
+        try:
+            self.flush()
+        except Exception:
+            # logged and re-armed by flush
+            pass
+
+    def _auto_flush(self) -> None:
+        # a buffered store retries a failed flush on its timer, raising as well
+        # would make the caller retry a write that is still pending
+        if self._buffered():
+            self._timed_flush()
+        else:
+            self.flush()
+
+    def _buffer_op(self, collection: str, key: str, doc: Optional[Dict[str, Any]]) -> bool:
+        # returns whether the buffer reached flush_size
+        with self._lock:
+            self._buffer[(collection, key)] = doc
+            self._start_timer()
+            return len(self._buffer) >= self._flush_size
+
+    def _lookup(self, key: str, collection: str) -> Tuple[bool, Optional[dict]]:
+        with self._lock:
+            for ops in (self._buffer, self._flushing):
+                if (collection, key) in ops:
+                    doc = ops[(collection, key)]
+                    return True, json.loads(doc["json_data"]) if doc else None
+        return False, None
+
+    def _merge_buffered(self, collection: str, result: Dict[str, dict]) -> Dict[str, dict]:
+        with self._lock:
+            for ops in (self._flushing, self._buffer):
+                for (c, key), doc in ops.items():
+                    if c != collection:
+                        continue
+                    if doc is None:
+                        result.pop(key, None)
+                    else:
+                        result[key] = json.loads(doc["json_data"])
+        return result
+
+    def flush(self) -> None:
+        """Write and commit the buffered puts and deletes."""
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._buffer:
+                    return
+                self._flushing, self._buffer = self._buffer, {}
+            try:
+                deletes: Dict[str, List[str]] = {}
+                docs = []
+                for (collection, key), doc in self._flushing.items():
+                    if doc is None:
+                        deletes.setdefault(collection, []).append(key)
+                    else:
+                        docs.append(doc)
+                for collection, keys in deletes.items():
+                    self._retrieval.delete_docs_by_ids(keys, collection)
+                if docs:
+                    self._retrieval.save_doc(data=docs, owner=None)
+                self._retrieval.commit_doc()
+            except Exception:
+                if self._buffered():
+                    logger.exception(f"failed to flush {len(self._flushing)} operations of the kv store, retry in {self._flush_interval} seconds")
+                    # keep the operations for the next flush, unless they were overwritten meanwhile
+                    with self._lock:
+                        self._buffer = {**self._flushing, **self._buffer}
+                        self._start_timer()
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def close(self) -> None:
+        """Flush the buffered operations and stop the flush timer."""
+        self.flush()
+        _open_stores.discard(self)
 
     def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
         """Put a key-value pair into the store.
@@ -32,14 +171,9 @@ class ByzerAIKVStore(BaseKVStore):
             val (dict): value
             collection (str): collection name
 
-        """             
-        self._retrieval.save_doc(data=[{            
-            "doc_id":key,
-            "json_data":json.dumps(val,ensure_ascii=False),
-            "collection":collection,
-            "content":"",
-        }],owner=None)
-        self._retrieval.commit_doc()
+        """
+        if self._buffer_op(collection, key, _to_doc(key, val, collection, "")):
+            self._auto_flush()
 
     async def aput(
         self, key: str, val: dict, collection: str = DEFAULT_COLLECTION
@@ -52,7 +186,14 @@ class ByzerAIKVStore(BaseKVStore):
             collection (str): collection name
 
         """
-        raise asyncfy_with_semaphore(self.put)(key, val, collection)
+        if self._buffer_op(collection, key, _to_doc(key, val, collection, "")):
+            await asyncfy_with_semaphore(self._auto_flush)()
+
+    def _put_all(self, kv_pairs: List[Tuple[str, dict]], collection: str) -> bool:
+        full = False
+        for key, val in kv_pairs:
+            full = self._buffer_op(collection, key, _to_doc(key, val, collection, val.get("text", ""))) or full
+        return full
 
     def put_all(
         self,
@@ -67,27 +208,24 @@ class ByzerAIKVStore(BaseKVStore):
             collection (str): collection name
 
         """
-        cur_batch = 0
-        v = []        
-        for key, val in kv_pairs:
-            v.append({            
-            "doc_id":key,
-            "json_data":json.dumps(val,ensure_ascii=False),
-            "collection":collection,
-            "content":val.get("text",""),
-        })
-            cur_batch += 1
+        if self._put_all(kv_pairs, collection):
+            self._auto_flush()
 
-            if cur_batch >= batch_size:
-                cur_batch = 0
-                self._retrieval.save_doc(data=v,owner=None)
-                v.clear()
+    async def aput_all(
+        self,
+        kv_pairs: List[Tuple[str, dict]],
+        collection: str = DEFAULT_COLLECTION,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> None:
+        """Put a dictionary of key-value pairs into the store.
 
-        if cur_batch > 0:
-            self._retrieval.save_doc(data=v,owner=None)
+        Args:
+            kv_pairs (List[Tuple[str, dict]]): key-value pairs
+            collection (str): collection name
 
-        self._retrieval.commit_doc()    
-            
+        """
+        if self._put_all(kv_pairs, collection):
+            await asyncfy_with_semaphore(self._auto_flush)()
 
     def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
         """Get a value from the store.
@@ -97,11 +235,10 @@ class ByzerAIKVStore(BaseKVStore):
             collection (str): collection name
 
         """
-        doc = self._retrieval.get_doc(doc_id=key,collection = collection)
-        val_str = doc["json_data"] if doc else None
-        if val_str is None:
-            return None
-        return json.loads(val_str)
+        buffered, val = self._lookup(key, collection)
+        if buffered:
+            return val
+        return _from_doc(self._retrieval.get_doc(doc_id=key,collection = collection))
 
     async def aget(
         self, key: str, collection: str = DEFAULT_COLLECTION
@@ -113,14 +250,20 @@ class ByzerAIKVStore(BaseKVStore):
             collection (str): collection name
 
         """
-        return asyncfy_with_semaphore(self.get)(key, collection)
+        buffered, val = self._lookup(key, collection)
+        if buffered:
+            return val
+        return _from_doc(await self._retrieval.aget_doc(doc_id=key,collection = collection))
 
     def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
-        raise NotImplementedError
+        """Get all values from the store."""
+        docs = self._retrieval.get_docs_by_collection(collection)
+        return self._merge_buffered(collection, {doc["doc_id"]: _from_doc(doc) for doc in docs})
 
     async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
         """Get all values from the store."""
-        raise NotImplementedError
+        docs = await self._retrieval.aget_docs_by_collection(collection)
+        return self._merge_buffered(collection, {doc["doc_id"]: _from_doc(doc) for doc in docs})
 
     def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
         """Delete a value from the store.
@@ -130,7 +273,8 @@ class ByzerAIKVStore(BaseKVStore):
             collection (str): collection name
 
         """
-        self._retrieval.delete_doc(doc_id=key,collection = collection)
+        if self._buffer_op(collection, key, None):
+            self._auto_flush()
         return True
 
     async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
@@ -141,5 +285,22 @@ class ByzerAIKVStore(BaseKVStore):
             collection (str): collection name
 
         """
-        asyncfy_with_semaphore(self.delete)(key, collection)
-    
+        if self._buffer_op(collection, key, None):
+            await asyncfy_with_semaphore(self._auto_flush)()
+        return True
+
+
+def _to_doc(key: str, val: dict, collection: str, content: str) -> Dict[str, Any]:
+    return {
+        "doc_id":key,
+        "json_data":json.dumps(val,ensure_ascii=False),
+        "collection":collection,
+        "content":content,
+    }
+
+
+def _from_doc(doc: Optional[Dict[str, Any]]) -> Optional[dict]:
+    val_str = doc["json_data"] if doc else None
+    if val_str is None:
+        return None
+    return json.loads(val_str)
@@ -9,6 +9,7 @@ from byzerllm.utils.client import LLMHistoryItem,LLMRequest
 from byzerllm.utils.retrieval import TableSettings,SearchQuery
 import uuid
 import json
+import numpy as np
 from langchain_core.prompts import PromptTemplate
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 try:
@@ -218,6 +219,8 @@ field(created_time,long,sort)
     
     def save_chunks(self,chunks:List[Dict[str,Any]]):        
         text_content_chunks = []
+        # embeddings from ByzerLLM.emb(...,return_ndarray=True) are written as one float32 matrix
+        use_arrays = len(chunks) > 0 and all(isinstance(chunk["chunk_embedding"],np.ndarray) for chunk in chunks)
         for chunk in chunks:
             chunk_id = chunk["chunk_id"]
             ref_doc_id = chunk["ref_doc_id"]
@@ -234,12 +237,20 @@ field(created_time,long,sort)
                 "owner":owner or "default",                
                 "chunk":self.search_tokenize(chunk_content),
                 "raw_chunk":chunk_content,
-                "chunk_vector":chunk_embedding,  
                 "chunk_collection":self.chunk_collection,              
                 "metadata":self.search_tokenize(json.dumps(metadata,ensure_ascii=False)),
                 "json_data":json.dumps(metadata,ensure_ascii=False),
                 "created_time":int(time.time()*1000),
                 })                   
+            if not use_arrays:
+                text_content_chunks[-1]["chunk_vector"] = chunk_embedding
+
+        if use_arrays:
+            self.retrieval.build_from_arrays(self.retrieval_cluster,
+                                             self.retrieval_db,
+                                             "text_content_chunk",text_content_chunks,
+                                             {"chunk_vector":np.stack([chunk["chunk_embedding"] for chunk in chunks])})
+            return
             
         self.retrieval.build_from_dicts(self.retrieval_cluster,
                                         self.retrieval_db,
@@ -247,15 +258,47 @@ field(created_time,long,sort)
 
             
         
+    def _doc_query(self,doc_id:str,collection:str):
+        filters = {"and":[{"field":"_id","value":f'{collection}/{doc_id}'}]}
+        return SearchQuery(self.retrieval_db,"text_content",
+                           filters=filters,
+                           keyword=None,fields=[],
+                           vector=[],vectorField=None,
+                           limit=1)
+
+    def _collection_query(self,collection:str,limit:int):
+        return SearchQuery(self.retrieval_db,"text_content",
+                           filters={"and":[{"field":"collection","value":collection}]},
+                           keyword=None,fields=[],
+                           vector=[],vectorField=None,
+                           limit=limit)
+
     def get_doc(self,doc_id:str,collection:str):
-        filters = {"and":[{"field":"_id","value":f'{collection}/{doc_id}'}]}        
-        docs = self.retrieval.filter(self.retrieval_cluster,
-                            [SearchQuery(self.retrieval_db,"text_content",
-                                         filters=filters,
-                                        keyword=None,fields=[],
-                                        vector=[],vectorField=None,
-                                        limit=1)])
+        docs = self.retrieval.filter(self.retrieval_cluster,[self._doc_query(doc_id,collection)])
+        return docs[0] if docs else None
+
+    async def aget_doc(self,doc_id:str,collection:str):
+        docs = await self.retrieval.afilter(self.retrieval_cluster,[self._doc_query(doc_id,collection)])
         return docs[0] if docs else None
+
+    def _check_not_truncated(self,docs,collection:str,limit:int):
+        # the filter query has no offset to page with, so refuse to return a partial collection
+        if len(docs) > limit:
+            raise Exception(f"collection {collection} has more than {limit} docs, raise the limit to read all of them")
+        return docs
+
+    def get_docs_by_collection(self,collection:str,limit:int=100000):
+        # one more than the limit tells whether the collection was cut
+        docs = self.retrieval.filter(self.retrieval_cluster,[self._collection_query(collection,limit + 1)])
+        return self._check_not_truncated(docs,collection,limit)
+
+    async def aget_docs_by_collection(self,collection:str,limit:int=100000):
+        docs = await self.retrieval.afilter(self.retrieval_cluster,[self._collection_query(collection,limit + 1)])
+        return self._check_not_truncated(docs,collection,limit)
+
+    def delete_docs_by_ids(self,doc_ids:List[str],collection:str):
+        ids = [f'{collection}/{doc_id}' for doc_id in doc_ids]
+        self.retrieval.delete_by_ids(self.retrieval_cluster,self.retrieval_db,"text_content",ids)
     
     @DeprecationWarning
     def delete_doc(self,doc_ids:List[str],collection:str):
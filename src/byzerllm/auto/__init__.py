@@ -9,6 +9,7 @@ from pyjava.api.mlsql import DataServer
 from byzerllm.utils.metrics import Metric
 from byzerllm import BlockRow
 from byzerllm.utils import (VLLMStreamServer,
+                            StreamServerPool,
                             StreamOutputs,
                             SingleOutput,
                             SingleOutputMeta,
@@ -17,6 +18,9 @@ from byzerllm.utils import (VLLMStreamServer,
                             ) 
 from byzerllm.utils.tokenizer import get_real_tokenizer,get_local_tokenizer,validate_args_engine_use_ray                        
 from byzerllm.utils.ray_utils import get_actor_info
+from byzerllm.utils.dynamic_batching import DynamicBatcher
+from byzerllm.utils.langutil import asyncfy_with_semaphore
+from byzerllm.utils.chat_template import chat_template_meta
 
 try:
     from byzerllm.auto.backend_llama_cpp import LlamaCppBackend
@@ -68,7 +72,7 @@ def stream_chat(self,tokenizer,ins:str, his:List[Dict[str,str]]=[],
         top_p:float=0.95,
         temperature:float=0.1,**kwargs):
  
-    if self.get_meta()[0]["message_format"]:
+    if self.get_meta()[0].get("message_format",False):
         config = copy.deepcopy(self.generation_config)
         config.max_length = max_length
         config.temperature = temperature
@@ -118,21 +122,7 @@ def stream_chat(self,tokenizer,ins:str, his:List[Dict[str,str]]=[],
 
     max_new_tokens = compute_max_new_tokens(tokens, min(max_length, getattr(config, "model_max_length", max_length))) 
 
-    other_params = {}  
-    if "early_stopping" in kwargs:
-        other_params["early_stopping"] = bool(kwargs["early_stopping"])
-
-    if "repetition_penalty" in kwargs:
-        other_params["repetition_penalty"] = float(kwargs["repetition_penalty"])
-
-    if self.generation_config and self.generation_config.eos_token_id:
-        other_params["eos_token_id"] = self.generation_config.eos_token_id
-
-    if self.generation_config and self.generation_config.pad_token_id:
-        other_params["pad_token_id"] = self.generation_config.pad_token_id
-    
-    if self.generation_config and self.generation_config.bos_token_id:
-        other_params["bos_token_id"] = self.generation_config.bos_token_id
+    other_params = _generation_params(self,kwargs)
     
     start_time = time.monotonic()        
     response = self.generate(
@@ -155,10 +145,103 @@ def stream_chat(self,tokenizer,ins:str, his:List[Dict[str,str]]=[],
             "generated_tokens_count":len(new_tokens),
             "time_cost":time_taken,
             "first_token_time": -1.0,
-            "speed":float(generated_tokens_count)/time_taken*1000,
+            "speed":float(len(new_tokens))/time_taken*1000,
             "prob": -1.0
         }})] 
 
+def _generation_params(self,kwargs:Dict[str,Any])->Dict[str,Any]:
+    other_params = {}  
+    if "early_stopping" in kwargs:
+        other_params["early_stopping"] = bool(kwargs["early_stopping"])
+
+    if "repetition_penalty" in kwargs:
+        other_params["repetition_penalty"] = float(kwargs["repetition_penalty"])
+
+    if self.generation_config and self.generation_config.eos_token_id:
+        other_params["eos_token_id"] = self.generation_config.eos_token_id
+
+    if self.generation_config and self.generation_config.pad_token_id:
+        other_params["pad_token_id"] = self.generation_config.pad_token_id
+    
+    if self.generation_config and self.generation_config.bos_token_id:
+        other_params["bos_token_id"] = self.generation_config.bos_token_id
+    return other_params
+
+def batch_generate(self,tokenizer,requests:List[Dict[str,Any]]):
+    '''
+    generate the requests of a DynamicBatcher batch in one padded generate call.
+    All the requests share the same sampling parameters (the batch group).
+    '''
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    params = requests[0]["params"]
+    other_params = _generation_params(self,params)
+
+    eos_token_id = other_params.get("eos_token_id",tokenizer.eos_token_id)
+    eos_token_ids = set(eos_token_id if isinstance(eos_token_id,list) else [eos_token_id])
+    pad_token_id = other_params.get("pad_token_id",tokenizer.pad_token_id)
+    if pad_token_id is None:
+        pad_token_id = next(iter(eos_token_ids))
+    other_params["pad_token_id"] = pad_token_id
+
+    # left padding so the new tokens of all the rows start at the same position
+    input_length = max(len(request["input_ids"]) for request in requests)
+    input_ids = [[pad_token_id] * (input_length - len(request["input_ids"])) + request["input_ids"] for request in requests]
+    attention_mask = [[0] * (input_length - len(request["input_ids"])) + [1] * len(request["input_ids"]) for request in requests]
+    max_new_tokens = max(request["max_new_tokens"] for request in requests)
+
+    start_time = time.monotonic()
+    response = self.generate(
+        input_ids=torch.tensor(input_ids,device=device),
+        attention_mask=torch.tensor(attention_mask,device=device),
+        max_new_tokens=max_new_tokens,
+        temperature=params["temperature"],
+        top_p=params["top_p"],
+        max_time=float(params.get("timeout_s",60*5)),
+        **other_params
+    )
+    time_taken = time.monotonic() - start_time
+
+    results = []
+    for request,output in zip(requests,response):
+        new_tokens = output[input_length:][:request["max_new_tokens"]].tolist()
+        for i,token in enumerate(new_tokens):
+            if token in eos_token_ids:
+                new_tokens = new_tokens[:i]
+                break
+        answer = tokenizer.decode(new_tokens, skip_special_tokens=True)
+        results.append([(answer,{"metadata":{
+            "request_id":"",
+            "input_tokens_count": len(request["input_ids"]),
+            "generated_tokens_count":len(new_tokens),
+            "time_cost":time_taken,
+            "first_token_time": -1.0,
+            "speed":float(len(new_tokens))/time_taken*1000,
+            "prob": -1.0,
+            "batch_size":len(requests)
+        }})])
+    return results
+
+async def async_batch_stream_chat(self,tokenizer,ins:str, his:List[Dict[str,str]]=[],  
+        max_length:int=4090, 
+        top_p:float=0.95,
+        temperature:float=0.1,**kwargs):
+    '''
+    stream_chat with dynamic batching, set up by init_model when
+    `backend.dynamic_batching` is true. Message format models and requests with
+    stopping sequences are not batched.
+    '''
+    if self.get_meta()[0].get("message_format",False) or "stopping_sequences" in kwargs:
+        return await asyncfy_with_semaphore(lambda:self.stream_chat(tokenizer,ins,his,
+                                                                    max_length=max_length,top_p=top_p,temperature=temperature,**kwargs))()
+
+    input_ids = tokenizer(ins, return_token_type_ids=False)["input_ids"]
+    max_new_tokens = compute_max_new_tokens({"input_ids":torch.tensor([input_ids])}, min(max_length, getattr(self.config, "model_max_length", max_length)))
+    params = {"top_p":top_p,"temperature":temperature,**{k:kwargs[k] for k in ["early_stopping","repetition_penalty","timeout_s"] if k in kwargs}}
+    request = {"input_ids":input_ids,"max_new_tokens":max_new_tokens,"params":params}
+    return await self.dynamic_batcher.submit(request,
+                                             num_tokens=len(input_ids) + max_new_tokens,
+                                             group=tuple(sorted(params.items())))
+
 async def async_get_meta(model):     
      model:AsyncLLMEngine = model     
      config = await model.get_model_config()
@@ -174,7 +257,8 @@ async def async_get_meta(model):
               "support_stream": True,
               "support_chat_template": support_chat_template,
               "max_model_len":config.max_model_len,
-              "architectures":getattr(config.hf_config, "architectures", [])              
+              "architectures":getattr(config.hf_config, "architectures", []),
+              **(chat_template_meta(final_tokenizer) if support_chat_template else {})
               }     
      
      if not isinstance(model.engine,_AsyncLLMEngine): 
@@ -248,20 +332,27 @@ async def async_vllm_chat(model,tokenizer,ins:str, his:List[Tuple[str,str]]=[],
     current_time_milliseconds = int(time.time() * 1000)
         
     if stream:
-        server = ray.get_actor("VLLM_STREAM_SERVER")
+        server = model.stream_server_pool
         async def writer():
             results_generator = model.generate(ins, sampling_params,request_id) 
+            # only send the text generated since the previous step
+            pre_text_lens = {}
             async for request_output in results_generator:     
-                v = StreamOutputs(outputs=[SingleOutput(text=item.text,metadata=SingleOutputMeta(
-                    input_tokens_count=len(request_output.prompt_token_ids),
-                    generated_tokens_count=len(item.token_ids),
-                )) for item in request_output.outputs])         
+                outputs = []
+                for index,item in enumerate(request_output.outputs):
+                    pre_text_len = pre_text_lens.get(index,0)
+                    outputs.append(SingleOutput(text=item.text[pre_text_len:],metadata=SingleOutputMeta(
+                        input_tokens_count=len(request_output.prompt_token_ids),
+                        generated_tokens_count=len(item.token_ids),
+                    ),delta=True))
+                    pre_text_lens[index] = len(item.text)
+                v = StreamOutputs(outputs=outputs)         
                 await server.add_item.remote(request_output.request_id, v)
             # mark the request is done
             await server.mark_done.remote(request_output.request_id)
         asyncio.create_task(writer())
         await server.add_item.remote(request_id, "RUNNING")        
-        return [("",{"metadata":{"request_id":request_id,"stream_server":"VLLM_STREAM_SERVER"}})]
+        return [("",{"metadata":{"request_id":request_id,"stream_server":server.shard_name(request_id)}})]
         
     results_generator = model.generate(ins, sampling_params,request_id) 
     final_output = None
@@ -312,10 +403,8 @@ def init_model(model_dir,infer_params:Dict[str,str]={},sys_conf:Dict[str,str]={}
         global INFERENCE_NAME
         INFERENCE_NAME = infer_params.get("udfName","auto")        
 
-        try:
-            ray.get_actor("VLLM_STREAM_SERVER")
-        except ValueError:            
-            ray.remote(VLLMStreamServer).options(name="VLLM_STREAM_SERVER",lifetime="detached",max_concurrency=1000).remote()
+        stream_server_pool = StreamServerPool.create(VLLMStreamServer,"VLLM_STREAM_SERVER",
+                                                     num_shards=int(infer_params.get("stream_server_shards",1)))
                         
         worker_use_ray: bool = get_bool(infer_params,"backend.worker_use_ray",True)
         
@@ -334,6 +423,7 @@ def init_model(model_dir,infer_params:Dict[str,str]={},sys_conf:Dict[str,str]={}
                                                       "backend.engine_use_ray",                                                                                                                                                                 
                                                       "backend.gpu_memory_utilization",
                                                       "backend.disable_log_stats",
+                                                      "backend.predict_concurrency",
                                                       ]:
                 new_k = k[len("backend."):]
                 if k == "backend.max_model_len":
@@ -358,8 +448,11 @@ def init_model(model_dir,infer_params:Dict[str,str]={},sys_conf:Dict[str,str]={}
         llm = AsyncLLMEngine.from_engine_args(engine_args) 
         tokenizer = get_local_tokenizer(llm,engine_args)         
         llm.local_tokenizer = tokenizer             
+        llm.stream_server_pool = stream_server_pool
         llm.async_stream_chat = types.MethodType(async_vllm_chat, llm) 
         llm.async_get_meta = types.MethodType(async_get_meta,llm)
+        # vllm batches the concurrent requests itself
+        llm.predict_concurrency = get_int(infer_params,"backend.predict_concurrency",32)
         return (llm,tokenizer)  
 
     if  infer_mode == "ray/deepspeed":
@@ -452,6 +545,17 @@ def init_model(model_dir,infer_params:Dict[str,str]={},sys_conf:Dict[str,str]={}
 
     model.stream_chat = types.MethodType(stream_chat, model)
     model.get_meta = types.MethodType(get_meta, model)     
+
+    if get_bool(infer_params,"backend.dynamic_batching",False):
+        model.batch_generate = types.MethodType(batch_generate, model)
+        model.dynamic_batcher = DynamicBatcher(lambda requests: model.batch_generate(tokenizer,requests),
+                                               max_batch_size=get_int(infer_params,"backend.max_batch_size",8),
+                                               max_wait_ms=get_float(infer_params,"backend.max_batch_wait_ms",10.0),
+                                               max_batch_tokens=get_int(infer_params,"backend.max_batch_tokens",16384))
+        model.async_stream_chat = types.MethodType(async_batch_stream_chat, model)
+        model.predict_concurrency = get_int(infer_params,"backend.predict_concurrency",model.dynamic_batcher.max_batch_size)
+    else:
+        model.predict_concurrency = get_int(infer_params,"backend.predict_concurrency",1)
     return (model,tokenizer)
 
 
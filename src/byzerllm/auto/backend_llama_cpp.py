@@ -13,6 +13,7 @@ from llama_cpp import Llama
 import llama_cpp
 from byzerllm.utils.types import ( 
     BlockVLLMStreamServer,   
+    StreamServerPool,
     StreamOutputs,
     SingleOutput,
     SingleOutputMeta,    
@@ -96,13 +97,8 @@ class LlamaCppBackend:
             "support_stream": True,            
         }
 
-        try:
-            ray.get_actor("BLOCK_VLLM_STREAM_SERVER") 
-        except ValueError:  
-            try:          
-                ray.remote(BlockVLLMStreamServer).options(name="BLOCK_VLLM_STREAM_SERVER",lifetime="detached",max_concurrency=1000).remote()
-            except Exception as e:
-                pass
+        self.stream_server_shards = int(infer_params.get("stream_server_shards",1))
+        self.stream_server_pool = StreamServerPool.create(BlockVLLMStreamServer,"BLOCK_VLLM_STREAM_SERVER",num_shards=self.stream_server_shards)
 
 
     def get_meta(self):
@@ -157,12 +153,11 @@ class LlamaCppBackend:
 
         stream = kwargs.get("stream",False)
         
-        server = ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
+        server = self.stream_server_pool
         request_id = [None]
         
         def writer():
             try:
-                r = ""       
                 response = self.model.create_chat_completion_openai_v1(
                                     messages=messages,                                    
                                     stream=True, 
@@ -174,7 +169,6 @@ class LlamaCppBackend:
 
                 for chunk in response:                                                              
                     content = chunk.choices[0].delta.content or ""
-                    r += content        
                     if hasattr(chunk,"usage"):
                         input_tokens_count = chunk.usage.prompt_tokens
                         generated_tokens_count = chunk.usage.completion_tokens
@@ -182,10 +176,10 @@ class LlamaCppBackend:
                         input_tokens_count = 0
                         generated_tokens_count = 0
                     ray.get(server.add_item.remote(request_id[0], 
-                                                    StreamOutputs(outputs=[SingleOutput(text=r,metadata=SingleOutputMeta(
+                                                    StreamOutputs(outputs=[SingleOutput(text=content,metadata=SingleOutputMeta(
                                                         input_tokens_count=input_tokens_count,
                                                         generated_tokens_count=generated_tokens_count,
-                                                    ))])
+                                                    ),delta=True)])
                                                     ))                                                   
             except:
                 traceback.print_exc()            
@@ -206,7 +200,7 @@ class LlamaCppBackend:
                 return ray.get(server.add_item.remote(request_id[0], "RUNNING"))
                         
             await asyncio.to_thread(write_running)
-            return [("",{"metadata":{"request_id":request_id[0],"stream_server":"BLOCK_VLLM_STREAM_SERVER"}})]
+            return [("",{"metadata":{"request_id":request_id[0],"stream_server":server.shard_name(request_id[0])}})]
         else:
             try:
                 start_time = time.monotonic()
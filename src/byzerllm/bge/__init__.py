@@ -1,10 +1,16 @@
 from sentence_transformers import SentenceTransformer
 from typing import Dict,List,Tuple
+import numpy as np
 
 def _encode(self,texts: List[str],extract_params={}):        
-    embeddings = [emb.tolist() for emb in self.encode(texts,
-                                                      normalize_embeddings=extract_params.get("normalize_embeddings",True))]
-    return embeddings
+    embeddings = self.encode(texts,
+                             batch_size=int(extract_params.get("batch_size",32)),
+                             normalize_embeddings=extract_params.get("normalize_embeddings",True),
+                             convert_to_numpy=True)
+    if extract_params.get("embedding_format","list") == "ndarray":
+        # float32 matrix, sent back through the object store without converting to python floats
+        return embeddings.astype(np.float32,copy=False)
+    return [emb.tolist() for emb in embeddings]
     
 def embed_documents(self, texts: List[str],extract_params={}) -> List[List[float]]:        
     embeddings = self._encode(texts,extract_params)
@@ -1,7 +1,7 @@
 import time
 from typing import List, Tuple, Dict, Any, Union
 import ray
-from byzerllm.utils.types import BlockVLLMStreamServer, StreamOutputs, SingleOutput, SingleOutputMeta, BlockBinaryStreamServer
+from byzerllm.utils.types import StreamServerPool, BlockVLLMStreamServer, StreamOutputs, SingleOutput, SingleOutputMeta, BlockBinaryStreamServer
 import threading
 import asyncio
 import traceback
@@ -41,20 +41,9 @@ class CustomSaasAPI:
             "model_name": "azure_tts",
         }
 
-        try:
-            ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
-        except ValueError:
-            try:
-                ray.remote(BlockVLLMStreamServer).options(name="BLOCK_VLLM_STREAM_SERVER", lifetime="detached", max_concurrency=1000).remote()
-            except Exception as e:
-                pass
-        try:
-            ray.get_actor("BlockBinaryStreamServer")
-        except ValueError:
-            try:
-                ray.remote(BlockBinaryStreamServer).options(name="BlockBinaryStreamServer", lifetime="detached", max_concurrency=1000).remote()
-            except Exception as e:
-                pass
+        self.stream_server_shards = int(infer_params.get("stream_server_shards",1))
+        self.stream_server_pool = StreamServerPool.create(BlockVLLMStreamServer,"BLOCK_VLLM_STREAM_SERVER",num_shards=self.stream_server_shards)
+        self.binary_stream_server_pool = StreamServerPool.create(BlockBinaryStreamServer,"BlockBinaryStreamServer",num_shards=self.stream_server_shards)
 
     def get_meta(self):
         return [self.meta]
@@ -132,7 +121,7 @@ class CustomSaasAPI:
                 "speed": 0,
             }})]
         else:
-            server = ray.get_actor("BlockBinaryStreamServer")
+            server = self.binary_stream_server_pool
             
             def writer():
                 request_id[0] = str(uuid.uuid4())
@@ -177,7 +166,7 @@ class CustomSaasAPI:
                 return ray.get(server.add_item.remote(request_id[0], "RUNNING"))
 
             await asyncio.to_thread(write_running)
-            return [("", {"metadata": {"request_id": request_id[0], "stream_server": "BlockBinaryStreamServer"}})]
+            return [("", {"metadata": {"request_id": request_id[0], "stream_server": server.shard_name(request_id[0])}})]
             
 
     def speech_to_text(self, ins: str, **kwargs):
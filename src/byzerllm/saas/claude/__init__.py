@@ -7,7 +7,7 @@ from typing import List, Dict, Any, Union
 import ray
 from anthropic import Anthropic
 
-from byzerllm.utils.types import BlockVLLMStreamServer, StreamOutputs, SingleOutput, SingleOutputMeta
+from byzerllm.utils.types import StreamServerPool, BlockVLLMStreamServer, StreamOutputs, SingleOutput, SingleOutputMeta
 from byzerllm.utils.langutil import asyncfy_with_semaphore
 
 
@@ -27,14 +27,8 @@ class CustomSaasAPI:
 
         self.client = Anthropic(api_key=self.api_key,**other_params)
 
-        try:
-            ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
-        except ValueError:
-            try:
-                ray.remote(BlockVLLMStreamServer).options(name="BLOCK_VLLM_STREAM_SERVER", lifetime="detached",
-                                                        max_concurrency=1000).remote()
-            except:
-                pass    
+        self.stream_server_shards = int(infer_params.get("stream_server_shards",1))
+        self.stream_server_pool = StreamServerPool.create(BlockVLLMStreamServer,"BLOCK_VLLM_STREAM_SERVER",num_shards=self.stream_server_shards)
 
     # saas/proprietary
     def get_meta(self):
@@ -90,12 +84,11 @@ class CustomSaasAPI:
                 
 
         if stream:
-            server = ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
+            server = self.stream_server_pool
             request_id = [None]
 
             def writer():
                 input_tokens = 0
-                r = ""  
                 for response in res_data:                     
                     
                     if response.type == "message_start":     
@@ -104,23 +97,23 @@ class CustomSaasAPI:
 
                     if response.type == "content_block_delta":    
                         v = response.delta.text  
-                        r += v                  
-                        server.add_item.remote(request_id[0],
-                                                    StreamOutputs(outputs=[SingleOutput(text=r, metadata=SingleOutputMeta(
+                        # deltas must be applied in order, so wait for each write
+                        ray.get(server.add_item.remote(request_id[0],
+                                                    StreamOutputs(outputs=[SingleOutput(text=v, metadata=SingleOutputMeta(
                                                         input_tokens_count=0,
                                                         generated_tokens_count=0,
-                                                    ))])
-                                                    )
+                                                    ),delta=True)])
+                                                    ))
                     if response.type == "message_delta":
-                        server.add_item.remote(request_id[0],
-                                                    StreamOutputs(outputs=[SingleOutput(text=r, metadata=SingleOutputMeta(
+                        ray.get(server.add_item.remote(request_id[0],
+                                                    StreamOutputs(outputs=[SingleOutput(text="", metadata=SingleOutputMeta(
                                                         input_tokens_count=input_tokens,
                                                         generated_tokens_count=response.usage.output_tokens,
-                                                    ))])
-                                                    )
+                                                    ),delta=True)])
+                                                    ))
 
 
-                server.mark_done.remote(request_id[0])
+                ray.get(server.mark_done.remote(request_id[0]))
 
             threading.Thread(target=writer,daemon=True).start()            
 
@@ -136,7 +129,7 @@ class CustomSaasAPI:
                 return ray.get(server.add_item.remote(request_id[0], "RUNNING"))
 
             await asyncio.to_thread(write_running)
-            return [("", {"metadata": {"request_id": request_id[0], "stream_server": "BLOCK_VLLM_STREAM_SERVER"}})]
+            return [("", {"metadata": {"request_id": request_id[0], "stream_server": server.shard_name(request_id[0])}})]
 
         time_cost = time.monotonic() - start_time
 
@@ -5,7 +5,7 @@ import google.generativeai as genai
 from google.generativeai.types import content_types
 import time
 import ray
-from byzerllm.utils import BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta
+from byzerllm.utils import StreamServerPool,BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta
 import threading
 import asyncio
 from byzerllm.utils.langutil import asyncfy_with_semaphore
@@ -23,10 +23,8 @@ class CustomSaasAPI:
         genai.configure(api_key=self.api_key)
         self.client = genai.GenerativeModel(self.model)
                 
-        try:
-            ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
-        except ValueError:            
-            ray.remote(BlockVLLMStreamServer).options(name="BLOCK_VLLM_STREAM_SERVER",lifetime="detached",max_concurrency=1000).remote()     
+        self.stream_server_shards = int(infer_params.get("stream_server_shards",1))
+        self.stream_server_pool = StreamServerPool.create(BlockVLLMStreamServer,"BLOCK_VLLM_STREAM_SERVER",num_shards=self.stream_server_shards)
 
      # saas/proprietary
     def get_meta(self):
@@ -67,20 +65,19 @@ class CustomSaasAPI:
         res_data = await asyncfy_with_semaphore(lambda:self.client.generate_content(contents=new_messages,stream=stream))()
         
         if stream:            
-            server = ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
+            server = self.stream_server_pool
             request_id = [None]
            
             def writer(): 
-                r = ""
                 for response in res_data:                                        
                     v = response.text
-                    r += v
-                    request_id[0] = str(uuid.uuid4())                        
+                    if request_id[0] is None:
+                        request_id[0] = str(uuid.uuid4())                        
                     ray.get(server.add_item.remote(request_id[0], 
-                                                    StreamOutputs(outputs=[SingleOutput(text=r,metadata=SingleOutputMeta(
+                                                    StreamOutputs(outputs=[SingleOutput(text=v,metadata=SingleOutputMeta(
                                                         input_tokens_count=0,
                                                         generated_tokens_count=0,
-                                                    ))])
+                                                    ),delta=True)])
                                                     ))
                     
                 ray.get(server.mark_done.remote(request_id[0]))
@@ -99,7 +96,7 @@ class CustomSaasAPI:
                 return ray.get(server.add_item.remote(request_id[0], "RUNNING"))
                         
             await asyncio.to_thread(write_running)
-            return [("",{"metadata":{"request_id":request_id[0],"stream_server":"BLOCK_VLLM_STREAM_SERVER"}})]  
+            return [("",{"metadata":{"request_id":request_id[0],"stream_server":server.shard_name(request_id[0])}})]  
               
         time_cost = time.monotonic() - start_time
         
@@ -6,7 +6,7 @@ import base64
 import io    
 import json
 import ray
-from byzerllm.utils.types import BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta,BlockBinaryStreamServer
+from byzerllm.utils.types import StreamServerPool,BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta,BlockBinaryStreamServer
 from byzerllm.utils.langutil import asyncfy_with_semaphore
 import threading
 import asyncio
@@ -60,20 +60,9 @@ class CustomSaasAPI:
                 proxies=self.proxies,
                 transport=httpx.HTTPTransport(local_address=self.local_address)))         
     
-        try:
-            ray.get_actor("BLOCK_VLLM_STREAM_SERVER") 
-        except ValueError:  
-            try:          
-                ray.remote(BlockVLLMStreamServer).options(name="BLOCK_VLLM_STREAM_SERVER",lifetime="detached",max_concurrency=1000).remote()
-            except Exception as e:
-                pass    
-        try:
-            ray.get_actor("BlockBinaryStreamServer")    
-        except ValueError:  
-            try:          
-                ray.remote(BlockBinaryStreamServer).options(name="BlockBinaryStreamServer",lifetime="detached",max_concurrency=1000).remote()
-            except Exception as e:
-                pass        
+        self.stream_server_shards = int(infer_params.get("stream_server_shards",1))
+        self.stream_server_pool = StreamServerPool.create(BlockVLLMStreamServer,"BLOCK_VLLM_STREAM_SERVER",num_shards=self.stream_server_shards)
+        self.binary_stream_server_pool = StreamServerPool.create(BlockBinaryStreamServer,"BlockBinaryStreamServer",num_shards=self.stream_server_shards)
     
     # saas/proprietary
     def get_meta(self):
@@ -151,9 +140,23 @@ class CustomSaasAPI:
                 "input_tokens_count":usage.prompt_tokens,
                 "generated_tokens_count":0}})
     
+    def _embeddings_with_usage(self, resp):
+        usage = resp.usage
+        return ([item.embedding for item in resp.data],{"metadata":{
+                "input_tokens_count":usage.prompt_tokens,
+                "generated_tokens_count":0}})
+
+    async def async_embed_documents(self, texts: List[str], **kwargs):
+        resp = await asyncfy_with_semaphore(lambda:self.client.embeddings.create(input = texts, model=self.model))()
+        return self._embeddings_with_usage(resp)
+
+    def embed_documents(self, texts: List[str], **kwargs):
+        resp = self.client.embeddings.create(input = texts, model=self.model)
+        return self._embeddings_with_usage(resp)
+    
     async def async_text_to_speech(self,stream:bool, ins: str, voice:str,chunk_size:int=None,**kwargs):
         if stream:
-            server = ray.get_actor("BlockBinaryStreamServer")
+            server = self.binary_stream_server_pool
             request_id = [None]
             
             def writer():
@@ -191,7 +194,7 @@ class CustomSaasAPI:
                 return ray.get(server.add_item.remote(request_id[0], "RUNNING"))
                         
             await asyncio.to_thread(write_running)
-            return [("",{"metadata":{"request_id":request_id[0],"stream_server":"BlockBinaryStreamServer"}})]                   
+            return [("",{"metadata":{"request_id":request_id[0],"stream_server":server.shard_name(request_id[0])}})]                   
     
         start_time = time.monotonic()
         with io.BytesIO() as output:
@@ -284,12 +287,11 @@ class CustomSaasAPI:
             return await self.async_text_to_image(stream=stream,input=input,size=size,quality=quality,n=n)        
 
         
-        server = ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
+        server = self.stream_server_pool
         request_id = [None]
         
         def writer():
             try:
-                r = ""       
                 response = self.client.chat.completions.create(
                                     messages=messages,
                                     model=model,
@@ -305,7 +307,6 @@ class CustomSaasAPI:
 
                 for chunk in response:                                                              
                     content = chunk.choices[0].delta.content or ""
-                    r += content        
                     if hasattr(chunk,"usage") and chunk.usage:
                         input_tokens_count = chunk.usage.prompt_tokens
                         generated_tokens_count = chunk.usage.completion_tokens
@@ -313,10 +314,10 @@ class CustomSaasAPI:
                         input_tokens_count = 0
                         generated_tokens_count = 0
                     ray.get(server.add_item.remote(request_id[0], 
-                                                    StreamOutputs(outputs=[SingleOutput(text=r,metadata=SingleOutputMeta(
+                                                    StreamOutputs(outputs=[SingleOutput(text=content,metadata=SingleOutputMeta(
                                                         input_tokens_count=input_tokens_count,
                                                         generated_tokens_count=generated_tokens_count,
-                                                    ))])
+                                                    ),delta=True)])
                                                     ))                                                   
             except:
                 traceback.print_exc()            
@@ -337,7 +338,7 @@ class CustomSaasAPI:
                 return ray.get(server.add_item.remote(request_id[0], "RUNNING"))
                         
             await asyncio.to_thread(write_running)
-            return [("",{"metadata":{"request_id":request_id[0],"stream_server":"BLOCK_VLLM_STREAM_SERVER"}})]
+            return [("",{"metadata":{"request_id":request_id[0],"stream_server":server.shard_name(request_id[0])}})]
         else:
             try:
                 start_time = time.monotonic()
@@ -7,7 +7,7 @@ import ray
 
 from byzerllm.utils import random_uuid
 from byzerllm.log import init_logger
-from byzerllm.utils.types import BlockVLLMStreamServer, StreamOutputs, SingleOutput, SingleOutputMeta
+from byzerllm.utils.types import StreamServerPool, BlockVLLMStreamServer, StreamOutputs, SingleOutput, SingleOutputMeta
 from byzerllm.utils.langutil import asyncfy_with_semaphore
 
 logger = init_logger(__name__)
@@ -28,10 +28,8 @@ class CustomSaasAPI:
         # qianfan.SK(self.secret_key)
         self.model: str = infer_params.get("saas.model", "ERNIE-Bot-turbo")
         self.client = qianfan.ChatCompletion(ak=self.api_key, sk=self.secret_key, access_token=self.access_token)
-        try:
-            ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
-        except ValueError:            
-            ray.remote(BlockVLLMStreamServer).options(name="BLOCK_VLLM_STREAM_SERVER",lifetime="detached",max_concurrency=1000).remote() 
+        self.stream_server_shards = int(infer_params.get("stream_server_shards",1))
+        self.stream_server_pool = StreamServerPool.create(BlockVLLMStreamServer,"BLOCK_VLLM_STREAM_SERVER",num_shards=self.stream_server_shards)
 
      # saas/proprietary
     def get_meta(self):
@@ -99,7 +97,7 @@ class CustomSaasAPI:
         ))()
         
         if stream:
-            server = ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
+            server = self.stream_server_pool
             request_id = [None]
 
             def writer(): 
@@ -111,7 +109,7 @@ class CustomSaasAPI:
                                                        StreamOutputs(outputs=[SingleOutput(text=v,metadata=SingleOutputMeta(
                                                            input_tokens_count=response["usage"]["prompt_tokens"],
                                                            generated_tokens_count=response["usage"]["completion_tokens"],
-                                                       ))])
+                                                       ),delta=True)])
                                                        ))                                            
                 ray.get(server.mark_done.remote(request_id[0]))
 
@@ -129,7 +127,7 @@ class CustomSaasAPI:
                 return ray.get(server.add_item.remote(request_id[0], "RUNNING"))
                         
             await asyncio.to_thread(write_running)
-            return [("",{"metadata":{"request_id":request_id[0],"stream_server":"BLOCK_VLLM_STREAM_SERVER"}})] 
+            return [("",{"metadata":{"request_id":request_id[0],"stream_server":server.shard_name(request_id[0])}})] 
 
         time_cost = time.monotonic() - start_time
 
@@ -4,7 +4,7 @@ import dashscope
 from dashscope.api_entities.dashscope_response import Message
 import time
 import ray
-from byzerllm.utils.types import BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta
+from byzerllm.utils.types import StreamServerPool,BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta
 import threading
 import asyncio
 from byzerllm.utils.langutil import asyncfy_with_semaphore
@@ -21,13 +21,8 @@ class CustomSaasAPI:
         
         self.meta["embedding_mode"] = "embedding"  in  self.model.lower()
 
-        try:
-            ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
-        except ValueError: 
-            try:           
-                ray.remote(BlockVLLMStreamServer).options(name="BLOCK_VLLM_STREAM_SERVER",lifetime="detached",max_concurrency=1000).remote()     
-            except Exception:
-                pass
+        self.stream_server_shards = int(infer_params.get("stream_server_shards",1))
+        self.stream_server_pool = StreamServerPool.create(BlockVLLMStreamServer,"BLOCK_VLLM_STREAM_SERVER",num_shards=self.stream_server_shards)
 
      # saas/proprietary
     def get_meta(self):
@@ -89,6 +84,8 @@ class CustomSaasAPI:
             other_params["incremental_output"] = kwargs["incremental_output"]    
 
         stream = kwargs.get("stream",False)    
+        # with incremental_output dashscope only returns the new piece in every response
+        incremental_output = other_params.get("incremental_output",False) in [True,"true","True"]
         
         res_data = await asyncfy_with_semaphore(lambda:dashscope.Generation.call(model = self.model,
                                             messages=[Message(**message) for message in messages],
@@ -100,7 +97,7 @@ class CustomSaasAPI:
         
         if stream:
             
-            server = ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
+            server = self.stream_server_pool
             request_id = [None]
 
             def writer(): 
@@ -112,7 +109,7 @@ class CustomSaasAPI:
                                                        StreamOutputs(outputs=[SingleOutput(text=v,metadata=SingleOutputMeta(
                                                            input_tokens_count=response["usage"]["input_tokens"],
                                                            generated_tokens_count=response["usage"]["output_tokens"],
-                                                       ))])
+                                                       ),delta=incremental_output)])
                                                        ))
                         
                     else:
@@ -136,7 +133,7 @@ class CustomSaasAPI:
                 return ray.get(server.add_item.remote(request_id[0], "RUNNING"))
                         
             await asyncio.to_thread(write_running)
-            return [("",{"metadata":{"request_id":request_id[0],"stream_server":"BLOCK_VLLM_STREAM_SERVER"}})]  
+            return [("",{"metadata":{"request_id":request_id[0],"stream_server":server.shard_name(request_id[0])}})]  
               
         time_cost = time.monotonic() - start_time
         
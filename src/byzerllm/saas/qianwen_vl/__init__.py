@@ -4,7 +4,7 @@ import dashscope
 from dashscope.api_entities.dashscope_response import MultiModalConversationResponse
 import time
 import ray
-from byzerllm.utils.types import BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta
+from byzerllm.utils.types import StreamServerPool,BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta
 from byzerllm.utils.langutil import asyncfy_with_semaphore
 import threading
 import asyncio
@@ -23,10 +23,8 @@ class CustomSaasAPI:
             "support_stream": True
         }
         
-        try:
-            ray.get_actor("BLOCK_VLLM_STREAM_SERVER") 
-        except ValueError:            
-            ray.remote(BlockVLLMStreamServer).options(name="BLOCK_VLLM_STREAM_SERVER",lifetime="detached",max_concurrency=1000).remote()
+        self.stream_server_shards = int(infer_params.get("stream_server_shards",1))
+        self.stream_server_pool = StreamServerPool.create(BlockVLLMStreamServer,"BLOCK_VLLM_STREAM_SERVER",num_shards=self.stream_server_shards)
 
      # saas/proprietary
     def get_meta(self):
@@ -72,7 +70,7 @@ class CustomSaasAPI:
                                             **other_params))()
         
         if stream:            
-            server = ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
+            server = self.stream_server_pool
             request_id = [None]
 
             def writer(): 
@@ -108,7 +106,7 @@ class CustomSaasAPI:
                 return ray.get(server.add_item.remote(request_id[0], "RUNNING"))
                         
             await asyncio.to_thread(write_running)
-            return [("",{"metadata":{"request_id":request_id[0],"stream_server":"BLOCK_VLLM_STREAM_SERVER"}})]
+            return [("",{"metadata":{"request_id":request_id[0],"stream_server":server.shard_name(request_id[0])}})]
               
         time_cost = time.monotonic() - start_time
         
@@ -5,7 +5,7 @@ import base64
 import io    
 import json
 import ray
-from byzerllm.utils.types import BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta,BlockBinaryStreamServer
+from byzerllm.utils.types import StreamServerPool,BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta,BlockBinaryStreamServer
 from byzerllm.utils.langutil import asyncfy_with_semaphore
 import threading
 import asyncio
@@ -35,20 +35,9 @@ class CustomSaasAPI:
             "model_name": self.model,
         }
 
-        try:
-            ray.get_actor("BLOCK_VLLM_STREAM_SERVER") 
-        except ValueError:  
-            try:          
-                ray.remote(BlockVLLMStreamServer).options(name="BLOCK_VLLM_STREAM_SERVER",lifetime="detached",max_concurrency=1000).remote()
-            except Exception as e:
-                pass    
-        try:
-            ray.get_actor("BlockBinaryStreamServer")    
-        except ValueError:  
-            try:          
-                ray.remote(BlockBinaryStreamServer).options(name="BlockBinaryStreamServer",lifetime="detached",max_concurrency=1000).remote()
-            except Exception as e:
-                pass        
+        self.stream_server_shards = int(infer_params.get("stream_server_shards",1))
+        self.stream_server_pool = StreamServerPool.create(BlockVLLMStreamServer,"BLOCK_VLLM_STREAM_SERVER",num_shards=self.stream_server_shards)
+        self.binary_stream_server_pool = StreamServerPool.create(BlockBinaryStreamServer,"BlockBinaryStreamServer",num_shards=self.stream_server_shards)
     
     # saas/proprietary
     def get_meta(self):
@@ -120,7 +109,7 @@ class CustomSaasAPI:
                     }
         request_id = [None]
         if stream:
-            server = ray.get_actor("BlockBinaryStreamServer")            
+            server = self.binary_stream_server_pool            
                         
             def writer():
                 request_id[0] = str(uuid.uuid4())
@@ -156,7 +145,7 @@ class CustomSaasAPI:
                 return ray.get(server.add_item.remote(request_id[0], "RUNNING"))
                         
             await asyncio.to_thread(write_running)
-            return [("",{"metadata":{"request_id":request_id[0],"stream_server":"BlockBinaryStreamServer"}})]                   
+            return [("",{"metadata":{"request_id":request_id[0],"stream_server":server.shard_name(request_id[0])}})]                   
     
         start_time = time.monotonic()     
         request_id[0] = str(uuid.uuid4())
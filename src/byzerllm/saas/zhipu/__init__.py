@@ -2,7 +2,7 @@ from zhipuai import ZhipuAI
 import time
 from typing import List, Tuple, Dict,Any
 import ray
-from byzerllm.utils.types import BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta
+from byzerllm.utils.types import StreamServerPool,BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta
 from byzerllm.utils.langutil import asyncfy_with_semaphore
 import threading
 import asyncio
@@ -25,10 +25,8 @@ class CustomSaasAPI:
             self.meta["embedding_mode"] = False 
         else:            
             self.meta["embedding_mode"] = True       
-        try:
-            ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
-        except ValueError:            
-            ray.remote(BlockVLLMStreamServer).options(name="BLOCK_VLLM_STREAM_SERVER",lifetime="detached",max_concurrency=1000).remote()            
+        self.stream_server_shards = int(infer_params.get("stream_server_shards",1))
+        self.stream_server_pool = StreamServerPool.create(BlockVLLMStreamServer,"BLOCK_VLLM_STREAM_SERVER",num_shards=self.stream_server_shards)
 
     # saas/proprietary
     def get_meta(self):
@@ -75,20 +73,18 @@ class CustomSaasAPI:
                             messages=messages,**other_params))()
         
         if stream:            
-            server = ray.get_actor("BLOCK_VLLM_STREAM_SERVER")
+            server = self.stream_server_pool
             request_id = [None]
 
             def writer(): 
-                r = ""
                 for response in res_data:                                        
                     v = response.choices[0].delta.content
-                    r += v
                     request_id[0] = f"zhipu_{response.id}"
                     ray.get(server.add_item.remote(request_id[0], 
-                                                    StreamOutputs(outputs=[SingleOutput(text=r,metadata=SingleOutputMeta(
+                                                    StreamOutputs(outputs=[SingleOutput(text=v,metadata=SingleOutputMeta(
                                                         input_tokens_count= -1,
                                                         generated_tokens_count= -1,
-                                                    ))])
+                                                    ),delta=True)])
                                                     ))
                 ray.get(server.mark_done.remote(request_id[0]))
 
@@ -106,7 +102,7 @@ class CustomSaasAPI:
                 return ray.get(server.add_item.remote(request_id[0], "RUNNING"))
                         
             await asyncio.to_thread(write_running)
-            return [("",{"metadata":{"request_id":request_id[0],"stream_server":"BLOCK_VLLM_STREAM_SERVER"}})] 
+            return [("",{"metadata":{"request_id":request_id[0],"stream_server":server.shard_name(request_id[0])}})] 
       
         time_cost = time.monotonic() - start_time
         generated_text = res_data.choices[0].message.content        
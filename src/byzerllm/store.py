@@ -1,68 +1,300 @@
-import asyncio
 import ray
 import time
 import os
+import io
+import json
+import queue
+import re
+import shutil
+import hashlib
 import tarfile
-import tempfile
+import threading
 import uuid
+from typing import Any, Dict, Iterator, List, Optional
 from .utils import print_flush
 
-async def producer(items,udf_name, queue):    
-    for item in items:        
-        await queue.put(ray.get(item))
-    await queue.put(None)
+MANIFEST_FILE = ".byzerllm_model_manifest.json"
+HASH_BLOCK_SIZE = 1024 * 1024
 
-async def worker(queue,udf_name,tf_path,total_count):
-    count = 0
-    with open(tf_path, "wb") as tf:
-        while True:
-            item = await queue.get()
-            if item is None:
-                # Signal to exit when queue is empty
-                break
-            tf.write(item["value"]) 
-            if count % 1000 == 0:
-                print_flush(f"MODEL[{udf_name}] UDFWorker pull model: {float(count)/total_count*100}%")
-            count += 1  
-
-async def _transfer_from_ob(udf_name, model_refs,target_dir):
-    queue = asyncio.Queue(1000)
-    
-    tf_path = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()))      
-
-    worker_task = asyncio.create_task(worker(queue,udf_name,tf_path,len(model_refs)))
-    producer_task = asyncio.create_task(producer(model_refs, udf_name,queue))    
-    
-    await asyncio.gather(producer_task,worker_task)
-    
-    with open(tf_path, "rb") as tf:
-        tt = tarfile.open(tf.name, mode="r:")
-        tt.extractall(target_dir)
-        tt.close()
-    os.remove(tf_path)
-
-def block_transfer_from_ob(udf_name, model_refs,target_dir):
-    tf_path = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()))  
-    count = 0
+
+def iter_chunks(udf_name:str, model_refs:List[Any], batch_size:int=64, prefetch:int=4)->Iterator[bytes]:
+    '''
+    yields the chunks of the model tar stream in order. The next `prefetch`
+    batches are asked to be pulled to the local object store with ray.wait
+    (fetch_local, no blocking) while the current batch is consumed.
+    '''
     total_count = len(model_refs)
-    with open(tf_path, "wb") as tf:
-        for item_ref in model_refs:
-            item = ray.get(item_ref)            
-            tf.write(item["value"]) 
+    batches = [model_refs[i:i+batch_size] for i in range(0,total_count,batch_size)]
+    count = 0
+    for i,batch in enumerate(batches):
+        for next_batch in batches[i+1:i+1+prefetch]:
+            ray.wait(next_batch,num_returns=len(next_batch),timeout=0,fetch_local=True)
+        for item in ray.get(batch):
             if count % 1000 == 0:
                 print_flush(f"MODEL[{udf_name}] UDFWorker pull model: {float(count)/total_count*100}%")
-            count += 1  
-    with open(tf_path, "rb") as tf:
-        tt = tarfile.open(tf.name, mode="r:")
-        tt.extractall(target_dir)
-        tt.close()
-    os.remove(tf_path)        
+            count += 1
+            yield item["value"]
+
+
+class ChunkStream(io.RawIOBase):
+    '''
+    a readable file object over the chunks fetched by a background thread, so
+    pulling the chunks overlaps with the extraction. It keeps the sha256 of the
+    whole stream.
+    '''
+    def __init__(self, chunks:Iterator[bytes], max_pending:int=256):
+        self.queue = queue.Queue(max_pending)
+        self.buffer = b""
+        self.error = None
+        self.sha256 = hashlib.sha256()
+        self.finished = False
+        # set by close, so the fetch thread never stays blocked on a full queue
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._fetch,args=(chunks,),daemon=True)
+        self.thread.start()
+
+    def _put(self, item)->bool:
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item,timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fetch(self, chunks:Iterator[bytes]):
+        try:
+            for chunk in chunks:
+                if not self._put(chunk):
+                    return
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(None)
+
+    def close(self):
+        # the consumer stopped (e.g. the extraction failed), let the fetch thread go
+        self.stopped.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.thread.join()
+        super().close()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b)->int:
+        while not self.buffer and not self.finished:
+            chunk = self.queue.get()
+            if chunk is None:
+                self.finished = True
+                if self.error is not None:
+                    raise self.error
+                break
+            self.sha256.update(chunk)
+            self.buffer = chunk
+        n = min(len(b),len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+    def drain(self):
+        # the tar end-of-archive padding may be left unread
+        while self.read(HASH_BLOCK_SIZE):
+            pass
+
+
+def _safe_path(target_dir:str, name:str)->str:
+    path = os.path.realpath(os.path.join(target_dir,name))
+    if os.path.commonpath([path,os.path.realpath(target_dir)]) != os.path.realpath(target_dir):
+        raise Exception(f"illegal path {name} in the model tar")
+    return path
+
+
+def extract_stream(stream:io.RawIOBase, target_dir:str)->Dict[str,Dict[str,Any]]:
+    '''
+    extracts the tar stream into target_dir without an intermediate tar file,
+    returns the size and sha256 of every extracted file and the target of every
+    symlink. Hard links (and symlinks) must point inside target_dir, the file
+    modes are restored, the directory ones once their content is written.
+    '''
+    files = {}
+    dirs = []
+    os.makedirs(target_dir,exist_ok=True)
+    with tarfile.open(fileobj=io.BufferedReader(stream,buffer_size=HASH_BLOCK_SIZE),mode="r|") as tar:
+        for member in tar:
+            path = _safe_path(target_dir,member.name)
+            name = os.path.relpath(path,target_dir)
+            if member.isdir():
+                os.makedirs(path,exist_ok=True)
+                dirs.append((path,member.mode))
+                continue
+            if not (member.isfile() or member.issym() or member.islnk()):
+                continue
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+            if member.issym():
+                # HF snapshots link the files to the blobs with relative paths
+                _safe_path(target_dir,os.path.join(os.path.dirname(member.name),member.linkname))
+                os.symlink(member.linkname,path)
+                files[name] = {"symlink":member.linkname}
+                continue
+            if member.islnk():
+                source_path = _safe_path(target_dir,member.linkname)
+                os.link(source_path,path)
+                source_name = os.path.relpath(source_path,target_dir)
+                files[name] = files[source_name] if source_name in files else \
+                    {"size":os.path.getsize(source_path),"sha256":_file_sha256(source_path)}
+                continue
+            sha256 = hashlib.sha256()
+            source = tar.extractfile(member)
+            with open(path,"wb") as f:
+                while True:
+                    block = source.read(HASH_BLOCK_SIZE)
+                    if not block:
+                        break
+                    sha256.update(block)
+                    f.write(block)
+            os.chmod(path,member.mode)
+            files[name] = {"size":member.size,"sha256":sha256.hexdigest()}
+    stream.drain()
+    for path,mode in reversed(dirs):
+        os.chmod(path,mode)
+    return files
+
+
+def block_transfer_from_ob(udf_name, model_refs,target_dir,batch_size:int=64,prefetch:int=4):
+    stream = ChunkStream(iter_chunks(udf_name,model_refs,batch_size=batch_size,prefetch=prefetch))
+    try:
+        files = extract_stream(stream,target_dir)
+        return files, stream.sha256.hexdigest()
+    finally:
+        stream.close()
+
+
+def _fingerprint(model_refs:List[Any])->Dict[str,Any]:
+    # the first chunk holds the tar header (name,size,mtime) of the first file,
+    # together with the number and the last chunk it tells whether the model changed
+    first,last = ray.get([model_refs[0],model_refs[-1]])
+    return {"num_chunks":len(model_refs),
+            "first_chunk":hashlib.sha256(first["value"]).hexdigest(),
+            "last_chunk":hashlib.sha256(last["value"]).hexdigest()}
+
+
+def _file_sha256(path:str)->str:
+    sha256 = hashlib.sha256()
+    with open(path,"rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def verify_model_cache(cache_path:str, fingerprint:Dict[str,Any], verify:str="sha256")->bool:
+    '''
+    verify is "sha256" (re-hash every file) or "size" (only compare the sizes)
+    '''
+    manifest_path = os.path.join(cache_path,MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path,"r") as f:
+        manifest = json.load(f)
+    if manifest.get("fingerprint") != fingerprint:
+        return False
+    for name,info in manifest["files"].items():
+        path = os.path.join(cache_path,name)
+        if "symlink" in info:
+            if not os.path.islink(path) or os.readlink(path) != info["symlink"]:
+                return False
+            continue
+        if not os.path.isfile(path) or os.path.getsize(path) != info["size"]:
+            return False
+        if verify == "sha256" and _file_sha256(path) != info["sha256"]:
+            return False
+    return True
+
+
+def _remove_old_versions(cache_dir:str, cache_key:str, keep_versions:int):
+    # the unfinished transfers (the lock is held, so nobody is writing them) and all
+    # but the newest keep_versions versions, the older ones are long out of use
+    prefix = f"{cache_key}@"
+    versions = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir,name)
+        if not name.startswith(prefix) or not os.path.isdir(path) or os.path.islink(path):
+            continue
+        if name.endswith(".tmp"):
+            shutil.rmtree(path,ignore_errors=True)
+        else:
+            versions.append(path)
+    versions.sort(key=os.path.getmtime,reverse=True)
+    for path in versions[keep_versions:]:
+        shutil.rmtree(path,ignore_errors=True)
+
+
+def cached_transfer_from_ob(udf_name:str, model_refs:List[Any], model_dir:str,
+                            cache_dir:str, cache_key:str, cache_version:str,
+                            verify:str="sha256", keep_versions:int=2):
+    '''
+    keeps the extracted model in cache_dir/cache_key@cache_version with a manifest
+    of the file checksums and links model_dir to it. A worker restarted on the same
+    node finds the verified model in the cache and skips the transfer. The workers
+    of a node share the cache with a file lock, so only one of them transfers.
+
+    cache_version is given by the deployer and must change whenever the model does:
+    the checksums only tell the cached files are intact, not that they are the files
+    of the deployed model (retrained weights have the same size). A cheap fingerprint
+    of the chunks (the number, the first and the last one) catches a version reused
+    for a different model layout. A new version goes to a new directory, so the
+    workers still linked to the previous one keep their files. Only the newest
+    keep_versions versions of a cache_key are kept.
+    '''
+    import fcntl
+    os.makedirs(cache_dir,exist_ok=True)
+    fingerprint = _fingerprint(model_refs)
+    cache_path = os.path.join(cache_dir,f"{cache_key}@{re.sub(r'[^A-Za-z0-9._-]','_',cache_version)}")
+
+    with open(os.path.join(cache_dir,f"{cache_key}.lock"),"w") as lock:
+        fcntl.flock(lock,fcntl.LOCK_EX)
+        if verify_model_cache(cache_path,fingerprint,verify):
+            print_flush(f"MODEL[{udf_name}] UDFWorker use the cached model in {cache_path}")
+        else:
+            tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+            try:
+                files,stream_sha256 = block_transfer_from_ob(udf_name,model_refs,tmp_path)
+                with open(os.path.join(tmp_path,MANIFEST_FILE),"w") as f:
+                    json.dump({"fingerprint":fingerprint,"stream_sha256":stream_sha256,"files":files},f)
+                if os.path.exists(cache_path):
+                    # a broken copy of this version, workers may still use it so it is
+                    # only moved aside and removed with the old versions
+                    os.rename(cache_path,f"{cache_path}-{uuid.uuid4().hex[:8]}")
+                os.rename(tmp_path,cache_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    shutil.rmtree(tmp_path,ignore_errors=True)
+        # the new version is the newest one
+        os.utime(cache_path)
+        _remove_old_versions(cache_dir,cache_key,keep_versions)
+
+    if os.path.abspath(model_dir) != os.path.abspath(cache_path):
+        if os.path.islink(model_dir):
+            os.remove(model_dir)
+        os.makedirs(os.path.dirname(os.path.abspath(model_dir)),exist_ok=True)
+        os.symlink(cache_path,model_dir)
 
 
-def transfer_from_ob(udf_name,model_refs,model_dir):
+def transfer_from_ob(udf_name,model_refs,model_dir,cache_dir:Optional[str]=None,cache_key:Optional[str]=None,
+                     verify:str="sha256",cache_version:Optional[str]=None):
     print_flush(f"[{udf_name}] model_refs:{len(model_refs)} model_dir:{model_dir}")
     time1 = time.time()
-    # loop = asyncio.get_event_loop()
-    # loop.run_until_complete(_transfer_from_ob(udf_name,model_refs,model_dir))            
-    block_transfer_from_ob(udf_name,model_refs,model_dir)
+    if cache_dir and not cache_version:
+        print_flush(f"[{udf_name}] no model cache version is given, skip the model cache in {cache_dir}")
+    if cache_dir and cache_version:
+        cached_transfer_from_ob(udf_name,model_refs,model_dir,cache_dir,cache_key or udf_name,cache_version,verify=verify)
+    else:
+        block_transfer_from_ob(udf_name,model_refs,model_dir)
     print_flush(f"[{udf_name}] UDFWorker pull model from object store cost {time.time() - time1} seconds")
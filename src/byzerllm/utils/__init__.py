@@ -7,12 +7,13 @@ import hashlib
 from typing import TYPE_CHECKING,TypeVar,Dict, List, Optional, Union,Any,Tuple,get_type_hints,Annotated,get_args,Callable
 import typing
 import inspect
+import weakref
 import pydantic
 import sys
 import traceback
 import io
 from enum import Enum
-from byzerllm.utils.types import BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta,BlockBinaryStreamServer
+from byzerllm.utils.types import BlockVLLMStreamServer,StreamOutputs,SingleOutput,SingleOutputMeta,BlockBinaryStreamServer,VLLMStreamServer,StreamServerPool
 
 T = TypeVar("T")
 
@@ -847,31 +848,66 @@ JSON Schema：
 '''
     return msg  
 
-def format_prompt(func,**kargs): 
-    from langchain import PromptTemplate
-    doc = func.__doc__       
+# func -> its signature / {render: (func.__doc__, compiled template)}, weak so the
+# prompt functions created on the fly do not stay alive in the cache
+_signature_cache = weakref.WeakKeyDictionary()
+_template_cache = weakref.WeakKeyDictionary()
+
+def get_signature(func)->inspect.Signature:
+    try:
+        signature = _signature_cache.get(func,None)
+    except TypeError:
+        # not weak referenceable
+        return inspect.signature(func)
+    if signature is None:
+        signature = inspect.signature(func)
+        _signature_cache[func] = signature
+    return signature
+
+def _dedent_doc(doc:str)->str:
     lines = doc.splitlines()
     # get the first line to get the whitespace prefix
     first_non_empty_line = next(line for line in lines if line.strip())
     prefix_whitespace_length = len(first_non_empty_line) - len(first_non_empty_line.lstrip())    
-    prompt = "\n".join([line[prefix_whitespace_length:] for line in lines])
-    tpl = PromptTemplate.from_template(prompt)
+    return "\n".join([line[prefix_whitespace_length:] for line in lines])
+
+def _compile_template(prompt:str,render:str):
+    if render == "jinja2":
+        from jinja2 import Template
+        return Template(prompt)
+    from langchain import PromptTemplate
+    return PromptTemplate.from_template(prompt)
+
+def get_prompt_template(func,render:str="jinja2"):
+    '''
+    the compiled template of the docstring of func, cached per function and render.
+    The entry is rebuilt when func.__doc__ is replaced.
+    '''
+    doc = func.__doc__
+    try:
+        templates = _template_cache.get(func,None)
+    except TypeError:
+        return _compile_template(_dedent_doc(doc),render)
+    if templates is None:
+        templates = {}
+        _template_cache[func] = templates
+    entry = templates.get(render,None)
+    if entry is None or entry[0] is not doc:
+        entry = (doc,_compile_template(_dedent_doc(doc),render))
+        templates[render] = entry
+    return entry[1]
+
+def format_prompt(func,**kargs): 
+    tpl = get_prompt_template(func,"langchain")
     return tpl.format(**kargs)
 
 def format_prompt_jinja2(func,**kargs):
-    from jinja2 import Template
-    doc = func.__doc__       
-    lines = doc.splitlines()
-    # get the first line to get the whitespace prefix
-    first_non_empty_line = next(line for line in lines if line.strip())
-    prefix_whitespace_length = len(first_non_empty_line) - len(first_non_empty_line.lstrip())    
-    prompt = "\n".join([line[prefix_whitespace_length:] for line in lines])
-    tpl = Template(prompt)
+    tpl = get_prompt_template(func,"jinja2")
     return tpl.render(kargs)
 
 def random_uuid() -> str:
     return str(uuid.uuid4().hex)
 
 
-__all__ = ["BlockVLLMStreamServer","StreamOutputs","SingleOutput","SingleOutputMeta","BlockBinaryStreamServer"]
+__all__ = ["BlockVLLMStreamServer","StreamOutputs","SingleOutput","SingleOutputMeta","BlockBinaryStreamServer","VLLMStreamServer","StreamServerPool"]
 
@@ -0,0 +1,47 @@
+import json
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List
+
+
+def chat_template_meta(tokenizer) -> Dict[str, Any]:
+    '''
+    the chat template of the tokenizer and the special tokens it refers to, put
+    in the model meta so the clients can render the prompt themselves.
+    '''
+    chat_template = getattr(tokenizer, "chat_template", None)
+    if not isinstance(chat_template, str):
+        return {}
+    special_tokens = {k: v for k, v in getattr(tokenizer, "special_tokens_map", {}).items() if isinstance(v, str)}
+    return {"chat_template": chat_template, "chat_template_special_tokens": special_tokens}
+
+
+@lru_cache(maxsize=32)
+def _compile_chat_template(chat_template: str):
+    # the same environment as transformers' apply_chat_template
+    import jinja2
+    import jinja2.ext
+    from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+    def raise_exception(message):
+        raise jinja2.exceptions.TemplateError(message)
+
+    def tojson(x, ensure_ascii=False, indent=None, separators=None, sort_keys=False):
+        return json.dumps(x, ensure_ascii=ensure_ascii, indent=indent, separators=separators, sort_keys=sort_keys)
+
+    def strftime_now(format):
+        return datetime.now().strftime(format)
+
+    env = ImmutableSandboxedEnvironment(trim_blocks=True, lstrip_blocks=True, extensions=[jinja2.ext.loopcontrols])
+    env.filters["tojson"] = tojson
+    env.globals["raise_exception"] = raise_exception
+    env.globals["strftime_now"] = strftime_now
+    return env.from_string(chat_template)
+
+
+def render_chat_template(chat_template: str, messages: List[Dict[str, Any]],
+                         special_tokens: Dict[str, str] = {},
+                         add_generation_prompt: bool = True) -> str:
+    template = _compile_chat_template(chat_template)
+    return template.render(messages=messages, tools=None, documents=None,
+                           add_generation_prompt=add_generation_prompt, **special_tokens)
@@ -16,11 +16,17 @@ from byzerllm.utils import (function_calling_format,
                             sys_function_impl_format,
                             exec_capture_output,
                             format_prompt,
-                            format_prompt_jinja2
+                            format_prompt_jinja2,
+                            get_signature
                             )
 from byzerllm.utils.ray_utils import cancel_placement_group,get_actor_info
-from byzerllm.utils.json_repaire import repair_json_str
+from byzerllm.utils.json_repaire import extract_json
+from byzerllm.utils.client.token_counter import TokenCounter
+from byzerllm.utils.client.worker_lease import WorkerLease, NoLiveWorkerError
+from byzerllm.utils.client.meta_registry import meta_registry
+from byzerllm.utils.chat_template import render_chat_template
 import json
+import numpy as np
 import dataclasses
 import importlib  
 import logging
@@ -63,6 +69,7 @@ class ByzerLLM:
             self.force_skip_context_length_check = kwargs["force_skip_context_length_check"]
 
         self.mapping_auto_use_apply_chat_template = {}
+        self.mapping_local_chat_template = {}
         
         self.mapping_max_input_length = {}
         self.mapping_max_output_length = {}
@@ -84,7 +91,12 @@ class ByzerLLM:
 
         
         self.func_impl_cache = {}
-        self.meta_cache = {}
+        # shared by all the instances of the process, see setup_global_meta_cache
+        self.meta_cache = meta_registry
+        self.mapping_token_counter = {}
+        self.udf_master_cache = {}
+        self.stream_server_cache = {}
+        self.mapping_worker_lease = {}
 
         self.byzer_engine_url = None
         if "byzer_engine_url" in kwargs:
@@ -162,6 +174,58 @@ class ByzerLLM:
         self.pin_model_worker_mapping = pin_model_worker_mapping
         return self   
 
+    def setup_global_meta_cache(self,ttl:float=300,use_ray_actor:bool=False)->'ByzerLLM':
+        '''
+        the model meta is cached for the whole process, so this configures the cache
+        of all the ByzerLLM instances: the meta fetched from now on is kept for ttl
+        seconds. With use_ray_actor it is also shared with the other processes of
+        the ray cluster through a named actor.
+        '''
+        self.meta_cache.setup(ttl=ttl,use_ray_actor=use_ray_actor)
+        return self
+
+    def setup_worker_lease(self,model:str,num_workers:int=1,max_inflight:int=8)->'ByzerLLM':
+        '''
+        borrow num_workers workers of the model from its UDFMaster and keep them,
+        so _query sends the requests to the leased workers directly without a
+        round trip to the master. Every leased worker takes up to max_inflight
+        concurrent requests. The workers are not available to other clients
+        until release_worker_lease is called.
+        '''
+        self.release_worker_lease(model)
+        self.mapping_worker_lease[model] = WorkerLease.create(self._get_udf_master(model),
+                                                              num_workers=num_workers,
+                                                              max_inflight=max_inflight)
+        return self
+
+    def release_worker_lease(self,model:str)->'ByzerLLM':
+        lease = self.mapping_worker_lease.pop(model,None)
+        if lease is not None:
+            lease.close()
+        return self
+
+    def _get_udf_master(self,model:str):
+        if model not in self.udf_master_cache:
+            self.udf_master_cache[model] = ray.get_actor(model)
+        return self.udf_master_cache[model]
+
+    def _get_stream_server(self,name:str):
+        # stream servers are detached actors living as long as the cluster
+        if name not in self.stream_server_cache:
+            self.stream_server_cache[name] = ray.get_actor(name)
+        return self.stream_server_cache[name]
+
+    def _drop_worker_lease(self,model:str,lease:WorkerLease):
+        if self.mapping_worker_lease.get(model,None) is lease:
+            self.mapping_worker_lease.pop(model,None)
+        lease.close()
+
+    def _invalidate_udf_master(self,model:str):
+        self.udf_master_cache.pop(model,None)
+        lease = self.mapping_worker_lease.pop(model,None)
+        if lease is not None:
+            lease.close()
+
     def setup_load_balance_way(self,load_balance_way:str)->'ByzerLLM':
         self.sys_conf["load_balance"] = load_balance_way
         return self 
@@ -262,10 +326,59 @@ class ByzerLLM:
         self.mapping_max_output_length[model] = max_output_length
         return self
     
+    def setup_local_tokenizer(self,model:str,tokenizer:Union[str,Any],**kwargs)->'ByzerLLM':
+        '''
+        count the tokens for the context length check locally instead of sending
+        a tokenize request to the model. tokenizer can be a tokenizer object or the
+        local path of the model. kwargs are passed to TokenCounter.
+        '''
+        self.mapping_token_counter[model] = TokenCounter.from_tokenizer(tokenizer,**kwargs)
+        return self
+
+    def get_token_counter(self,model:str)->Optional[TokenCounter]:
+        '''
+        return None when the model does not provide the tokenizer service
+        '''
+        if model in self.mapping_token_counter:
+            return self.mapping_token_counter[model]
+
+        # the worker adds the special tokens to every text, they are left out like a local
+        # tokenizer does (add_special_tokens=False), so each block does not count them again.
+        # How many there are is learned from an empty text sent along with the first request.
+        special_tokens = []
+
+        def count_input(texts:List[str]):
+            default_config = self.mapping_extra_generation_params.get(model,{})
+            texts = texts if special_tokens else texts + [""]
+            return [{"instruction":s,"tokenizer":True, **default_config} for s in texts]
+
+        def to_counts(texts:List[str],res)->List[int]:
+            counts = [len(item["predict"][0]) for item in res]
+            if len(counts) > len(texts):
+                special_tokens[:] = [counts.pop()]
+            return [max(0,v - special_tokens[0]) for v in counts]
+
+        def count_func(texts:List[str])->List[int]:
+            return to_counts(texts,self._query(model,count_input(texts)))
+
+        async def acount_func(texts:List[str])->List[int]:
+            return to_counts(texts,await self._aquery(model,count_input(texts)))
+
+        self.mapping_token_counter[model] = TokenCounter(count_func,acount_func=acount_func)
+        return self.mapping_token_counter[model]
+
     def setup_role_mapping(self,model:str,role_mapping:Dict[str,str])->'ByzerLLM':
         self.mapping_role_mapping[model] = role_mapping
         return self
     
+    def setup_local_chat_template(self,model:str,enable:bool=True)->'ByzerLLM':
+        '''
+        whether the chat template of the model (template "auto") is rendered in the client,
+        which is the default, or by the model worker in an extra request.
+        '''
+        self.mapping_local_chat_template[model] = enable
+        return self
+
     def setup_extra_generation_params(self,model:str,extra_generation_params:Dict[str,Any])->'ByzerLLM':
         v = self.mapping_extra_generation_params.get(model,{}) 
         self.mapping_extra_generation_params[model] = {**v,**extra_generation_params}
@@ -273,28 +386,35 @@ class ByzerLLM:
     
     def setup_template(self,model:str,template:Union[Template,str])->'ByzerLLM':
         if template == "auto":
-            meta = self.get_meta(model=model)
-            
-            is_saas_model =  meta.get("model_deploy_type",None) == "saas"
-            
-            if is_saas_model:
-                return self
-            
-            is_message_format = meta.get("message_format",False)
-            
-            if is_message_format:                
-                return self
-                        
-            if "QWenLMHeadModel" in meta.get("architectures",[]):
-                self.setup_template(model,Templates.qwen())
-                return self
-
-            if not meta.get("support_chat_template",False):
-                raise Exception(f"The model({model}) is not support auto(apply chat template) for now.")
-            
-            self.mapping_auto_use_apply_chat_template[model] = True
+            return self._setup_auto_template(model,self.get_meta(model=model))
+        return self._setup_template(model,template)
+
+    async def asetup_template(self,model:str,template:Union[Template,str])->'ByzerLLM':
+        if template == "auto":
+            return self._setup_auto_template(model,await self.aget_meta(model=model))
+        return self._setup_template(model,template)
+
+    def _setup_auto_template(self,model:str,meta:Dict[str,Any])->'ByzerLLM':
+        is_saas_model =  meta.get("model_deploy_type",None) == "saas"
+        
+        if is_saas_model:
             return self
+        
+        is_message_format = meta.get("message_format",False)
+        
+        if is_message_format:                
+            return self
+                    
+        if "QWenLMHeadModel" in meta.get("architectures",[]):
+            return self._setup_template(model,Templates.qwen())
 
+        if not meta.get("support_chat_template",False):
+            raise Exception(f"The model({model}) is not support auto(apply chat template) for now.")
+        
+        self.mapping_auto_use_apply_chat_template[model] = True
+        return self
+
+    def _setup_template(self,model:str,template:Template)->'ByzerLLM':
         self.mapping_role_mapping[model] = template.role_mapping
         
         v = self.mapping_extra_generation_params.get(model,{}) 
@@ -435,8 +555,8 @@ class ByzerLLM:
                 except Exception as inst:
                     pass
             ray.kill(model)  
-            if udf_name in self.meta_cache:
-                del self.meta_cache[udf_name]                          
+            self._invalidate_udf_master(udf_name)
+            self.meta_cache.invalidate(udf_name)
         except ValueError:
             pass
         time.sleep(3)
@@ -447,8 +567,42 @@ class ByzerLLM:
     }):                
         meta = self.get_meta(model=model)
         if self.mapping_auto_use_apply_chat_template.get(model,False) and meta.get("support_chat_template",False) :
+            prompt = self._render_chat_template(model,meta,conversations)
+            if prompt is not None:
+                return prompt
             return self.apply_chat_template(model,json.dumps(conversations,ensure_ascii=False))
+        return self._format_history(conversations,role_mapping)
+
+    async def agenerate_instruction_from_history(self,model:str,conversations:List[Dict[str,str]],role_mapping:Dict[str,str]={        
+        "user_role":"User:",        
+        "assistant_role":"Assistant:",
+    }):
+        meta = await self.aget_meta(model=model)
+        if self.mapping_auto_use_apply_chat_template.get(model,False) and meta.get("support_chat_template",False) :
+            prompt = self._render_chat_template(model,meta,conversations)
+            if prompt is not None:
+                return prompt
+            return await self.aapply_chat_template(model,json.dumps(conversations,ensure_ascii=False))
+        return self._format_history(conversations,role_mapping)
 
+    def _render_chat_template(self,model:str,meta:Dict[str,Any],conversations:List[Dict[str,str]])->Optional[str]:
+        '''
+        renders the chat template from the model meta in the client, returns None when
+        the meta has no template (older workers) or the local rendering fails, then the
+        model worker applies it.
+        '''
+        chat_template = meta.get("chat_template",None)
+        if not chat_template or not self.mapping_local_chat_template.get(model,True):
+            return None
+        try:
+            return render_chat_template(chat_template,conversations,
+                                        special_tokens=meta.get("chat_template_special_tokens",{}),
+                                        add_generation_prompt=True)
+        except Exception as e:
+            logger.warning(f"render the chat template of {model} locally failed, apply it in the model worker: {e}")
+            return None
+
+    def _format_history(self,conversations:List[Dict[str,str]],role_mapping:Dict[str,str]):
         new_his = []    
         for item in conversations:
             if item["role"] == "system":
@@ -477,18 +631,26 @@ class ByzerLLM:
         return fin_ins     
 
     def is_model_exist(self,udf_name:str)->bool:
+        # ask ray instead of the cache, another client may have undeployed the model
         try:
             ray.get_actor(udf_name)
             return True
         except Exception as inst:
+            self._invalidate_udf_master(udf_name)
             return False                           
 
+    async def ais_model_exist(self,udf_name:str)->bool:
+        # ray.get_actor blocks on the gcs, keep it off the event loop
+        return await asyncio.to_thread(self.is_model_exist,udf_name)
+
     def deploy(self,model_path:str,
                pretrained_model_type:str,
                udf_name:str,
                infer_params:Dict[str,Any]):        
         from byzerllm import common_init_model
         self.setup("UDF_CLIENT",udf_name)
+        self._invalidate_udf_master(udf_name)
+        self.meta_cache.invalidate(udf_name)
 
         infer_backend = self.sys_conf["infer_backend"]
         
@@ -508,6 +670,8 @@ class ByzerLLM:
                 from byzerllm import consume_model
                 consume_model(conf)                
                 infer = infer_module.CustomSaasAPI(infer_params)
+                # the items of a request are sent to the saas api concurrently
+                infer.predict_concurrency = int(infer_params.get("saas.predict_concurrency",8))
                 return (infer,None)
             
             UDFBuilder.build(self.ray_context,init_model,simple_predict_func)
@@ -549,74 +713,85 @@ class ByzerLLM:
         UDFBuilder.build(self.ray_context,init_model,getattr(predict_module,predict_func))
         return self.get_meta(model=udf_name)
   
-    def get_meta(self,model:str,llm_config:Dict[str,Any]={}):        
-        if not model and not self.default_model_name:
-            raise Exception("model name is required")
-        
-        if not model:
-            model = self.default_model_name
+    def _resolve_model(self,model:Optional[str],default_model:Optional[str],error:str="model name is required")->str:
+        if not model and not default_model:
+            raise Exception(error)
+        return model if model else default_model
 
-        if model in self.meta_cache:
-            return self.meta_cache[model]    
+    def _to_llm_responses(self,res)->List[LLMResponse]:
+        return [LLMResponse(output=item["predict"],metadata=item.get("metadata",{}),input=item["input"]) for item in res]
 
+    def _meta_input(self,model:str,llm_config:Dict[str,Any]):
         default_config = self.mapping_extra_generation_params.get(model,{})
+        return [{"instruction":"","meta":True, **{**default_config,**llm_config} }]
 
-        v = [{"instruction":"","meta":True, **{**default_config,**llm_config} }]        
-        res = self._query(model,v) 
-        
-        t = [LLMResponse(output=item["predict"],metadata=item.get("metadata",{}),input=item["input"]) for item in res]        
+    def _set_meta(self,model:str,res):
+        t = self._to_llm_responses(res)
         
         res = {}
         if len(t) != 0 and len(t[0].output) != 0 :
             res = t[0].output[0]
 
-        self.meta_cache[model] = res            
-        return self.meta_cache[model]
+        return self.meta_cache.put(model,res)
+
+    def get_meta(self,model:str,llm_config:Dict[str,Any]={}):        
+        model = self._resolve_model(model,self.default_model_name)
+
+        meta = self.meta_cache.get(model)
+        if meta is not None:
+            return meta
+
+        res = self._query(model,self._meta_input(model,llm_config)) 
+        return self._set_meta(model,res)
+
+    async def aget_meta(self,model:str,llm_config:Dict[str,Any]={}):
+        model = self._resolve_model(model,self.default_model_name)
+
+        meta = await self.meta_cache.aget(model)
+        if meta is not None:
+            return meta
+
+        res = await self._aquery(model,self._meta_input(model,llm_config)) 
+        return self._set_meta(model,res)
+
+    def _tokenize_input(self,model:str,s:str,llm_config:Dict[str,Any]):
+        default_config = self.mapping_extra_generation_params.get(model,{})
+        return [{"instruction":s,"tokenizer":True, **{**default_config,**llm_config} }]
         
     def tokenize(self,model:str,s:str,llm_config:Dict[str,Any]={})->List[str]:
-        
-        if not model and not self.default_model_name:
-            raise Exception("model name is required")
-        
-        if not model:
-            model = self.default_model_name
+        model = self._resolve_model(model,self.default_model_name)
+        res = self._query(model,self._tokenize_input(model,s,llm_config)) 
+        return self._to_llm_responses(res)
 
-        default_config = self.mapping_extra_generation_params.get(model,{})
+    async def atokenize(self,model:str,s:str,llm_config:Dict[str,Any]={})->List[str]:
+        model = self._resolve_model(model,self.default_model_name)
+        res = await self._aquery(model,self._tokenize_input(model,s,llm_config)) 
+        return self._to_llm_responses(res)
 
-        v = [{"instruction":s,"tokenizer":True, **{**default_config,**llm_config} }]        
-        res = self._query(model,v) 
-        return [LLMResponse(output=item["predict"],metadata=item.get("metadata",{}),input=item["input"]) for item in res]
+    def _apply_chat_template_input(self,model:str,s:str,llm_config:Dict[str,Any]):
+        default_config = self.mapping_extra_generation_params.get(model,{})
+        return [{"instruction":s,"apply_chat_template":True, **{**default_config,**llm_config} }]
     
     def apply_chat_template(self,model:str,s:str,llm_config:Dict[str,Any]={}):
-        if not model and not self.default_model_name:
-            raise Exception("model name is required")
-        
-        if not model:
-            model = self.default_model_name
-        
-        default_config = self.mapping_extra_generation_params.get(model,{})
-        v = [{"instruction":s,"apply_chat_template":True, **{**default_config,**llm_config} }]        
-        res = self._query(model,v) 
-        
-        t = [LLMResponse(output=item["predict"],metadata=item.get("metadata",{}),input=item["input"]) for item in res]  
-        return t[0].output      
+        model = self._resolve_model(model,self.default_model_name)
+        res = self._query(model,self._apply_chat_template_input(model,s,llm_config)) 
+        return self._to_llm_responses(res)[0].output      
+
+    async def aapply_chat_template(self,model:str,s:str,llm_config:Dict[str,Any]={}):
+        model = self._resolve_model(model,self.default_model_name)
+        res = await self._aquery(model,self._apply_chat_template_input(model,s,llm_config)) 
+        return self._to_llm_responses(res)[0].output      
 
     def emb_query(self,v:str,model:str=None):
         return self.emb(model=model,request=LLMRequest(instruction=v))
 
-
-    def emb(self, model, request:LLMRequest ,extract_params:Dict[str,Any]={}):
-        
-        if not model and not self.default_emb_model_name:
-            raise Exception("model name is required")
-        
-        if not model:
-            model = self.default_emb_model_name
-
-        default_config = self.mapping_extra_generation_params.get(model,{})            
-
+    def _emb_request(self,request:Union[LLMRequest,List[str]])->LLMRequest:
         if isinstance(request,list):
             request = LLMRequest(instruction=request)
+        return request
+
+    def _emb_input(self,model:str,request:LLMRequest,extract_params:Dict[str,Any],meta:Dict[str,Any]={}):
+        default_config = self.mapping_extra_generation_params.get(model,{})            
 
         if isinstance(request.instruction,str):
             v = [{
@@ -627,6 +802,17 @@ class ByzerLLM:
             "temperature":request.temperature,                                    
             ** default_config,           
             ** extract_params}] 
+        elif meta.get("support_embed_batch",False):
+            # all the texts in one query, the worker encodes them in batches
+            v = [{
+            "instruction":request.instruction,
+            "embedding":True,
+            "embed_batch":True,
+            "max_length":request.max_length,
+            "top_p":request.top_p,
+            "temperature":request.temperature,            
+            ** default_config, 
+            ** extract_params}]
         else: 
             v = [{
             "instruction":x,
@@ -636,34 +822,78 @@ class ByzerLLM:
             "temperature":request.temperature,            
             ** default_config, 
             ** extract_params} for x in request.instruction]    
-        res = self._query(model,v) 
-      
-        return [LLMResponse(output=item["predict"],metadata=item.get("metadata",{}),input=item["input"]) for item in res]
-
-    def emb_rerank(self, model: str = None, sentence_pairs: Union[List[Tuple[str, str]], Tuple[str, str]] = [],
-                   extract_params: Dict[str, Any] = {}) -> Union[Tuple[Tuple[str, str], float], List[Tuple[Tuple[str, str], float]]]:
-
-        if not model and not self.default_rerank_model_name:
-            raise Exception("rerank model name is required")
+        return v
+
+    def _to_emb_responses(self,res,return_ndarray:bool=False)->List[LLMResponse]:
+        responses = []
+        for item in res:
+            predict = item["predict"]
+            if return_ndarray and not isinstance(predict,np.ndarray):
+                # the worker does not support embedding_format yet
+                predict = np.asarray(predict,dtype=np.float32)
+            if not item["input"].get("embed_batch",False):
+                responses.append(LLMResponse(output=predict,metadata=item.get("metadata",{}),input=item["input"]))
+                continue
+            # the metadata (e.g. the token usage) is of the whole batch, it goes with the
+            # first text only so summing it over the responses still gives the batch total
+            for i,(text,embedding) in enumerate(zip(item["input"]["instruction"],predict)):
+                metadata = item.get("metadata",{}) if i == 0 else {}
+                responses.append(LLMResponse(output=embedding,metadata=metadata,input={**item["input"],"instruction":text}))
+        return responses
+
+    def _emb_extract_params(self,extract_params:Dict[str,Any],return_ndarray:bool)->Dict[str,Any]:
+        if return_ndarray:
+            return {**extract_params,"embedding_format":"ndarray"}
+        return extract_params
+
+    def emb(self, model, request:LLMRequest ,extract_params:Dict[str,Any]={},return_ndarray:bool=False):
+        '''
+        request.instruction can be a list of texts, they are sent in one request
+        when the model supports batched embedding (support_embed_batch in meta).
 
+        With return_ndarray=True the output of every response is a float32 numpy array.
+        The worker returns the embeddings as float32 arrays through the object store
+        instead of json, the arrays are read-only views of the object store buffer.
+        '''
+        model = self._resolve_model(model,self.default_emb_model_name)
+        request = self._emb_request(request)
+        meta = {} if isinstance(request.instruction,str) else self.get_meta(model=model)
+        extract_params = self._emb_extract_params(extract_params,return_ndarray)
+        res = self._query(model,self._emb_input(model,request,extract_params,meta)) 
+        return self._to_emb_responses(res,return_ndarray)
+
+    async def aemb(self, model, request:LLMRequest ,extract_params:Dict[str,Any]={},return_ndarray:bool=False):
+        model = self._resolve_model(model,self.default_emb_model_name)
+        request = self._emb_request(request)
+        meta = {} if isinstance(request.instruction,str) else await self.aget_meta(model=model)
+        extract_params = self._emb_extract_params(extract_params,return_ndarray)
+        res = await self._aquery(model,self._emb_input(model,request,extract_params,meta)) 
+        return self._to_emb_responses(res,return_ndarray)
+
+    def _emb_rerank_input(self, model: str, sentence_pairs, extract_params: Dict[str, Any]):
         if not sentence_pairs or len(sentence_pairs) == 0:
             raise Exception("rerank rerank param sentence_pairs is required")
 
-        if not model:
-            model = self.default_rerank_model_name
-
         default_config = self.mapping_extra_generation_params.get(model, {})
 
-        v = [{
+        return [{
             "instruction": sentence_pairs,
             "embedding": True,
             "embed_rerank": True,
             **default_config,
             **extract_params}]
-        res = self._query(model, v)
 
-        return [LLMResponse(output=item["predict"], metadata=item.get("metadata", {}), input=item["input"]) for item in
-                res]
+    def emb_rerank(self, model: str = None, sentence_pairs: Union[List[Tuple[str, str]], Tuple[str, str]] = [],
+                   extract_params: Dict[str, Any] = {}) -> Union[Tuple[Tuple[str, str], float], List[Tuple[Tuple[str, str], float]]]:
+        model = self._resolve_model(model, self.default_rerank_model_name, "rerank model name is required")
+        res = self._query(model, self._emb_rerank_input(model, sentence_pairs, extract_params))
+        return self._to_llm_responses(res)
+
+    async def aemb_rerank(self, model: str = None, sentence_pairs: Union[List[Tuple[str, str]], Tuple[str, str]] = [],
+                          extract_params: Dict[str, Any] = {}) -> Union[Tuple[Tuple[str, str], float], List[Tuple[Tuple[str, str], float]]]:
+        model = self._resolve_model(model, self.default_rerank_model_name, "rerank model name is required")
+        res = await self._aquery(model, self._emb_rerank_input(model, sentence_pairs, extract_params))
+        return self._to_llm_responses(res)
 
     def _generate_ins(self,model:str,request:LLMRequest,role_mapping:Dict[str,str]):
          if not role_mapping["user_role"]:
@@ -700,40 +930,13 @@ class ByzerLLM:
         
         r = LLMFunctionCallResponse(response=response,values=[],metadata={"reason":""})
         
-        is_json = False
         try:
-            json.loads(response.output)
-            is_json = True
-        except Exception as inst:
-            pass
-
-        code = response.output
-            
-        if not is_json:
-            if code.strip().startswith("```json"): 
-                index = code.rfind("```")
-                if index != -1:
-                    code = code.strip()[7:index-1]                    
-                    try:
-                        json.loads(code)
-                        is_json = True
-                    except Exception as inst:
-                        pass
-                
-        if not is_json:
-            codes = code_utils.extract_code(response.output)         
-            if len(codes) == 0:            
-                r.metadata["reason"] = "No json block found"
-                return r 
-            
-            lang,code = codes[-1]
+            temp = extract_json(response.output)
+        except ValueError as inst:
+            r.metadata["reason"] = str(inst)
+            return r
 
-            if lang != "json":
-                r.metadata["reason"] = "No json block found"
-                return r
-        
         try:
-            temp = json.loads(code)
             if isinstance(temp,list):
                 temp = temp[-1]
             ms = FunctionCallList.parse_obj(temp)
@@ -809,44 +1012,14 @@ class ByzerLLM:
         
         
         r = LLMClassResponse(response=response,value=None,metadata={"reason":""})
-        is_json = False
-        try:
-            json.loads(response.output)
-            is_json = True
-        except Exception as inst:
-            pass
-                
-        code = response.output
 
-        if not is_json:
-            if code.strip().startswith("```json"): 
-                index = code.rfind("```")
-                if index != -1:
-                    code = code.strip()[7:index-1]                    
-                    try:
-                        json.loads(code)
-                        is_json = True
-                    except Exception as inst:
-                        pass
-
-        if not is_json:
-            codes = code_utils.extract_code(response.output)
-            if len(codes) == 0:
-                r.metadata["reason"] = "No json block found"
-                return r 
-            
-            lang,code = codes[-1]
+        try:
+            obj = extract_json(response.output)
+        except ValueError as inst:
+            r.metadata["reason"] = str(inst)
+            return r
 
-            if lang != "json":
-                r.metadata["reason"] = "No json block found"
-                return r
-        
         try:
-            try:
-                obj = json.loads(code)
-            except Exception as inst:
-                print("Fail to parse json. Error:\n" + str(inst) + "\n" + traceback.format_exc(),flush=True)
-                obj = json.loads(repair_json_str(code))
             ms = response_class.parse_obj(obj)            
         except Exception as inst:
             r.metadata["reason"] = str(inst) + "\n" + traceback.format_exc()
@@ -856,40 +1029,28 @@ class ByzerLLM:
 
         return r
 
-    def abort(self,request_id:str,model:Optional[str]=None):
-        if not model and not self.default_model_name:
-            raise Exception("model name is required")
-        if not model:
-            model = self.default_model_name
-        
-        meta = self.get_meta(model=model)
+    def _abort_conversations(self,request_id:str,meta:Dict[str,Any]):
         if meta.get("backend",None) != "ray/vllm":
             raise Exception("abort only support ray/vllm backend")
-        
-        self.chat_oai(conversations=[
+        return [
             {
                 "role":"user",
                 "content":f"{request_id}"
             }
-        ],llm_config={"gen.request_id":request_id,"gen.abort":True})    
+        ]
 
-    def chat_oai(self,
-                 conversations,
-                 tools:List[Union[Callable,str]]=[], 
-                 tool_choice:Optional[Union[Callable,str]]=None,
-                 execute_tool:bool=False,  
-                 impl_func:Optional[Callable]=None,
-                 execute_impl_func:bool=False,
-                 impl_func_params:Optional[Dict[str,Any]]=None,
-                 func_params:Optional[Dict[str,Any]]=None,
-                 response_class:Optional[Union[pydantic.BaseModel,str]] = None, 
-                 response_after_chat:Optional[Union[pydantic.BaseModel,str]] = False,
-                 enable_default_sys_message:bool=True,                 
-                 model:Optional[str] = None,
-                 role_mapping=None,llm_config:Dict[str,Any]={},
-                 only_return_prompt:bool= False,
-                 )->Union[List[LLMResponse],List[LLMFunctionCallResponse],List[LLMClassResponse]]:        
-        
+    def abort(self,request_id:str,model:Optional[str]=None):
+        model = self._resolve_model(model,self.default_model_name)
+        conversations = self._abort_conversations(request_id,self.get_meta(model=model))
+        self.chat_oai(conversations=conversations,model=model,llm_config={"gen.request_id":request_id,"gen.abort":True})    
+
+    async def aabort(self,request_id:str,model:Optional[str]=None):
+        model = self._resolve_model(model,self.default_model_name)
+        conversations = self._abort_conversations(request_id,await self.aget_meta(model=model))
+        await self.achat_oai(conversations=conversations,model=model,llm_config={"gen.request_id":request_id,"gen.abort":True})    
+
+    def _prepare_chat_oai(self,conversations,tools,tool_choice,impl_func,response_class,
+                          enable_default_sys_message:bool,model:Optional[str],role_mapping):
         if not self.default_model_name and not model:
             raise Exception("Use llm.setup_default_model_name to setup default model name or setup the model parameter")
         
@@ -932,8 +1093,11 @@ class ByzerLLM:
             if first_message["role"] == "system":
                 first_message["content"] = f'''{self.mapping_base_system_message.get(model,base_ability_format(base_abilities=base_abilities))}
 {first_message["content"]}'''
-                
-        meta = self.get_meta(model=model)        
+
+        return model,role_mapping,conversations
+
+    def _format_chat_oai_conversations(self,conversations,meta:Dict[str,Any],tools,tool_choice,impl_func,response_class,response_after_chat,
+                                       enable_default_sys_message:bool,model:str):
         is_saas_model =  meta.get("model_deploy_type",None) == "saas"
         is_message_format = meta.get("message_format",False)
 
@@ -967,27 +1131,38 @@ class ByzerLLM:
                 history.append(item)
             
         else:
-            final_ins = self.generate_instruction_from_history(model,temp_conversations, role_mapping)         
+            # the caller renders the whole conversation
+            final_ins = None
             history = []
 
-        default_config = self.mapping_extra_generation_params.get(model,{})
-        v = [{"instruction":final_ins,"history":history,**default_config,**llm_config }]         
+        return temp_conversations,final_ins,history
 
-        if only_return_prompt:
-            responses = [LLMResponse(output="",metadata=item,input=item["instruction"]) for item in v]
-            if response_class or response_after_chat:
-                new_responses = []
-                for response in responses:
-                    temp = LLMClassResponse(response=response,value=response,metadata={"reason":"Only return prompt"})
-                    new_responses.append(temp)
-                return new_responses
-            return responses                    
+    def _only_return_prompt(self,v,response_class,response_after_chat):
+        responses = [LLMResponse(output="",metadata=item,input=item["instruction"]) for item in v]
+        if response_class or response_after_chat:
+            new_responses = []
+            for response in responses:
+                temp = LLMClassResponse(response=response,value=response,metadata={"reason":"Only return prompt"})
+                new_responses.append(temp)
+            return new_responses
+        return responses                    
 
-        res = self._query(model,v) 
+    def _chat_oai_responses(self,model:str,res)->List[LLMResponse]:
         clean_func = self.mapping_clean_func.get(model,lambda s: s) 
-        
-        responses = [LLMResponse(output=clean_func(item["predict"]),metadata=item.get("metadata",{}),input=item["input"]) for item in res]        
-        
+        return [LLMResponse(output=clean_func(item["predict"]),metadata=item.get("metadata",{}),input=item["input"]) for item in res]        
+
+    def _after_chat_conversations(self,model:str,temp_conversations,responses:List[LLMResponse],response_class):
+        f = self.mapping_response_class_format_after_chat_func.get(model,response_class_format_after_chat)
+        return [temp_conversations + [{
+                    "content":response.output,
+                    "role":"assistant"
+                },{
+                    "content":f(response_class),
+                    "role":"user"
+                }] for response in responses]
+
+    def _process_chat_oai_responses(self,responses:List[LLMResponse],after_chat_responses:Optional[List[LLMResponse]],
+                                    tools,execute_tool:bool,impl_func,execute_impl_func:bool,impl_func_params,func_params,response_class):
         ## handle impl_func response
         if impl_func and response_class and execute_impl_func:
             final_result = []
@@ -1003,19 +1178,7 @@ class ByzerLLM:
             return responses
 
         ## handle response_class response 
-        temp_result = responses    
-        if response_class and response_after_chat: 
-            temp_result = []
-            f = self.mapping_response_class_format_after_chat_func.get(model,response_class_format_after_chat)
-            for response in responses:
-                new_conversations = temp_conversations + [{
-                                        "content":response.output,
-                                        "role":"assistant"
-                                    },{
-                                        "content":f(response_class),
-                                        "role":"user"
-                                    }]
-                temp_result.append(self.chat_oai(new_conversations,role_mapping=role_mapping,llm_config=llm_config)[0])            
+        temp_result = responses if after_chat_responses is None else after_chat_responses
 
         if response_class:
             final_result = []
@@ -1031,8 +1194,168 @@ class ByzerLLM:
 
             return final_result
         
-        return responses    
+        return responses
+
+    def chat_oai(self,
+                 conversations,
+                 tools:List[Union[Callable,str]]=[], 
+                 tool_choice:Optional[Union[Callable,str]]=None,
+                 execute_tool:bool=False,  
+                 impl_func:Optional[Callable]=None,
+                 execute_impl_func:bool=False,
+                 impl_func_params:Optional[Dict[str,Any]]=None,
+                 func_params:Optional[Dict[str,Any]]=None,
+                 response_class:Optional[Union[pydantic.BaseModel,str]] = None, 
+                 response_after_chat:Optional[Union[pydantic.BaseModel,str]] = False,
+                 enable_default_sys_message:bool=True,                 
+                 model:Optional[str] = None,
+                 role_mapping=None,llm_config:Dict[str,Any]={},
+                 only_return_prompt:bool= False,
+                 )->Union[List[LLMResponse],List[LLMFunctionCallResponse],List[LLMClassResponse]]:        
         
+        model,role_mapping,conversations = self._prepare_chat_oai(conversations,tools,tool_choice,impl_func,response_class,
+                                                                  enable_default_sys_message,model,role_mapping)
+        meta = self.get_meta(model=model)
+        temp_conversations,final_ins,history = self._format_chat_oai_conversations(conversations,meta,tools,tool_choice,impl_func,response_class,response_after_chat,
+                                                                                   enable_default_sys_message,model)
+        if final_ins is None:
+            final_ins = self.generate_instruction_from_history(model,temp_conversations, role_mapping)
+
+        default_config = self.mapping_extra_generation_params.get(model,{})
+        v = [{"instruction":final_ins,"history":history,**default_config,**llm_config }]         
+
+        if only_return_prompt:
+            return self._only_return_prompt(v,response_class,response_after_chat)
+
+        res = self._query(model,v) 
+        responses = self._chat_oai_responses(model,res)
+
+        after_chat_responses = None
+        if response_class and response_after_chat and not impl_func:
+            after_chat_responses = []
+            for new_conversations in self._after_chat_conversations(model,temp_conversations,responses,response_class):
+                after_chat_responses.append(self.chat_oai(new_conversations,role_mapping=role_mapping,llm_config=llm_config)[0])
+
+        return self._process_chat_oai_responses(responses,after_chat_responses,tools,execute_tool,impl_func,execute_impl_func,
+                                                impl_func_params,func_params,response_class)
+
+    async def achat_oai(self,
+                  conversations,
+                  tools:List[Union[Callable,str]]=[], 
+                  tool_choice:Optional[Union[Callable,str]]=None,
+                  execute_tool:bool=False,  
+                  impl_func:Optional[Callable]=None,
+                  execute_impl_func:bool=False,
+                  impl_func_params:Optional[Dict[str,Any]]=None,
+                  func_params:Optional[Dict[str,Any]]=None,
+                  response_class:Optional[Union[pydantic.BaseModel,str]] = None, 
+                  response_after_chat:Optional[Union[pydantic.BaseModel,str]] = False,
+                  enable_default_sys_message:bool=True,                 
+                  model:Optional[str] = None,
+                  role_mapping=None,llm_config:Dict[str,Any]={},
+                  only_return_prompt:bool= False,
+                  )->Union[List[LLMResponse],List[LLMFunctionCallResponse],List[LLMClassResponse]]:        
+        '''
+        the asyncio version of chat_oai, it awaits the model on the event loop
+        instead of holding a thread for every request.
+        '''
+        model,role_mapping,conversations = self._prepare_chat_oai(conversations,tools,tool_choice,impl_func,response_class,
+                                                                  enable_default_sys_message,model,role_mapping)
+        meta = await self.aget_meta(model=model)
+        temp_conversations,final_ins,history = self._format_chat_oai_conversations(conversations,meta,tools,tool_choice,impl_func,response_class,response_after_chat,
+                                                                                   enable_default_sys_message,model)
+        if final_ins is None:
+            final_ins = await self.agenerate_instruction_from_history(model,temp_conversations, role_mapping)
+
+        default_config = self.mapping_extra_generation_params.get(model,{})
+        v = [{"instruction":final_ins,"history":history,**default_config,**llm_config }]         
+
+        if only_return_prompt:
+            return self._only_return_prompt(v,response_class,response_after_chat)
+
+        res = await self._aquery(model,v) 
+        responses = self._chat_oai_responses(model,res)
+
+        after_chat_responses = None
+        if response_class and response_after_chat and not impl_func:
+            after_chat_responses = []
+            for new_conversations in self._after_chat_conversations(model,temp_conversations,responses,response_class):
+                after_chat_responses.append((await self.achat_oai(new_conversations,role_mapping=role_mapping,llm_config=llm_config))[0])
+
+        return self._process_chat_oai_responses(responses,after_chat_responses,tools,execute_tool,impl_func,execute_impl_func,
+                                                impl_func_params,func_params,response_class)
+
+    def _merge_stream_text(self,output,pre_generated_text:Optional[str],delta_mode:bool):
+        '''
+        return (text to yield, generated text so far) or None if nothing is new.
+        The writer sends either the delta or the whole text so far in every chunk.
+        '''
+        if getattr(output,"delta",False):
+            if not output.text:
+                return None
+            if delta_mode:
+                return (output.text,pre_generated_text)
+            # the full text is only rebuilt when the caller asks for it
+            generated_text = (pre_generated_text or "") + output.text
+            return (generated_text,generated_text)
+
+        generated_text = output.text
+        if pre_generated_text is not None and generated_text == pre_generated_text:
+            return None
+
+        if delta_mode and pre_generated_text is not None:
+            s = generated_text[len(pre_generated_text):]
+        else:
+            s = generated_text
+        return (s,generated_text)
+
+    def _stream_items(self,server,request_id:str,timeout:float=1.0):
+        # stream servers deployed by an older version may not support the long poll api
+        if not hasattr(server,"get_items"):
+            while True:
+                final_output = ray.get(server.get_item.remote(request_id))
+                if isinstance(final_output,str):
+                    time.sleep(0.01)
+                    continue
+                if final_output is None:
+                    break
+                yield final_output
+            return
+
+        cursor = 0
+        while True:
+            batch = ray.get(server.get_items.remote(request_id,cursor,timeout))
+            if batch is None:
+                break
+            items,cursor,done = batch
+            for item in items:
+                yield item
+            if done:
+                break
+
+    async def _async_stream_items(self,server,request_id:str,timeout:float=1.0):
+        if not hasattr(server,"get_items"):
+            while True:
+                final_output = await server.get_item.remote(request_id)
+                if isinstance(final_output,str):
+                    await asyncio.sleep(0.01)
+                    continue
+                if final_output is None:
+                    break
+                yield final_output
+            return
+
+        cursor = 0
+        while True:
+            batch = await server.get_items.remote(request_id,cursor,timeout)
+            if batch is None:
+                break
+            items,cursor,done = batch
+            for item in items:
+                yield item
+            if done:
+                break
+
     def stream_chat_oai(self,conversations, 
                         model:Optional[str]=None, 
                         role_mapping=None,
@@ -1049,33 +1372,20 @@ class ByzerLLM:
         v = self.chat_oai(conversations,model=model,role_mapping = role_mapping,llm_config={**llm_config,**{"generation.stream":True}})       
         request_id = v[0].metadata["request_id"]
         stream_server_type = v[0].metadata.get("stream_server", "VLLM_STREAM_SERVER")
-        server = ray.get_actor(stream_server_type)                        
+        server = self._get_stream_server(stream_server_type)
 
         pre_generated_text = None
-        while True:                 
-            final_output = ray.get(server.get_item.remote(request_id))
-            if isinstance(final_output,str):
-                time.sleep(0.01)
-                continue
-            
-            if final_output is None:
-                break
-
-            if stream_server_type == "BlockBinaryStreamServer":                
+        for final_output in self._stream_items(server,request_id):
+            if stream_server_type.startswith("BlockBinaryStreamServer"):                
                 binary_data = final_output.outputs[0].text 
                 yield (binary_data, final_output.outputs[0].metadata)
             else:            
                 text_outputs = final_output.outputs
                 clean_func = self.mapping_clean_func.get(model,lambda s: s)
-                generated_text = text_outputs[0].text
-                if pre_generated_text is not None and generated_text == pre_generated_text:
+                r = self._merge_stream_text(text_outputs[0],pre_generated_text,delta_mode)
+                if r is None:
                     continue
-                
-                if delta_mode and pre_generated_text is not None:
-                    s = generated_text[len(pre_generated_text):]
-                else:
-                    s = generated_text    
-                pre_generated_text=generated_text
+                s,pre_generated_text = r
                 yield (clean_func(s),text_outputs[0].metadata)
 
     async def async_stream_chat_oai(self,conversations,
@@ -1087,40 +1397,27 @@ class ByzerLLM:
         if not model:
             model = self.default_model_name
         
-        meta = self.get_meta(model=model)
+        meta = await self.aget_meta(model=model)
         if not meta.get("support_stream",False):
             raise Exception(f"The model({model}) is not support stream chat for now.")    
 
-        v = self.chat_oai(conversations,model=model,role_mapping=role_mapping,llm_config={**llm_config,**{"generation.stream":True}})       
+        v = await self.achat_oai(conversations,model=model,role_mapping=role_mapping,llm_config={**llm_config,**{"generation.stream":True}})       
         request_id = v[0].metadata["request_id"]
         stream_server_type = v[0].metadata.get("stream_server", "VLLM_STREAM_SERVER")
-        server = ray.get_actor(stream_server_type)
+        server = self._get_stream_server(stream_server_type)
 
         pre_generated_text = None
-        while True:                 
-            final_output = await server.get_item.remote(request_id)
-            if isinstance(final_output,str):
-                time.sleep(0.01)
-                continue
-            
-            if final_output is None:
-                break
-            
-            if stream_server_type == "BlockBinaryStreamServer":                
+        async for final_output in self._async_stream_items(server,request_id):
+            if stream_server_type.startswith("BlockBinaryStreamServer"):                
                 binary_data = final_output.outputs[0].text 
                 yield (binary_data, final_output.outputs[0].metadata)
             else:            
                 text_outputs = final_output.outputs
                 clean_func = self.mapping_clean_func.get(model,lambda s: s)
-                generated_text = text_outputs[0].text
-                if pre_generated_text is not None and generated_text == pre_generated_text:
+                r = self._merge_stream_text(text_outputs[0],pre_generated_text,delta_mode)
+                if r is None:
                     continue
-                
-                if delta_mode and pre_generated_text is not None:
-                    s = generated_text[len(pre_generated_text):]
-                else:
-                    s = generated_text    
-                pre_generated_text=generated_text
+                s,pre_generated_text = r
                 yield (clean_func(s),text_outputs[0].metadata)
                             
 
@@ -1167,7 +1464,7 @@ class ByzerLLM:
             def _impl(func):                                
                 @functools.wraps(func)
                 def wrapper(*args, **kwargs):                                                                                                   
-                    signature = inspect.signature(func)
+                    signature = get_signature(func)
                     arguments = signature.bind(*args, **kwargs)
                     arguments.apply_defaults()
                     input_dict = {}
@@ -1240,7 +1537,7 @@ class ByzerLLM:
         def _impl(func):               
             @functools.wraps(func)
             def wrapper(*args, **kwargs):                                                                               
-                signature = inspect.signature(func)
+                signature = get_signature(func)
                 arguments = signature.bind(*args, **kwargs)
                 arguments.apply_defaults()
                 input_dict = {}
@@ -1292,7 +1589,7 @@ class ByzerLLM:
             def wrapper(*args, **kwargs):
                                                 
                 key = f"{model}_{instruction}_{func.__module__}.{func.__name__}"
-                signature = inspect.signature(func)
+                signature = get_signature(func)
                 arguments = signature.bind(*args, **kwargs)
                 arguments.apply_defaults()
                 
@@ -1445,39 +1742,60 @@ cost {time.monotonic() - start_time} seconds
     def get_max_input_length(self,model:str):
         return self.mapping_max_input_length.get(model,None)        
 
-    def _query(self, model:str, input_value:List[Dict[str,Any]]):  
+    def _set_input_size(self,model:str,input:Dict[str,Any],input_size:int):
+        if self.get_max_input_length(model) and input_size > self.get_max_input_length(model):
+            raise Exception(f"input length {input_size} is larger than max_input_length {self.mapping_max_input_length[model]}")                
         
-        if not self.force_skip_context_length_check:
-            for input in input_value:
-                # if this is a embedding/tokenizer query ,skip            
-                if input.get("embedding",False) or input.get("tokenizer",False):
-                    continue            
-                
-                final_ins = input.get("instruction","")
-                
-                try:
-                    input_size = len(self.tokenize(None,final_ins,{})[0].output[0])
-                except Exception as inst:                
-                    continue
-                
-                if self.get_max_input_length(model) and input_size > self.get_max_input_length(model):
-                    raise Exception(f"input length {input_size} is larger than max_input_length {self.mapping_max_input_length[model]}")                
-                
-                max_output_length = self.get_max_output_length(model)
-
-                if  self.get_max_model_length(model):                    
-                    if input_size + max_output_length > self.get_max_model_length(model):
-                        raise Exception(f"input_size ({input_size}) + max_output_length {max_output_length} is larget than model context length {self.mapping_max_model_length[model]}")                
-                
-                # dynamically update the max_length
-                input["max_length"] = input_size + max_output_length
+        max_output_length = self.get_max_output_length(model)
 
-        event_result = self._trigger_event(EventName.BEFORE_CALL_MODEL, self, model, input_value)        
-        if event_result is not None:            
-            return event_result
-        
-        udf_master = ray.get_actor(model)     
+        if  self.get_max_model_length(model):                    
+            if input_size + max_output_length > self.get_max_model_length(model):
+                raise Exception(f"input_size ({input_size}) + max_output_length {max_output_length} is larget than model context length {self.mapping_max_model_length[model]}")                
         
+        # dynamically update the max_length
+        input["max_length"] = input_size + max_output_length
+
+    def _inputs_to_check(self,model:str,input_value:List[Dict[str,Any]]):
+        if self.force_skip_context_length_check:
+            return []
+        # if this is a embedding/tokenizer query ,skip            
+        return [input for input in input_value if not (input.get("embedding",False) or input.get("tokenizer",False))]
+
+    def _skip_token_count(self,model:str,inst:Exception):
+        # the model has no tokenizer (e.g. saas models), skip the check from now on.
+        # Any other error (a timeout, a restarting worker) only skips this input.
+        if "do not support text tokenizer service" in str(inst):
+            self.mapping_token_counter[model] = None
+
+    def _check_context_length(self,model:str,input_value:List[Dict[str,Any]]):
+        for input in self._inputs_to_check(model,input_value):
+            token_counter = self.get_token_counter(model)
+            if token_counter is None:
+                continue
+
+            try:
+                input_size = token_counter.count(input.get("instruction",""))
+            except Exception as inst:
+                self._skip_token_count(model,inst)
+                continue
+            
+            self._set_input_size(model,input,input_size)
+
+    async def _acheck_context_length(self,model:str,input_value:List[Dict[str,Any]]):
+        for input in self._inputs_to_check(model,input_value):
+            token_counter = self.get_token_counter(model)
+            if token_counter is None:
+                continue
+
+            try:
+                input_size = await token_counter.acount(input.get("instruction",""))
+            except Exception as inst:
+                self._skip_token_count(model,inst)
+                continue
+            
+            self._set_input_size(model,input,input_size)
+
+    def _serialize_input(self,model:str,input_value:List[Dict[str,Any]]):
         try:   
             new_input_value = [json.dumps(x,ensure_ascii=False) for x in input_value]
         except Exception as inst:
@@ -1485,29 +1803,135 @@ cost {time.monotonic() - start_time} seconds
            
         if self.verbose:
             print(f"Send to model[{model}]:{new_input_value}")
-        index = -1 
+
+        worker_id = -1  
+        if self.pin_model_worker_mapping:
+            if input_value[0].get("embedding",False):
+                worker_id = self.pin_model_worker_mapping.get("embedding",-1)
+            elif input_value[0].get("tokenizer",False):
+                worker_id = self.pin_model_worker_mapping.get("tokenizer",-1)
+            elif input_value[0].get("apply_chat_template",False):
+                worker_id = self.pin_model_worker_mapping.get("apply_chat_template",-1)
+            elif input_value[0].get("meta",False):
+                worker_id = self.pin_model_worker_mapping.get("meta",-1)                  
+        return new_input_value, worker_id
+
+    def _query(self, model:str, input_value:List[Dict[str,Any]]):  
+        
+        self._check_context_length(model,input_value)
+
+        event_result = self._trigger_event(EventName.BEFORE_CALL_MODEL, self, model, input_value)        
+        if event_result is not None:            
+            return event_result
+        
+        new_input_value, worker_id = self._serialize_input(model,input_value)
+
+        lease = self.mapping_worker_lease.get(model,None)
+        res = None
+        if lease is not None and worker_id == -1:
+            try:
+                res = self._query_leased_worker(lease,new_input_value)
+            except NoLiveWorkerError:
+                # every leased worker died, nothing was sent yet
+                self._drop_worker_lease(model,lease)
+        if res is None:
+            res = self._query_udf_master(model,worker_id,new_input_value)
+
+        values = self._decode_result(res)
+        event_result = self._trigger_event(EventName.AFTER_CALL_MODEL,self, model, values)
+        if event_result is not None:
+            return event_result
+                                            
+        return values
+
+    async def _aquery(self, model:str, input_value:List[Dict[str,Any]]):
+        '''
+        the asyncio version of _query, the ObjectRefs are awaited on the event loop
+        instead of blocking in ray.get.
+        '''
+        await self._acheck_context_length(model,input_value)
+
+        event_result = self._trigger_event(EventName.BEFORE_CALL_MODEL, self, model, input_value)        
+        if event_result is not None:            
+            return event_result
+        
+        new_input_value, worker_id = self._serialize_input(model,input_value)
+
+        lease = self.mapping_worker_lease.get(model,None)
+        res = None
+        if lease is not None and worker_id == -1:
+            try:
+                index, worker = lease.acquire(timeout=0)
+            except TimeoutError:
+                # all the leased workers are full, never block the event loop, ask the master instead
+                index = -1
+            except NoLiveWorkerError:
+                self._drop_worker_lease(model,lease)
+                index = -1
+            if index != -1:
+                try:
+                    res = await worker.async_apply.remote(new_input_value)
+                except ray.exceptions.RayActorError:
+                    lease.invalidate(index)
+                    raise
+                finally:
+                    lease.release(index)
+        if res is None:
+            res = await self._aquery_udf_master(model,worker_id,new_input_value)
+
+        values = self._decode_result(res)
+        event_result = self._trigger_event(EventName.AFTER_CALL_MODEL,self, model, values)
+        if event_result is not None:
+            return event_result
+                                            
+        return values
+
+    def _decode_result(self,res:Dict[str,Any])->List[Dict[str,Any]]:
+        values = json.loads(res["value"][0])
+        ndarrays = res.get("ndarrays",None)
+        if ndarrays:
+            for item in values:
+                if "ndarray" in item:
+                    item["predict"] = ndarrays[item.pop("ndarray")]
+        return values
+
+    def _query_leased_worker(self,lease:WorkerLease,new_input_value:List[str]):
+        index, worker = lease.acquire()
+        try:
+            return ray.get(worker.async_apply.remote(new_input_value))
+        except ray.exceptions.RayActorError:
+            lease.invalidate(index)
+            raise
+        finally:
+            lease.release(index)
+
+    def _query_udf_master(self,model:str,worker_id:int,new_input_value:List[str]):
+        udf_master = self._get_udf_master(model)
+        try:
+            [index, worker] = ray.get(udf_master.get.remote(worker_id))
+        except ray.exceptions.RayActorError:
+            # the cached handle is stale (the model was redeployed), look it up again.
+            # Nothing was sent to a worker yet so it is safe to retry.
+            self._invalidate_udf_master(model)
+            udf_master = self._get_udf_master(model)
+            [index, worker] = ray.get(udf_master.get.remote(worker_id))
+
         try:    
-            worker_id = -1  
-            if self.pin_model_worker_mapping:
-                if input_value[0].get("embedding",False):
-                    worker_id = self.pin_model_worker_mapping.get("embedding",-1)
-                elif input_value[0].get("tokenizer",False):
-                    worker_id = self.pin_model_worker_mapping.get("tokenizer",-1)
-                elif input_value[0].get("apply_chat_template",False):
-                    worker_id = self.pin_model_worker_mapping.get("apply_chat_template",-1)
-                elif input_value[0].get("meta",False):
-                    worker_id = self.pin_model_worker_mapping.get("meta",-1)                  
-
-            [index, worker] = ray.get(udf_master.get.remote(worker_id))                        
-            res = ray.get(worker.async_apply.remote(new_input_value))
-            
-            event_result = self._trigger_event(EventName.AFTER_CALL_MODEL,self, model, json.loads(res["value"][0]))
-            if event_result is not None:
-                return event_result
-                                                
-            return json.loads(res["value"][0])
-        except Exception as inst:
-            raise inst
+            return ray.get(worker.async_apply.remote(new_input_value))
         finally:
-            if index != -1:
-                ray.get(udf_master.give_back.remote(index)) 
\ No newline at end of file
+            # actor calls from the same caller run in order, no need to wait for it
+            udf_master.give_back.remote(index)
+
+    async def _aquery_udf_master(self,model:str,worker_id:int,new_input_value:List[str]):
+        udf_master = self._get_udf_master(model)
+        try:
+            [index, worker] = await udf_master.get.remote(worker_id)
+        except ray.exceptions.RayActorError:
+            self._invalidate_udf_master(model)
+            udf_master = self._get_udf_master(model)
+            [index, worker] = await udf_master.get.remote(worker_id)
+
+        try:    
+            return await worker.async_apply.remote(new_input_value)
+        finally:
+            udf_master.give_back.remote(index)
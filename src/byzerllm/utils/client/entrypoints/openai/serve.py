@@ -130,7 +130,7 @@ async def embed(body: Embeddings):
     """
     embedding_id = f"embed-{random_uuid()}"
 
-    results_list = llm_client.emb(body.model, request=LLMRequest(instruction=body.input))
+    results_list = await llm_client.aemb(body.model, request=LLMRequest(instruction=body.input))
     tokens = 0
 
     return EmbeddingsOutput(
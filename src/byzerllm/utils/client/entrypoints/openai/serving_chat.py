@@ -1,6 +1,5 @@
 # Adapted from
 # vLLM project
-import asyncio
 import time
 from fastapi import Request
 from typing import AsyncGenerator, Union, Optional
@@ -55,7 +54,7 @@ class OpenAIServingChat(OpenAIServing):
             - function_call (Users should implement this by themselves)
         """
         if body.prompt_template:
-            self.llm_client.setup_template(body.model, self._detect_prompt_template(body.prompt_template))
+            await self.llm_client.asetup_template(body.model, self._detect_prompt_template(body.prompt_template))
 
         request_id = f"cmpl-{random_uuid()}"
 
@@ -177,30 +176,22 @@ class OpenAIServingChat(OpenAIServing):
             request_id: str
     ) -> Union[ErrorResponse, ChatCompletionResponse]:
 
-        async def wrapper_chat_generator():
-            r = self.llm_client.chat_oai(
-                model=model_name,
-                conversations=body.messages,
-                llm_config={
-                    "gen.request_id": request_id,
-                    **body.to_llm_config()
-                }
-            )
-            for _ in r:
-                yield _
-
-        result_generator = await asyncio.to_thread(wrapper_chat_generator)
-
         model_name = body.model
         created_time = int(time.time())
-        final_res = None
-
-        async for res in result_generator:
-            if await request.is_disconnected():
-                # Abort the request if the client disconnects.
-                await self.llm_client.abort(request_id, model=model_name)
-                return self.create_error_response("Client disconnected")
-            final_res = res
+
+        results = await self._chat_until_done(
+            request,
+            request_id,
+            model_name,
+            conversations=body.messages,
+            llm_config={
+                "gen.request_id": request_id,
+                **body.to_llm_config()
+            }
+        )
+        if results is None:
+            return self.create_error_response("Client disconnected")
+        final_res = results[-1] if results else None
         assert final_res is not None
 
         choices = []
@@ -1,7 +1,6 @@
 # Adapted from
 # vLLM project
 
-import asyncio
 import time
 from typing import AsyncGenerator, Optional
 
@@ -55,7 +54,7 @@ class OpenAIServingCompletion(OpenAIServing):
         echo_without_generation = body.echo and body.max_tokens == 0
 
         if body.prompt_template:
-            self.llm_client.setup_template(body.model, self._detect_prompt_template(body.prompt_template))
+            await self.llm_client.asetup_template(body.model, self._detect_prompt_template(body.prompt_template))
 
         model_name = body.model
         request_id = f"cmpl-{random_uuid()}"
@@ -67,31 +66,24 @@ class OpenAIServingCompletion(OpenAIServing):
             return self.completion_stream_generator(body, request_id, created_time)
 
         # Non-streaming response
-        async def wrapper_chat_generator():
-            r = self.llm_client.chat_oai(
-                model=model_name,
-                conversations=[
-                    {
-                        "role": "user",
-                        "content": body.prompt
-                    }
-                ],
-                llm_config={
-                    "gen.request_id": request_id,
-                    **body.to_llm_config()
+        results = await self._chat_until_done(
+            request,
+            request_id,
+            model_name,
+            conversations=[
+                {
+                    "role": "user",
+                    "content": body.prompt
                 }
-            )
-            for _ in r:
-                yield _
-
-        result_generator = await asyncio.to_thread(wrapper_chat_generator)
-        final_res = None
-        async for res in result_generator:
-            if await request.is_disconnected():
-                # Abort the request if the client disconnects.
-                await self.llm_client.abort(request_id, model=model_name)
-                return self.create_error_response("Client disconnected")
-            final_res = res
+            ],
+            llm_config={
+                "gen.request_id": request_id,
+                **body.to_llm_config()
+            }
+        )
+        if results is None:
+            return self.create_error_response("Client disconnected")
+        final_res = results[-1] if results else None
         assert final_res is not None
         choices = []
 
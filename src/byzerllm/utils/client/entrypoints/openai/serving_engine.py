@@ -3,13 +3,14 @@
 # Adapted from
 # vLLM project
 
+import asyncio
 import json
 from dataclasses import dataclass
 from http import HTTPStatus
 from typing import Dict, List, Optional, Union
 
 from byzerllm.log import init_logger
-from byzerllm.utils.client import ByzerLLM, Templates
+from byzerllm.utils.client import ByzerLLM, LLMResponse, Templates
 from byzerllm.utils.client.entrypoints.openai.protocol import (
     CompletionRequest,
     ChatCompletionRequest,
@@ -117,8 +118,31 @@ class OpenAIServing:
         })
         return json_str
 
+    async def _chat_until_done(
+            self,
+            request,
+            request_id: str,
+            model_name: str,
+            **kwargs
+    ) -> Optional[List[LLMResponse]]:
+        """Run achat_oai and abort it when the client disconnects before it is done.
+        Returns None if the client disconnected.
+        """
+        task = asyncio.ensure_future(self.llm_client.achat_oai(model=model_name, **kwargs))
+        while True:
+            done, _ = await asyncio.wait([task], timeout=1.0)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                try:
+                    await self.llm_client.aabort(request_id, model=model_name)
+                except Exception as e:
+                    logger.warning(f"Fail to abort request {request_id}: {e}")
+                return None
+
     async def _check_model(self, body) -> Optional[ErrorResponse]:
-        if self.llm_client.is_model_exist(body.model):
+        if await self.llm_client.ais_model_exist(body.model):
             return
         return self.create_error_response(
             message=f"The model `{body.model}` does not exist.",
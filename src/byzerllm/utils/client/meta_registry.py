@@ -0,0 +1,117 @@
+import copy
+import time
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import ray
+
+META_REGISTRY_ACTOR_NAME = "BYZERLLM_META_REGISTRY"
+
+
+class MetaRegistryActor:
+    '''
+    keeps the model meta for all the clients of the cluster, so a client in a
+    new process asks this actor instead of the model workers.
+    '''
+    def __init__(self):
+        self.metas:Dict[str,Tuple[Dict[str,Any],float]] = {}
+
+    def get(self, model:str)->Optional[Tuple[Dict[str,Any],float]]:
+        v = self.metas.get(model,None)
+        if v is None or v[1] < time.time():
+            self.metas.pop(model,None)
+            return None
+        return v
+
+    def put(self, model:str, meta:Dict[str,Any], expire_time:float):
+        self.metas[model] = (meta,expire_time)
+
+    def invalidate(self, model:str):
+        self.metas.pop(model,None)
+
+
+class ModelMetaRegistry:
+    '''
+    The model meta (max_model_len, backend, support_chat_template...) shared by
+    all the ByzerLLM instances of the process. An entry lives `ttl` seconds and
+    is dropped when the model is deployed or undeployed.
+
+    With `use_ray_actor` the entries are also kept in a detached named actor,
+    so the clients of other processes (e.g. the ray workers of the agents)
+    find them there. Invalidation removes the entry from the actor too; the
+    other processes keep their local copy until it expires.
+
+    The callers get their own copy of the meta, changing it does not change
+    the cached one.
+    '''
+    def __init__(self, ttl:float=300, use_ray_actor:bool=False):
+        self.ttl = ttl
+        self.use_ray_actor = use_ray_actor
+        self.metas:Dict[str,Tuple[Dict[str,Any],float]] = {}
+        self.lock = threading.Lock()
+        self.actor = None
+
+    def setup(self, ttl:float=300, use_ray_actor:bool=False):
+        # the cached entries keep their expire time
+        with self.lock:
+            self.ttl = ttl
+            self.use_ray_actor = use_ray_actor
+            self.actor = None
+
+    def _get_actor(self):
+        if self.actor is None:
+            self.actor = ray.remote(MetaRegistryActor).options(name=META_REGISTRY_ACTOR_NAME,
+                                                                lifetime="detached",
+                                                                get_if_exists=True,
+                                                                num_cpus=0).remote()
+        return self.actor
+
+    def _get_local(self, model:str)->Optional[Dict[str,Any]]:
+        with self.lock:
+            v = self.metas.get(model,None)
+            if v is None:
+                return None
+            if v[1] < time.time():
+                del self.metas[model]
+                return None
+            return v[0]
+
+    def _put_local(self, model:str, meta:Dict[str,Any], expire_time:float):
+        with self.lock:
+            self.metas[model] = (meta,expire_time)
+
+    def get(self, model:str)->Optional[Dict[str,Any]]:
+        meta = self._get_local(model)
+        if meta is not None or not self.use_ray_actor:
+            return copy.deepcopy(meta)
+        v = ray.get(self._get_actor().get.remote(model))
+        if v is None:
+            return None
+        self._put_local(model,*v)
+        return copy.deepcopy(v[0])
+
+    async def aget(self, model:str)->Optional[Dict[str,Any]]:
+        meta = self._get_local(model)
+        if meta is not None or not self.use_ray_actor:
+            return copy.deepcopy(meta)
+        v = await self._get_actor().get.remote(model)
+        if v is None:
+            return None
+        self._put_local(model,*v)
+        return copy.deepcopy(v[0])
+
+    def put(self, model:str, meta:Dict[str,Any])->Dict[str,Any]:
+        expire_time = time.time() + self.ttl
+        self._put_local(model,copy.deepcopy(meta),expire_time)
+        if self.use_ray_actor:
+            self._get_actor().put.remote(model,meta,expire_time)
+        return meta
+
+    def invalidate(self, model:str):
+        with self.lock:
+            self.metas.pop(model,None)
+        if self.use_ray_actor:
+            ray.get(self._get_actor().invalidate.remote(model))
+
+
+meta_registry = ModelMetaRegistry()
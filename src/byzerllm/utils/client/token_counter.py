@@ -0,0 +1,116 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from byzerllm.utils.tokenizer import get_real_tokenizer
+
+
+def load_local_tokenizer(tokenizer:Union[str,Any]):
+    '''
+    tokenizer can be a tokenizer object (a vLLM TokenizerGroup is unwrapped the
+    same way as the model worker does) or a local path of the model/tokenizer.
+    '''
+    if isinstance(tokenizer,str):
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer,trust_remote_code=True)
+    return get_real_tokenizer(tokenizer)
+
+
+class TokenCounter:
+    '''
+    Counts the tokens of a prompt for the context length check in ByzerLLM._query.
+
+    The text is split at line boundaries into blocks of about `block_size`
+    characters, greedily from the start, so two prompts sharing a prefix (the
+    system prompt and the history of a conversation) share the same leading
+    blocks. The count of every block is kept in an LRU cache keyed by the md5 of
+    the block, and only the missing blocks are sent to `count_func` in one batch.
+    The sum of the blocks may differ from the count of the whole text by a token
+    at each boundary, which is good enough for a length check.
+
+    count_func takes a list of texts and returns their token counts, it is
+    either a local tokenizer or one remote tokenize request to the model.
+    '''
+    def __init__(self, count_func:Callable[[List[str]],List[int]],
+                 cache_size:int=10000,
+                 block_size:int=1024,
+                 acount_func:Optional[Callable[[List[str]],Awaitable[List[int]]]]=None):
+        self.count_func = count_func
+        self.acount_func = acount_func
+        self.cache_size = cache_size
+        self.block_size = block_size
+        self.cache:"OrderedDict[str,int]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer:Union[str,Any], **kwargs)->"TokenCounter":
+        tokenizer = load_local_tokenizer(tokenizer)
+
+        def count_func(texts:List[str])->List[int]:
+            # special tokens would be counted once per block
+            return [len(ids) for ids in tokenizer(texts,add_special_tokens=False,return_token_type_ids=False)["input_ids"]]
+
+        return cls(count_func, **kwargs)
+
+    def split(self, s:str)->List[str]:
+        blocks = []
+        start = 0
+        while start < len(s):
+            end = s.find("\n", start + self.block_size)
+            end = len(s) if end == -1 else end + 1
+            blocks.append(s[start:end])
+            start = end
+        return blocks
+
+    def _lookup(self, s:str):
+        blocks = self.split(s)
+        keys = [hashlib.md5(block.encode("utf-8")).hexdigest() for block in blocks]
+
+        counts:List[Optional[int]] = []
+        missing = {}
+        with self.lock:
+            for key,block in zip(keys,blocks):
+                v = self.cache.get(key, None)
+                if v is None:
+                    missing[key] = block
+                    self.misses += 1
+                else:
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                counts.append(v)
+        return keys, counts, missing
+
+    def _fill(self, keys:List[str], counts:List[Optional[int]], missing:Dict[str,str], new_counts:List[int])->int:
+        new_counts = dict(zip(missing.keys(), new_counts))
+        with self.lock:
+            for key,v in new_counts.items():
+                self.cache[key] = v
+                self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return sum(new_counts[key] if v is None else v for key,v in zip(keys,counts))
+
+    def count(self, s:str)->int:
+        keys, counts, missing = self._lookup(s)
+        if not missing:
+            return sum(counts)
+        return self._fill(keys, counts, missing, self.count_func(list(missing.values())))
+
+    async def acount(self, s:str)->int:
+        '''
+        the same as count, the missing blocks are counted by `acount_func` when it
+        is set (a remote tokenize request awaited on the event loop).
+        '''
+        keys, counts, missing = self._lookup(s)
+        if not missing:
+            return sum(counts)
+        texts = list(missing.values())
+        new_counts = await self.acount_func(texts) if self.acount_func else self.count_func(texts)
+        return self._fill(keys, counts, missing, new_counts)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
@@ -0,0 +1,76 @@
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import ray
+
+
+class NoLiveWorkerError(Exception):
+    pass
+
+
+class WorkerLease:
+    '''
+    A set of model workers borrowed from the UDFMaster of a model and kept by
+    the client, so the requests are sent to the workers directly instead of
+    asking the master for a worker (and giving it back) every time.
+
+    The workers are async actors, so every leased worker accepts up to
+    `max_inflight` requests at the same time. A request goes to the leased
+    worker with the fewest in-flight requests and blocks only when all of them
+    are full. A worker that died is dropped from the lease and never given back
+    to the master; once no worker is left acquire raises NoLiveWorkerError and
+    the client goes back to the master.
+    '''
+    def __init__(self, udf_master:Any, workers:List[Tuple[int,Any]], max_inflight:int=8):
+        self.udf_master = udf_master
+        self.max_inflight = max_inflight
+        self.workers:Dict[int,Any] = {index:worker for index,worker in workers}
+        self.inflight:Dict[int,int] = {index:0 for index,_ in workers}
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dead = set()
+
+    @classmethod
+    def create(cls, udf_master:Any, num_workers:int=1, max_inflight:int=8)->"WorkerLease":
+        # borrow the workers concurrently, the master blocks until a worker is free
+        workers = ray.get([udf_master.get.remote(-1) for _ in range(num_workers)])
+        return cls(udf_master, [(index,worker) for index,worker in workers], max_inflight=max_inflight)
+
+    def acquire(self, timeout:Optional[float]=None)->Tuple[int,Any]:
+        with self.cond:
+            while True:
+                if self.closed or not self.workers:
+                    raise NoLiveWorkerError("the worker lease is closed or has no live worker")
+                index = min(self.inflight, key=self.inflight.get)
+                if self.inflight[index] < self.max_inflight:
+                    self.inflight[index] += 1
+                    return index, self.workers[index]
+                if not self.cond.wait(timeout):
+                    raise TimeoutError(f"no leased worker is available in {timeout} seconds")
+
+    def release(self, index:int):
+        with self.cond:
+            if index in self.inflight:
+                self.inflight[index] -= 1
+            self.cond.notify()
+
+    def invalidate(self, index:int):
+        with self.cond:
+            # the master must not hand the dead worker out again, so it is not given back
+            if self.workers.pop(index, None) is not None:
+                self.dead.add(index)
+            self.inflight.pop(index, None)
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            indexes = list(self.workers.keys())
+            self.workers.clear()
+            self.inflight.clear()
+            self.cond.notify_all()
+        try:
+            ray.get([self.udf_master.give_back.remote(index) for index in indexes])
+        except Exception:
+            # the master is gone together with its workers
+            pass
@@ -0,0 +1,124 @@
+import time
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, Hashable, List, Optional
+
+from byzerllm.utils.langutil import asyncfy_with_semaphore
+
+
+class _PendingRequest:
+    def __init__(self, item:Any, num_tokens:int, group:Hashable, future:asyncio.Future):
+        self.item = item
+        self.num_tokens = num_tokens
+        self.group = group
+        self.future = future
+        self.enqueue_time = time.monotonic()
+
+
+class DynamicBatcher:
+    '''
+    Collects the requests submitted on the event loop and runs them with
+    `batch_func` in batches, one batch at a time in a worker thread.
+
+    A batch is started when `max_batch_size` requests of the same group are
+    waiting or when the oldest request has waited `max_wait_ms`. Only requests
+    of the same group (e.g. the same sampling parameters) are batched together.
+
+    The oldest waiting request always goes into the next batch, so a request is
+    never starved by later requests of a busier group (FIFO fairness). The next
+    requests of its group are added in arrival order while the padded size of
+    the batch, `len(batch) * max(num_tokens)`, stays within `max_batch_tokens`.
+
+    batch_func takes a list of items and returns a list of results in the same
+    order. If it raises, every request of the batch gets the exception.
+    '''
+    def __init__(self, batch_func:Callable[[List[Any]],List[Any]],
+                 max_batch_size:int=8,
+                 max_wait_ms:float=10.0,
+                 max_batch_tokens:int=16384):
+        self.batch_func = batch_func
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_batch_tokens = max_batch_tokens
+        self.pending:Deque[_PendingRequest] = deque()
+        self.new_request:Optional[asyncio.Event] = None
+        self.scheduler:Optional[asyncio.Task] = None
+        self.batches = 0
+        self.requests = 0
+
+    async def submit(self, item:Any, num_tokens:int=1, group:Hashable=None)->Any:
+        self._ensure_scheduler()
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(_PendingRequest(item, num_tokens, group, future))
+        self.new_request.set()
+        return await future
+
+    def _ensure_scheduler(self):
+        # created lazily so the batcher can be built outside of the event loop
+        if self.scheduler is None or self.scheduler.done():
+            self.new_request = asyncio.Event()
+            self.scheduler = asyncio.get_running_loop().create_task(self._schedule())
+
+    def _group_size(self, group:Hashable)->int:
+        return sum(1 for request in self.pending if request.group == group)
+
+    def _next_batch(self)->List[_PendingRequest]:
+        head = self.pending[0]
+        batch = [head]
+        max_tokens = head.num_tokens
+        for request in list(self.pending)[1:]:
+            if len(batch) >= self.max_batch_size:
+                break
+            if request.group != head.group:
+                continue
+            new_max_tokens = max(max_tokens, request.num_tokens)
+            if new_max_tokens * (len(batch) + 1) > self.max_batch_tokens:
+                continue
+            batch.append(request)
+            max_tokens = new_max_tokens
+        for request in batch:
+            self.pending.remove(request)
+        return batch
+
+    async def _schedule(self):
+        while True:
+            if not self.pending:
+                self.new_request.clear()
+                await self.new_request.wait()
+                continue
+
+            head = self.pending[0]
+            deadline = head.enqueue_time + self.max_wait_ms / 1000
+            while self._group_size(head.group) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self.new_request.clear()
+                try:
+                    await asyncio.wait_for(self.new_request.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = [request for request in self._next_batch() if not request.future.cancelled()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            try:
+                results = await asyncfy_with_semaphore(lambda: self.batch_func([request.item for request in batch]))()
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+            for request, result in zip(batch, results):
+                if not request.future.done():
+                    request.future.set_result(result)
+
+    def stats(self):
+        return {
+            "pending": len(self.pending),
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+        }
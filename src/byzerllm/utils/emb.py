@@ -1,6 +1,7 @@
 from langchain.embeddings.base import Embeddings
 from typing import List, Union
 import torch
+import numpy as np
 import torch.nn.functional as F
 from transformers import pipeline
 
@@ -21,8 +22,11 @@ class ByzerSentenceTransformerEmbeddings(Embeddings):
         
         
     def _encode(self,texts: List[str],extract_params={}):        
-        embeddings = [emb.tolist() for emb in self.model.encode(texts,**extract_params)]
-        return embeddings
+        params = {k:v for k,v in extract_params.items() if k != "embedding_format"}
+        embeddings = self.model.encode(texts,convert_to_numpy=True,**params)
+        if extract_params.get("embedding_format","list") == "ndarray":
+            return embeddings.astype(np.float32,copy=False)
+        return [emb.tolist() for emb in embeddings]
         
     def embed_documents(self, texts: List[str],extract_params={}) -> List[List[float]]:        
         embeddings = self._encode(texts,extract_params)
@@ -53,11 +57,17 @@ class ByzerLLMEmbeddings(Embeddings):
         if self.pipeline:
             return [self.pipeline(text)[0][-1] for text in texts]
         else:
-            _, embeddings = self.get_embedding_with_token_count(texts)
-            embeddings = embeddings.detach().cpu()
-            embeddings = embeddings.numpy()
-            embeddings = [emb.tolist() for emb in embeddings]
-            return embeddings
+            # one padded forward pass per batch
+            batch_size = int(extract_params.get("batch_size",32))
+            embeddings = []
+            for i in range(0,len(texts),batch_size):
+                with torch.no_grad():
+                    _, batch = self.get_embedding_with_token_count(texts[i:i+batch_size])
+                embeddings.append(batch.detach().cpu().float().numpy())
+            embeddings = np.concatenate(embeddings) if embeddings else np.zeros((0,0),dtype=np.float32)
+            if extract_params.get("embedding_format","list") == "ndarray":
+                return embeddings
+            return embeddings.tolist()
         
     def embed_documents(self, texts: List[str],extract_params={}) -> List[List[float]]:        
         embeddings = self._encode(texts,extract_params)
@@ -1,9 +1,17 @@
 import json
-from typing import Any, Dict, List, Union
+import re
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 class JSONParser:
+    # Up to this size the repairs copy the string, above it the first repair moves
+    # the string to a gap buffer. Copying a short string is cheaper than the
+    # bookkeeping of the gap buffer on every read.
+    GAP_BUFFER_MIN_SIZE = 128 * 1024
+
     def __init__(self, json_str: str) -> None:
-        # The string to parse
+        # The string to parse, a plain string until a long one needs a repair, then
+        # a gap buffer: the repairs insert and remove characters next to the index,
+        # which is O(1) there instead of copying the string
         self.json_str = json_str
         # Index is our iterator that will keep track of which character we are looking at right now
         self.index = 0
@@ -17,6 +25,11 @@ class JSONParser:
         self,
     ) -> Union[Dict[str, Any], List[Any], str, float, int, bool, None]:
         char = self.get_char_at()
+        # skip what can not start a value, a loop instead of the recursion of the last branch
+        # below, so a long prose before the json does not hit the recursion limit
+        while char is not False and not self._can_start_value(char):
+            self.index += 1
+            char = self.get_char_at()
         # False means that we are at the end of the string provided, is the base case for recursion
         if char is False:
             return ""
@@ -238,7 +251,7 @@ class JSONParser:
         else:
             self.index += 1
 
-        return self.json_str[start:end]
+        return self._slice(start, end)
 
     def parse_number(self) -> Union[float, int, str]:
         # <number> is a valid real number expressed in one of a number of given formats
@@ -268,44 +281,121 @@ class JSONParser:
         # <boolean> is one of the literal strings 'true', 'false', or 'null' (unquoted)
         boolean_map = {"true": (True, 4), "false": (False, 5), "null": (None, 4)}
         for key, (value, length) in boolean_map.items():
-            if self.json_str.lower().startswith(key, self.index):
+            if self._slice(self.index, self.index + length).lower() == key:
                 self.index += length
                 return value
 
         # This is a string then
         return self.parse_string()
 
+    def _can_start_value(self, char: str) -> bool:
+        return (char in '{["\'“' or char.isdigit() or char == "-" or char.isalpha()
+                or (char == "}" and self.context == "object_value"))
+
+    @property
+    def json_str(self) -> str:
+        if self._plain:
+            return self._tail
+        return "".join(self._left) + self._tail[self._gap + self._shift:]
+
+    @json_str.setter
+    def json_str(self, json_str: str) -> None:
+        # the repaired characters before the gap, the rest is read from the input
+        # string: the character at position p >= gap is _tail[p + _shift]. The gap
+        # only moves forward, with the index, so the input is copied once.
+        # While _plain is set _tail is the whole string and there is no gap.
+        self._plain = True
+        self._left: List[str] = []
+        self._gap = 0
+        self._tail = json_str
+        self._shift = 0
+
+    def _size(self) -> int:
+        return len(self._tail) - self._shift
+
+    def _advance_gap(self, pos: int) -> None:
+        if pos > self._gap:
+            self._left.extend(self._tail[self._gap + self._shift:pos + self._shift])
+            self._gap = pos
+
+    def _to_gap_buffer(self) -> bool:
+        # returns whether the edits go to the gap buffer
+        if self._plain and len(self._tail) > self.GAP_BUFFER_MIN_SIZE:
+            self._plain = False
+        return not self._plain
+
+    def _slice(self, start: int, end: int) -> str:
+        if self._plain:
+            return self._tail[max(0, start):max(0, end)]
+        size = self._size()
+        start, end = max(0, min(start, size)), max(0, min(end, size))
+        if start >= end:
+            return ""
+        gap = self._gap
+        if start >= gap:
+            return self._tail[start + self._shift:end + self._shift]
+        left = "".join(self._left[start:min(end, gap)])
+        if end <= gap:
+            return left
+        return left + self._tail[gap + self._shift:end + self._shift]
+
     def insert_char_at(self, char: str) -> None:
-        self.json_str = self.json_str[: self.index] + char + self.json_str[self.index :]
+        if not self._to_gap_buffer():
+            self._tail = self._tail[:self.index] + char + self._tail[self.index:]
+            self.index += 1
+            return
+        pos = min(self.index, self._size())
+        if pos >= self._gap:
+            self._advance_gap(pos)
+            self._left.append(char)
+        else:
+            self._left.insert(pos, char)
+        self._gap += 1
+        self._shift -= 1
         self.index += 1
 
     def get_char_at(self, count: int = 0) -> Union[str, bool]:
         # Why not use something simpler? Because we might be out of bounds and doing this check all the time is annoying
-        try:
-            return self.json_str[self.index + count]
-        except IndexError:
-            return False
+        pos = self.index + count
+        if self._plain:
+            try:
+                return self._tail[pos]
+            except IndexError:
+                return False
+        if pos >= self._gap:
+            try:
+                return self._tail[pos + self._shift]
+            except IndexError:
+                return False
+        if pos < 0:
+            # negative positions count from the end, as indexing the string did
+            pos += self._size()
+            if pos < 0:
+                return False
+            if pos >= self._gap:
+                return self._tail[pos + self._shift]
+        return self._left[pos]
 
     def remove_char_at(self, count: int = 0) -> None:
-        self.json_str = (
-            self.json_str[: self.index + count]
-            + self.json_str[self.index + count + 1 :]
-        )
+        pos = self.index + count
+        if not 0 <= pos < self._size():
+            return
+        if not self._to_gap_buffer():
+            self._tail = self._tail[:pos] + self._tail[pos + 1:]
+            return
+        if pos >= self._gap:
+            self._advance_gap(pos)
+        else:
+            del self._left[pos]
+            self._gap -= 1
+        self._shift += 1
 
     def skip_whitespaces_at(self) -> None:
         # Remove trailing spaces
-        # I'd rather not do this BUT this method is called so many times that it makes sense to expand get_char_at
-        # At least this is what the profiler said and I believe in our lord and savior the profiler
-        try:
-            char = self.json_str[self.index]
-        except IndexError:
-            return
+        char = self.get_char_at()
         while char and char.isspace():
             self.index += 1
-            try:
-                char = self.json_str[self.index]
-            except IndexError:
-                return
+            char = self.get_char_at()
 
 
 def repair_json(
@@ -351,4 +441,179 @@ def loads(
     This function works like `json.loads()` except that it will fix your JSON in the process.
     It is a wrapper around the `repair_json()` function with `return_objects=True`.
     """
-    return repair_json(json_str, True)
\ No newline at end of file
+    return repair_json(json_str, True)
+
+_JSON_FENCE = re.compile(r"```[ \t]*json[ \t]*\r?\n")
+_JSON_FENCE_LINE = re.compile(r"```[ \t]*json[ \t]*\r?$")
+_NOT_PARSED = object()
+
+
+def _find_json(text: str) -> Tuple[Optional[str], Any]:
+    # the json string and, when it was parsed on the way, its value (else _NOT_PARSED)
+    stripped = text.strip()
+    if stripped[:1] in ("{", "["):
+        try:
+            return stripped, json.loads(stripped)
+        except json.JSONDecodeError:
+            pass
+
+    fence = None
+    for fence in _JSON_FENCE.finditer(text):
+        pass
+    if fence is not None:
+        end = text.find("```", fence.end())
+        return (text[fence.end():] if end == -1 else text[fence.end():end]), _NOT_PARSED
+
+    if stripped[:1] in ("{", "["):
+        return stripped, _NOT_PARSED
+    if "```" in text:
+        return None, _NOT_PARSED
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    return (text[min(starts):] if starts else None), _NOT_PARSED
+
+
+def extract_json_str(text: str) -> Optional[str]:
+    """
+    Finds the json in an LLM output with a few linear scans: the whole output when
+    it is valid json, else the content of the last ```json block (up to the end of
+    the output when the block is not closed), else the whole output when it starts
+    with `{` or `[`, else the text from the first `{` or `[` when the output has no
+    code block at all. Returns None otherwise.
+    """
+    return _find_json(text)[0]
+
+
+def extract_json(text: str) -> Union[Dict[str, Any], List[Any], str, float, int, bool, None]:
+    """
+    The json value of an LLM output, repaired when it does not parse.
+    Raises ValueError when the output has no json.
+    """
+    json_str, value = _find_json(text)
+    if json_str is None:
+        raise ValueError("No json block found")
+    if value is not _NOT_PARSED:
+        return value
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError:
+        return JSONParser(json_str).parse()
+
+
+class JSONStreamParser:
+    """
+    Follows a streamed LLM output chunk by chunk and tells when its first top level
+    json object or array is closed. Every character is looked at once, only the
+    nesting depth and the string/escape state are kept, so the cost of a chunk
+    does not depend on what was received before. Quoted text is skipped from
+    the first character on, so a bracket quoted in the prose does not start the
+    value, and a ```json line starts the value over after it. The closed value is parsed
+    (and repaired when needed) and, with a `response_class`, validated right away,
+    so the caller can stop the generation. `close()` repairs an unfinished value.
+
+        parser = JSONStreamParser(response_class=Answer)
+        for chunk, _ in llm.stream_chat_oai(conversations, delta_mode=True):
+            if parser.feed(chunk):
+                break
+        answer = parser.close()
+
+    It is a standalone helper, the streaming chat methods do not use it: the
+    caller feeds it the delta texts and decides what to do once it is done.
+    """
+
+    def __init__(self, response_class: Optional[Any] = None) -> None:
+        self.response_class = response_class
+        self.chunks: List[str] = []
+        self.size = 0
+        self.start = -1
+        self.end = -1
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        # the pieces of the current line, to spot a ```json line
+        self.line: List[str] = []
+        self.value = None
+        self.error: Optional[Exception] = None
+
+    @property
+    def done(self) -> bool:
+        return self.end != -1
+
+    @property
+    def text(self) -> str:
+        if len(self.chunks) > 1:
+            self.chunks = ["".join(self.chunks)]
+        return self.chunks[0] if self.chunks else ""
+
+    def feed(self, chunk: str) -> bool:
+        """Adds a chunk, returns whether the json value is complete."""
+        if self.done:
+            return True
+        offset = self.size
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        line_start = 0
+        for i, char in enumerate(chunk):
+            if char == "\n" and (self.start == -1 or not self.in_string):
+                self.line.append(chunk[line_start:i])
+                line_start = i + 1
+                self._end_line()
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                if self.start == -1:
+                    self.start = offset + i
+                self.depth += 1
+            elif char in "}]" and self.start != -1:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = offset + i + 1
+                    self._finish(self.text[self.start:self.end])
+                    return True
+        self.line.append(chunk[line_start:])
+        return False
+
+    def _end_line(self) -> None:
+        line = "".join(self.line)
+        self.line = []
+        if _JSON_FENCE_LINE.search(line):
+            # a ```json line outside of a string: whatever was opened before it was prose
+            self.start = -1
+            self.depth = 0
+        if self.start == -1:
+            # a json string never spans lines, an open quote was a stray one of the prose
+            self.in_string = False
+            self.escape = False
+
+    def partial(self) -> Union[Dict[str, Any], List[Any], str, float, int, bool, None]:
+        """The value received so far, with the missing quotes and brackets added."""
+        if self.start == -1:
+            return None
+        return JSONParser(self.text[self.start:]).parse()
+
+    def close(self) -> Any:
+        """The final value: the validated response_class instance when one is given."""
+        if not self.done and self.start != -1:
+            self._finish(self.text[self.start:])
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def _finish(self, json_str: str) -> None:
+        try:
+            try:
+                value = json.loads(json_str)
+            except json.JSONDecodeError:
+                value = JSONParser(json_str).parse()
+            if self.response_class is not None:
+                value = self.response_class.parse_obj(value)
+            self.value = value
+            self.error = None
+        except Exception as e:
+            self.error = e
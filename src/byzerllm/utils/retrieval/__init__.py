@@ -2,10 +2,23 @@
 import ray 
 from ray.types import ObjectRef
 from byzerllm.records import ClusterSettings, EnvSettings, JVMSettings, TableSettings,SearchQuery,ResourceRequirementSettings,ResourceRequirement
-from typing import List,Dict,Any,Optional,Union
+from typing import List,Dict,Any,Optional,Union,Tuple
 import byzerllm.utils.object_store_ref_util as ref_utils
 import json
 
+def _vectors_to_json(matrix)->List[str]:
+    import io
+    import numpy as np
+    matrix = np.asarray(matrix,dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1,-1)
+    if matrix.shape[0] == 0:
+        return []
+    buf = io.StringIO()
+    # 9 significant digits are enough to restore the float32 values exactly
+    np.savetxt(buf,matrix,fmt="%.9g",delimiter=",")
+    return [f"[{line}]" for line in buf.getvalue().splitlines()]
+
 class ClusterBuilder:
 
     def __init__(self,br:'ByzerRetrieval') -> None:
@@ -108,10 +121,19 @@ class ClusterBuilder:
 
 class ByzerRetrieval:
     
-    def __init__(self):
+    def __init__(self,strict:bool=False):
+        '''
+        the table settings of every cluster are cached, so checking that a table exists
+        before build/commit/... does not fetch the cluster info every time. A table
+        missing in the cache is looked up again, tables created by other clients are
+        found. With strict=True the cluster info is fetched for every check.
+        '''
         self.launched = False
         self.retrieval_gateway = None
         self.clusters = {}
+        self.strict = strict
+        # cluster name -> {(database,table):TableSettings}
+        self.table_settings_cache:Dict[str,Dict[Tuple[str,str],TableSettings]] = {}
 
     def launch_gateway(self)-> ray.actor.ActorHandle:
         
@@ -191,21 +213,35 @@ class ByzerRetrieval:
         except ValueError:
             return False
     
-    def get_table_settings(self,cluster_name:str, database:str, table:str) -> Optional[TableSettings]:               
+    def _load_table_settings(self,cluster_name:str) -> Dict[Tuple[str,str],TableSettings]:
         cluster_info = self.cluster_info(cluster_name)
-        target_table_settings = None
-        for table_settings_dict in cluster_info["tableSettingsList"]:
-            table_settings = TableSettings(**table_settings_dict)
-            if table_settings.database == database and table_settings.table == table:
-                target_table_settings = table_settings
-                break        
-        return target_table_settings
+        table_settings_dict = {}
+        for item in cluster_info["tableSettingsList"]:
+            table_settings = TableSettings(**item)
+            table_settings_dict[(table_settings.database,table_settings.table)] = table_settings
+        if not self.strict:
+            self.table_settings_cache[cluster_name] = table_settings_dict
+        return table_settings_dict
+
+    def invalidate_table_settings(self,cluster_name:Optional[str]=None):
+        if cluster_name is None:
+            self.table_settings_cache.clear()
+        else:
+            self.table_settings_cache.pop(cluster_name,None)
+
+    def get_table_settings(self,cluster_name:str, database:str, table:str) -> Optional[TableSettings]:               
+        if not self.strict:
+            table_settings = self.table_settings_cache.get(cluster_name,{}).get((database,table),None)
+            if table_settings is not None:
+                return table_settings
+        return self._load_table_settings(cluster_name).get((database,table),None)
     
     def check_table_exists(self,cluster_name:str, database:str, table:str) -> bool:
         return self.get_table_settings(cluster_name,database,table) is not None
         
     
     def restore_from_cluster_info(self,cluster_info:Dict[str,Any]) -> bool:        
+        self.invalidate_table_settings()
         return ray.get(self.retrieval_gateway.restoreFromClusterInfo.remote(json.dumps(cluster_info,ensure_ascii=False)))
 
     def create_table(self,cluster_name:str, tableSettings:TableSettings)-> bool:
@@ -214,7 +250,9 @@ class ByzerRetrieval:
             raise Exception(f"Table {tableSettings.database}.{tableSettings.table} already exists in cluster {cluster_name}")
 
         cluster = self.cluster(cluster_name)
-        return ray.get(cluster.createTable.remote(tableSettings.json()))     
+        v = ray.get(cluster.createTable.remote(tableSettings.json()))
+        self.invalidate_table_settings(cluster_name)
+        return v
 
     def build(self, cluster_name:str, database:str, table:str, object_refs:List[ObjectRef[str]])-> bool:
         
@@ -227,14 +265,76 @@ class ByzerRetrieval:
         locations = ref_utils.get_locations(object_refs)
         return ray.get(cluster.buildFromRayObjectStore.remote(database,table,data_ids,locations))
     
-    def build_from_dicts(self, cluster_name:str, database:str, table:str, data:List[Dict[str,Any]])-> bool:
-        data_refs = []
+    def _build_in_blocks(self, cluster_name:str, database:str, table:str, num_rows:int,
+                         serialize_block, block_rows:int)-> bool:
+        '''
+        builds the table with one buildFromRayObjectStore call per block of `block_rows` rows.
+        The rows of the next block are serialized and put to the object store by a worker
+        thread while the current block is ingested, and the objects of a block are released
+        once it is ingested, so at most two blocks of rows are held in the object store
+        instead of the whole data. Every object is still one json document as the builder expects.
+        '''
+        from concurrent.futures import ThreadPoolExecutor
+        if not self.check_table_exists(cluster_name,database,table):
+            raise Exception(f"Table {database}.{table} not exists in cluster {cluster_name}")
+        if num_rows == 0:
+            return self.build(cluster_name,database,table,[])
 
-        for item in data:
-            itemref = ray.put(json.dumps(item ,ensure_ascii=False))
-            data_refs.append(itemref)
-        
-        return self.build(cluster_name,database,table,data_refs)
+        block_rows = max(1,block_rows)
+        cluster = self.cluster(cluster_name)
+
+        def put_block(start:int):
+            return [ray.put(value) for value in serialize_block(start,min(start+block_rows,num_rows))]
+
+        starts = list(range(0,num_rows,block_rows))
+        result = True
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_refs = executor.submit(put_block,starts[0])
+            for i in range(len(starts)):
+                refs = next_refs.result()
+                if i + 1 < len(starts):
+                    next_refs = executor.submit(put_block,starts[i+1])
+                data_ids = ref_utils.get_object_ids(refs)
+                locations = ref_utils.get_locations(refs)
+                v = ray.get(cluster.buildFromRayObjectStore.remote(database,table,data_ids,locations))
+                result = result and v
+                del refs
+        return result
+
+    def build_from_dicts(self, cluster_name:str, database:str, table:str, data:List[Dict[str,Any]],
+                         block_rows:int=10000)-> bool:
+        def serialize_block(start:int, end:int):
+            return [json.dumps(item ,ensure_ascii=False) for item in data[start:end]]
+        return self._build_in_blocks(cluster_name,database,table,len(data),serialize_block,block_rows)
+
+    def build_from_arrays(self, cluster_name:str, database:str, table:str, 
+                          data:List[Dict[str,Any]], vectors:Dict[str,Any],
+                          block_rows:int=10000)-> bool:
+        '''
+        like build_from_dicts, but the vector fields are given as float32 matrices,
+        one row per item of data, e.g. the output of ByzerLLM.emb(...,return_ndarray=True).
+        The matrices are formatted to json text in one pass per block instead of going
+        through a list of python floats per row.
+        '''
+        import numpy as np
+        vectors = {field:np.asarray(matrix,dtype=np.float32) for field,matrix in vectors.items()}
+        vectors = {field:matrix.reshape(1,-1) if matrix.ndim == 1 else matrix for field,matrix in vectors.items()}
+        for field,matrix in vectors.items():
+            if len(matrix) != len(data):
+                raise Exception(f"vector field {field} has {len(matrix)} rows but there are {len(data)} items")
+
+        def serialize_block(start:int, end:int):
+            vector_texts = {field:_vectors_to_json(matrix[start:end]) for field,matrix in vectors.items()}
+            values = []
+            for i,item in enumerate(data[start:end]):
+                fields = [f'{json.dumps(field)}:{texts[i]}' for field,texts in vector_texts.items()]
+                value = json.dumps(item ,ensure_ascii=False)
+                if fields:
+                    value = value[:-1] + ("," if item else "") + ",".join(fields) + "}"
+                values.append(value)
+            return values
+
+        return self._build_in_blocks(cluster_name,database,table,len(data),serialize_block,block_rows)
 
     def delete_by_ids(self,cluster_name:str, database:str, table:str,ids:List[Any])-> bool:
 
@@ -245,11 +345,7 @@ class ByzerRetrieval:
         return ray.get(cluster.deleteByIds.remote(database,table,json.dumps(ids,ensure_ascii=False)))
     
     def get_tables(self,cluster_name:str) -> List[TableSettings]:
-        cluster_info = self.cluster_info(cluster_name)
-        target_table_settings = []
-        for table_settings_dict in cluster_info["tableSettingsList"]:
-            target_table_settings.append(TableSettings(**table_settings_dict))
-        return target_table_settings
+        return list(self._load_table_settings(cluster_name).values())
     
     def get_databases(self,cluster_name:str) -> List[str]:
         table_settings_list = self.get_tables(cluster_name)
@@ -263,6 +359,7 @@ class ByzerRetrieval:
         v = ray.get(self.retrieval_gateway.shutdownCluster.remote(cluster_name))
         if cluster_name in self.clusters:
             del self.clusters[cluster_name]        
+        self.invalidate_table_settings(cluster_name)
         return v
             
 
@@ -296,7 +393,9 @@ class ByzerRetrieval:
             raise Exception(f"Table {database}.{table} not exists in cluster {cluster_name}")
 
         cluster = self.cluster(cluster_name)
-        return ray.get(cluster.closeAndDeleteFile.remote(database,table))
+        v = ray.get(cluster.closeAndDeleteFile.remote(database,table))
+        self.invalidate_table_settings(cluster_name)
+        return v
     
     def search_keyword(self,cluster_name:str, 
                        database:str, 
@@ -342,6 +441,13 @@ class ByzerRetrieval:
         v = cluster.filter.remote(f"[{','.join([x.json() for x in search_query])}]")
         return json.loads(ray.get(v))
 
+    async def afilter(self,cluster_name:str,search_query: Union[List[SearchQuery],SearchQuery]) -> List[Dict[str,Any]]:
+        cluster = self.cluster(cluster_name)
+        if isinstance(search_query,SearchQuery):
+            search_query = [search_query]
+        v = cluster.filter.remote(f"[{','.join([x.json() for x in search_query])}]")
+        return json.loads(await v)
+
     def delete_by_filter(self,cluster_name:str, database:str, table:str,filter:Dict[str,Any])-> bool:
         cluster = self.cluster(cluster_name)
         return ray.get(cluster.deleteByFilter.remote(database,table,json.dumps(filter,ensure_ascii=False)))    
@@ -119,13 +119,8 @@ class SimpleRest:
     @app.post("/table/data") 
     def build(self, cluster_name: Annotated[str, Body()], database:Annotated[str, Body()], 
               table:Annotated[str, Body()], data:Annotated[List[Dict[str,Any]], Body()]):        
-        data_refs = []        
-        for item in data:
-            itemref = ray.put(json.dumps(item,ensure_ascii=False))
-            data_refs.append(itemref)
-
         return {
-            "status":self.retrieval.build(cluster_name,database,table,data_refs)
+            "status":self.retrieval.build_from_dicts(cluster_name,database,table,data)
         }
     
     @app.post("/table/commit")
@@ -1,5 +1,7 @@
 from typing import List,Tuple,Any,Dict
 import json
+import asyncio
+import numpy as np
 from byzerllm.utils.tokenizer import get_real_tokenizer
 from .emb import ByzerLLMEmbeddings,ByzerSentenceTransformerEmbeddings
 from byzerllm.utils.langutil import asyncfy_with_semaphore
@@ -21,6 +23,46 @@ class ByzerLLMGenerator:
             else:    
                 self.embedding = ByzerLLMEmbeddings(model,self.tokenizer,use_feature_extraction=use_feature_extraction)
     
+    def _meta(self,meta):
+        # batched embedding requests carry a list of texts in one query, see ByzerLLM.emb
+        if not self.embedding:
+            return meta
+        return [{**item,"support_embed_batch":True} if isinstance(item,dict) else item for item in meta]
+
+    def _merge_embeddings(self,embeddings):
+        # saas models return (embedding,{"metadata":...}) for every text
+        if isinstance(embeddings,tuple) or not any(isinstance(v,tuple) for v in embeddings):
+            return embeddings
+        values = []
+        input_tokens_count = 0
+        for v in embeddings:
+            if isinstance(v,tuple):
+                if isinstance(v[1],dict) and "metadata" in v[1]:
+                    input_tokens_count += v[1]["metadata"].get("input_tokens_count",0)
+                v = v[0]
+            values.append(v)
+        return (values,{"metadata":{"input_tokens_count":input_tokens_count,"generated_tokens_count":0}})
+
+    def embed_documents(self,texts:List[str],extract_params:Dict[str,Any]={}):
+        targets = [getattr(self.embedding,"model",None),self.embedding]
+        for target in targets:
+            if hasattr(target,"embed_documents"):
+                return self._merge_embeddings(target.embed_documents(texts,extract_params=extract_params))
+        for target in targets:
+            if hasattr(target,"embed_query"):
+                return self._merge_embeddings([target.embed_query(text,extract_params=extract_params) for text in texts])
+        raise Exception("This model do not support text emedding service")
+
+    async def async_embed_documents(self,texts:List[str],extract_params:Dict[str,Any]={}):
+        targets = [getattr(self.embedding,"model",None),self.embedding]
+        for target in targets:
+            if hasattr(target,"async_embed_documents"):
+                return self._merge_embeddings(await target.async_embed_documents(texts,extract_params=extract_params))
+        for target in targets:
+            if hasattr(target,"async_embed_query") and not hasattr(target,"embed_documents"):
+                return self._merge_embeddings(await asyncio.gather(*[target.async_embed_query(text,extract_params=extract_params) for text in texts]))
+        return await asyncfy_with_semaphore(lambda:self.embed_documents(texts,extract_params=extract_params))()
+
     def extract_history(self,input)-> List[Dict[str,str]]:
         history = input.get("history",[])
         return history
@@ -48,6 +90,11 @@ class ByzerLLMGenerator:
                     new_params[k[len("gen."):]] = v
                 if k.startswith("generation."):
                     new_params[k[len("generation."):]] = v 
+            if "embedding_format" in query:
+                new_params["embedding_format"] = query["embedding_format"]
+
+            if query.get("embed_batch", False):
+                return self.embed_documents(ins,extract_params=new_params)
             
             if hasattr(self.embedding.model,"embed_query"):
                 return self.embedding.model.embed_query(ins,extract_params=new_params)
@@ -56,8 +103,8 @@ class ByzerLLMGenerator:
         
         if query.get("meta",False):
             if hasattr(self.model,"get_meta"):
-                return self.model.get_meta()
-            return [{"model_deploy_type":"proprietary"}]
+                return self._meta(self.model.get_meta())
+            return self._meta([{"model_deploy_type":"proprietary"}])
 
         if not self.model:
             raise Exception("This model do not support text generation service")
@@ -113,9 +160,14 @@ class ByzerLLMGenerator:
                         new_params[k[len("gen."):]] = v
                     if k.startswith("generation."):
                         new_params[k[len("generation."):]] = v 
+                if "embedding_format" in query:
+                    new_params["embedding_format"] = query["embedding_format"]
 
                 if query.get("embed_rerank", False):
                     return self.embedding.embed_rerank(ins,extract_params=new_params)
+
+                if query.get("embed_batch", False):
+                    return await self.async_embed_documents(ins,extract_params=new_params)
                 
                 if hasattr(self.embedding.model,"async_embed_query"):
                     return await self.embedding.model.async_embed_query(ins,extract_params=new_params)
@@ -129,10 +181,10 @@ class ByzerLLMGenerator:
 
             if query.get("meta",False):
                 if hasattr(self.model,"async_get_meta"):
-                    return await self.model.async_get_meta()
+                    return self._meta(await self.model.async_get_meta())
                 elif hasattr(self.model,"get_meta"):
-                    return await asyncfy_with_semaphore(lambda:self.model.get_meta())()
-                return [{"model_deploy_type":"proprietary"}]
+                    return self._meta(await asyncfy_with_semaphore(lambda:self.model.get_meta())())
+                return self._meta([{"model_deploy_type":"proprietary"}])
 
             if not self.model:
                 raise Exception("This model do not support text generation service")
@@ -173,68 +225,100 @@ class ByzerLLMGenerator:
             return response[-1]
 
 
+def _embedding_result(item:Dict[str,Any],v,ndarrays:List[np.ndarray])->Dict[str,Any]:
+    metadata = {}
+    value = v
+    if isinstance(v,tuple):
+        if isinstance(v[1],dict) and "metadata" in v[1]:
+            metadata = v[1]["metadata"]
+        value = v[0]
+    if item.get("embedding_format","list") == "ndarray" and not item.get("embed_rerank",False):
+        # the float32 array is returned next to the json value, ray puts it in the
+        # object store as is and the client reads it without copying
+        ndarrays.append(np.asarray(value,dtype=np.float32))
+        return {"predict":None,"ndarray":len(ndarrays)-1,"metadata":metadata,"input":item}
+    if isinstance(value,np.ndarray):
+        value = value.tolist()
+    return {"predict":value,"metadata":metadata,"input":item}
+
+def _predict_output(results:List[Dict[str,Any]],ndarrays:List[np.ndarray])->Dict[str,Any]:
+    output = {"value":[json.dumps(results,ensure_ascii=False)]}
+    if ndarrays:
+        output["ndarrays"] = ndarrays
+    return output
+
+# id(model) -> (model, its generator), the UDF worker calls the predict func with
+# the same model for its whole life
+_generators: Dict[int,Tuple[Any,ByzerLLMGenerator]] = {}
+
+def _get_generator(model,tokenizer,use_feature_extraction=False)->ByzerLLMGenerator:
+    entry = _generators.get(id(model),None)
+    if entry is None or entry[0] is not model:
+        entry = (model,ByzerLLMGenerator(model,tokenizer,use_feature_extraction=use_feature_extraction))
+        _generators[id(model)] = entry
+    return entry[1]
+
+def _predict_concurrency(model)->int:
+    '''
+    how many items of one request are predicted at the same time, set by the backends
+    which can serve concurrent requests (vllm, saas, transformers with dynamic batching)
+    '''
+    return max(1,int(getattr(model,"predict_concurrency",1)))
+
+def _predict_result(item:Dict[str,Any],v,ndarrays:List[np.ndarray])->Dict[str,Any]:
+    if item.get("embedding",False):
+        return _embedding_result(item,v,ndarrays)
+
+    if item.get("tokenizer",False) or item.get("meta",False) or item.get("apply_chat_template",False):
+        return {
+        "predict":v,
+        "metadata":{},
+        "input":item}
+
+    metadata = {}
+    if isinstance(v[1],dict) and "metadata" in v[1]:
+        metadata = v[1]["metadata"] 
+
+    return {
+        "predict":v[0],
+        "metadata":metadata,
+        "input":item}
+
 async def simple_predict_func(model,v):
     (model,tokenizer) = model
-    llm = ByzerLLMGenerator(model,tokenizer)
+    llm = _get_generator(model,tokenizer)
     data = [json.loads(item) for item in v]
-    
-    results=[]
-    for item in data:        
-        v = await llm.async_predict(item)
-        if item.get("embedding",False):
-            metadata = {}
-            value = v
-            if isinstance(v,tuple):
-                if isinstance(v[1],dict) and "metadata" in v[1]:
-                    metadata = v[1]["metadata"]
-                value = v[0]                            
-            results.append({"predict":value,"metadata":metadata,"input":item})
 
-        elif item.get("tokenizer",False) or item.get("meta",False) or item.get("apply_chat_template",False):
-            results.append({
-            "predict":v,
-            "metadata":{},
-            "input":item})
-        else:            
-            metadata = {}
-            if isinstance(v[1],dict) and "metadata" in v[1]:
-                metadata = v[1]["metadata"] 
+    semaphore = asyncio.Semaphore(_predict_concurrency(model))
+    async def predict(item):
+        async with semaphore:
+            return await llm.async_predict(item)
 
-            results.append({
-                "predict":v[0],
-                "metadata":metadata,
-                "input":item})
-
-    return {"value":[json.dumps(results,ensure_ascii=False)]}
+    outputs = await asyncio.gather(*[predict(item) for item in data])
+    ndarrays=[]
+    results = [_predict_result(item,output,ndarrays) for item,output in zip(data,outputs)]
+    return _predict_output(results,ndarrays)
 
 
 def chatglm_predict_func(model,v):
     (trainer,tokenizer) = model
-    llm = ByzerLLMGenerator(trainer,tokenizer,use_feature_extraction=True)
+    llm = _get_generator(trainer,tokenizer,use_feature_extraction=True)
     data = [json.loads(item) for item in v]
-    
-    results=[]
     for item in data:
         if "system" in item:
             item["instruction"] = f'{item["system"]}\n{item["instruction"]}'
-        v = llm.predict(item)
 
-        if item.get("tokenizer",False) or item.get("embedding",False) or item.get("meta",False) or item.get("apply_chat_template",False):
-            results.append({
-            "predict":v,
-            "metadata":{},
-            "input":item})
-        else:            
-            metadata = {}
-            if isinstance(v[1],dict) and "metadata" in v[1]:
-                metadata = v[1]["metadata"]            
-
-            results.append({
-                "predict":v[0],
-                "metadata":metadata,
-                "input":item})
-        
-    return {"value":[json.dumps(results,ensure_ascii=False)]}
+    concurrency = min(_predict_concurrency(trainer),len(data))
+    if concurrency > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outputs = list(executor.map(llm.predict,data))
+    else:
+        outputs = [llm.predict(item) for item in data]
+
+    ndarrays=[]
+    results = [_predict_result(item,output,ndarrays) for item,output in zip(data,outputs)]
+    return _predict_output(results,ndarrays)
 
 def qa_predict_func(model,v):        
     data = [json.loads(item) for item in v]
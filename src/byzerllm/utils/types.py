@@ -1,7 +1,9 @@
 import time
+import zlib
+import asyncio
 import threading
+from collections import OrderedDict
 from typing import TYPE_CHECKING,TypeVar,Dict, List, Optional, Union,Any,Tuple,get_type_hints,Annotated,get_args,Callable
-from queue import Queue
 from transformers import StoppingCriteria
 
 class StopSequencesCriteria(StoppingCriteria):
@@ -34,108 +36,433 @@ class SingleOutputMeta:
         self.generated_tokens_count = generated_tokens_count    
 
 class SingleOutput:
-    def __init__(self, text:str,metadata:SingleOutputMeta=SingleOutputMeta()):
+    '''
+    When `delta` is True the text only holds the piece generated since the
+    previous chunk of the stream, otherwise it is the whole text so far.
+    '''
+    def __init__(self, text:str,metadata:SingleOutputMeta=SingleOutputMeta(),delta:bool=False):
         self.text = text
         self.metadata = metadata
+        self.delta = delta
         
 class StreamOutputs: 
     def __init__(self, outputs:List[SingleOutput]):
         self.outputs = outputs   
+        # the sequence number in the stream, assigned by the stream server
+        self.seq = -1
 
-class BlockBinaryStreamServer:
+class StreamRequestState:
+    '''
+    The chunks of one stream request which are not consumed by the client yet.
+    `offset` is the sequence number of the first chunk held in `chunks`, so a
+    client cursor is simply the sequence number of the next chunk it wants.
+    '''
     def __init__(self):
-        self.cache = {}
-        self.cache_status = {} 
+        self.chunks = []
+        self.sizes = []
+        self.nbytes = 0
+        self.offset = 0
+        self.done = False
+        self.updated_at = time.monotonic()
+        # the whole text so far, built by the deprecated `get_item` only
+        self.merged = None
+
+    @property
+    def end(self)->int:
+        return self.offset + len(self.chunks)
+
+    def append(self, item)->int:
+        if isinstance(item, StreamOutputs):
+            item.seq = self.end
+        size = estimate_stream_item_size(item)
+        self.chunks.append(item)
+        self.sizes.append(size)
+        self.nbytes += size
+        return size
+
+    def ack(self, cursor:int)->int:
+        '''
+        chunks before the cursor have been delivered, drop them and
+        return the number of bytes released.
+        '''
+        n = min(cursor, self.end) - self.offset
+        if n <= 0:
+            return 0
+        released = sum(self.sizes[:n])
+        del self.chunks[:n]
+        del self.sizes[:n]
+        self.offset += n
+        self.nbytes -= released
+        return released
+
+
+def _merge_stream_outputs(merged, item):
+    if not isinstance(item, StreamOutputs):
+        return item
+    previous = merged.outputs if isinstance(merged, StreamOutputs) else []
+    outputs = []
+    for i, output in enumerate(item.outputs):
+        text = output.text
+        if output.delta and i < len(previous):
+            text = (previous[i].text or "") + (text or "")
+        outputs.append(SingleOutput(text, metadata=output.metadata))
+    v = StreamOutputs(outputs)
+    v.seq = item.seq
+    return v
+
+
+def estimate_stream_item_size(item)->int:
+    if isinstance(item, StreamOutputs):
+        return 64 + sum(len(output.text) if output.text else 0 for output in item.outputs)
+    if isinstance(item, (str,bytes,bytearray)):
+        return len(item)
+    return 64
+
+
+class StreamServerBase:
+    '''
+    Shared state handling of the stream servers. The writer calls `add_item` for
+    every chunk and `mark_done` when the generation is finished. The string item
+    `RUNNING` only registers the request.
+
+    Clients should prefer `get_items(request_id, cursor, timeout)`, which returns
+    `(items, next_cursor, done)` with every chunk queued since `cursor`, and blocks
+    up to `timeout` seconds when there is nothing new. It returns None when the
+    request is unknown (never started, already consumed or evicted).
+
+    `cache` is ordered by the last activity of the request, so expired requests
+    are always at the head: a request is evicted when it has been idle longer
+    than `idle_ttl` seconds, or (oldest first) when the chunks held by all
+    requests exceed `max_bytes`. Eviction runs on every write and in a
+    background reaper every `reap_interval` seconds.
+    '''
+    def __init__(self, max_bytes:int=1024*1024*1024, idle_ttl:float=30*60, reap_interval:float=10.0):
+        self.cache:"OrderedDict[str,StreamRequestState]" = OrderedDict()
         self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.reap_interval = reap_interval
+        self.total_bytes = 0
+        self.evictions = 0
+        self.expired_evictions = 0
+
+    def _touch(self, request_id, state:StreamRequestState):
+        state.updated_at = time.monotonic()
+        self.cache.move_to_end(request_id)
+
+    def _add(self, request_id, item)->StreamRequestState:
+        state = self.cache.get(request_id, None)
+        if state is None:
+            state = StreamRequestState()
+            self.cache[request_id] = state
+        if not isinstance(item,str):
+            self.total_bytes += state.append(item)
+        self._touch(request_id, state)
+        return state
+
+    def _done(self, request_id)->Optional[StreamRequestState]:
+        if request_id is None:
+            return None
+        state = self.cache.get(request_id, None)
+        if state is None:
+            state = StreamRequestState()
+            self.cache[request_id] = state
+        state.done = True
+        self._touch(request_id, state)
+        return state
+
+    def _remove(self, request_id):
+        state = self.cache.pop(request_id, None)
+        if state is not None:
+            self.total_bytes -= state.nbytes
+
+    def _ack(self, state:StreamRequestState, cursor:int):
+        self.total_bytes -= state.ack(cursor)
+
+    def _read(self, request_id, cursor:int):
+        state = self.cache.get(request_id, None)
+        if state is None:
+            return None
+        self._ack(state, cursor)
+        items = list(state.chunks)
+        done = state.done
+        if done:
+            # every remaining chunk is handed out, the client won't come back
+            self._remove(request_id)
+        else:
+            self._touch(request_id, state)
+        return (items, state.end, done)
+
+    def _read_merged(self, request_id):
+        '''
+        The read of the deprecated `get_item`, whose clients expect the whole text
+        in every chunk: the delta chunks are joined onto the text so far.
+        '''
+        state = self.cache.get(request_id, None)
+        if state is None:
+            return None
+        has_new = len(state.chunks) > 0
+        for item in state.chunks:
+            state.merged = _merge_stream_outputs(state.merged, item)
+        self._ack(state, state.end)
+        if state.done:
+            self._remove(request_id)
+            return state.merged if has_new else None
+        self._touch(request_id, state)
+        return "RUNNING" if state.merged is None else state.merged
+
+    def _has_new(self, request_id, cursor:int)->bool:
+        state = self.cache.get(request_id, None)
+        return state is None or state.done or state.end > cursor
+
+    def _evict(self)->List[str]:
+        '''
+        pop the expired requests from the head of the time ordered index,
+        then the oldest ones until the memory is under the limit.
+        '''
+        evicted = []
+        deadline = time.monotonic() - self.idle_ttl
+        while self.cache:
+            request_id, state = next(iter(self.cache.items()))
+            if state.updated_at < deadline:
+                self.expired_evictions += 1
+            elif self.total_bytes > self.max_bytes and len(self.cache) > 1:
+                pass
+            else:
+                break
+            self._remove(request_id)
+            self.evictions += 1
+            evicted.append(request_id)
+        return evicted
+
+    def _stats(self)->Dict[str,Any]:
+        return {
+            "live_streams": len(self.cache),
+            "bytes_held": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "idle_ttl": self.idle_ttl,
+            "evictions": self.evictions,
+            "expired_evictions": self.expired_evictions,
+        }
+
+
+class BlockBinaryStreamServer(StreamServerBase):
+    def __init__(self, max_bytes:int=1024*1024*1024, idle_ttl:float=30*60, reap_interval:float=10.0):
+        super().__init__(max_bytes=max_bytes, idle_ttl=idle_ttl, reap_interval=reap_interval)
+        self.conds:Dict[str,threading.Condition] = {}
+        threading.Thread(target=self._reaper, daemon=True).start()
+
+    def _reaper(self):
+        while True:
+            time.sleep(self.reap_interval)
+            with self.lock:
+                self._evict_and_notify()
+
+    def _evict_and_notify(self):
+        for request_id in self._evict():
+            # wake up the waiting client so it sees the request is gone
+            cond = self.conds.pop(request_id, None)
+            if cond is not None:
+                cond.notify_all()
+
+    def _notify(self, request_id):
+        cond = self.conds.get(request_id, None)
+        if cond is not None:
+            cond.notify_all()
 
     def add_item(self, request_id, item):
-        with self.lock:            
-            if request_id not in self.cache:
-                self.cache[request_id] = Queue()
-            self.cache[request_id].put(item)
-            self.cache_status[request_id]=int(time.time()*1000)
-    
+        with self.lock:
+            self._add(request_id, item)
+            self._notify(request_id)
+            self._evict_and_notify()
+
     def mark_done(self, request_id):
-        if len(self.cache_status) > 30:
-            now = int(time.time()*1000)
-            with self.lock:
-                for k in list(self.cache_status.keys()):
-                    if now - self.cache_status[k] > 10*60*60*1000:
-                        del self.cache_status[k]
-                        del self.cache[k] 
-        with self.lock:            
-            self.cache_status[request_id] = 0
-
-    def get_item(self, request_id):                
         with self.lock:
+            self._done(request_id)
+            self._notify(request_id)
+
+    def get_items(self, request_id, cursor:int=0, timeout:float=1.0):
+        with self.lock:
+            if not self._has_new(request_id, cursor):
+                cond = self.conds.setdefault(request_id, threading.Condition(self.lock))
+                cond.wait_for(lambda: self._has_new(request_id, cursor), timeout=timeout)
+            v = self._read(request_id, cursor)
             if request_id not in self.cache:
-                return None                                                        
-            try:
-                return self.cache[request_id].get(timeout=0.1)                
-            except:
-                if request_id in self.cache_status and self.cache_status[request_id] == 0:
-                    del self.cache[request_id]
-                    del self.cache_status[request_id]
-                    return None
-                return "RUNNING"
+                self.conds.pop(request_id, None)
+            return v
 
+    def stats(self)->Dict[str,Any]:
+        with self.lock:
+            return self._stats()
 
-class BlockVLLMStreamServer:
-    def __init__(self):
-        self.cache = {}
-        self.cache_status = {} 
-        self.lock = threading.Lock()
+    def get_item(self, request_id):
+        '''
+        Deprecated, use `get_items`. Pops the oldest chunk, returns `RUNNING` when
+        nothing is queued yet and None when the stream is finished.
+        '''
+        with self.lock:
+            state = self.cache.get(request_id, None)
+            if state is None:
+                return None
+            if state.chunks:
+                item = state.chunks[0]
+                self._ack(state, state.offset + 1)
+                return item
+            if state.done:
+                self._remove(request_id)
+                return None
+            return "RUNNING"
 
-    def add_item(self, request_id, item):
-        with self.lock:            
-            self.cache[request_id]=item
-            self.cache_status[request_id]=int(time.time()*1000)
-    
-    def mark_done(self, request_id):
-        if len(self.cache_status) > 30:
-            now = int(time.time()*1000)
-            with self.lock:
-                for k in list(self.cache_status.keys()):
-                    if now - self.cache_status[k] > 10*60*60*1000:
-                        del self.cache_status[k]
-                        del self.cache[k] 
-        with self.lock:            
-            self.cache_status[request_id] = 0
-
-    def get_item(self, request_id):                
+
+class BlockVLLMStreamServer(BlockBinaryStreamServer):
+
+    def get_item(self, request_id):
+        '''
+        Deprecated, use `get_items`. Returns the whole text so far, `RUNNING` when
+        nothing is queued yet and None when the stream is finished.
+        '''
         with self.lock:
-            v = self.cache.get(request_id, None)     
-            if request_id in self.cache_status and self.cache_status[request_id] == 0:
-                del self.cache[request_id]
-                del self.cache_status[request_id]
-            return v     
+            return self._read_merged(request_id)
 
-class VLLMStreamServer:
-    def __init__(self):
-        self.cache = {}
-        self.cache_status = {} 
-        self.lock = threading.Lock()
+
+class VLLMStreamServer(StreamServerBase):
+    '''
+    The async actor version, every waiter is parked on its own future
+    instead of occupying a thread of the actor, and the reaper is a task
+    on the actor's event loop.
+    '''
+    def __init__(self, max_bytes:int=1024*1024*1024, idle_ttl:float=30*60, reap_interval:float=10.0):
+        super().__init__(max_bytes=max_bytes, idle_ttl=idle_ttl, reap_interval=reap_interval)
+        # request id -> the futures of the clients waiting for new chunks
+        self.waiters:Dict[str,List[asyncio.Future]] = {}
+        self.reaper_task = None
+
+    def _ensure_reaper(self):
+        # there is no running loop in __init__, so start the reaper on first use
+        if self.reaper_task is None:
+            self.reaper_task = asyncio.get_running_loop().create_task(self._reaper())
+
+    async def _reaper(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            with self.lock:
+                self._evict_and_notify()
+
+    def _evict_and_notify(self):
+        for request_id in self._evict():
+            self._notify(request_id)
+
+    def _notify(self, request_id):
+        for waiter in self.waiters.pop(request_id, []):
+            if not waiter.done():
+                waiter.set_result(None)
 
     async def add_item(self, request_id, item):
-        with self.lock:            
-            self.cache[request_id]=item
-            self.cache_status[request_id]=int(time.time()*1000)
-    
+        self._ensure_reaper()
+        with self.lock:
+            self._add(request_id, item)
+            self._notify(request_id)
+            self._evict_and_notify()
+
     async def mark_done(self, request_id):
-        if len(self.cache_status) > 30:
-            now = int(time.time()*1000)
-            with self.lock:
-                for k in list(self.cache_status.keys()):
-                    if now - self.cache_status[k] > 10*60*60*1000:
-                        del self.cache_status[k]
-                        del self.cache[k] 
-        with self.lock:            
-            self.cache_status[request_id] = 0
-
-    async def get_item(self, request_id):                
         with self.lock:
-            v = self.cache.get(request_id, None)     
-            if request_id in self.cache_status and self.cache_status[request_id] == 0:
-                del self.cache[request_id]
-                del self.cache_status[request_id]
-            return v    
\ No newline at end of file
+            self._done(request_id)
+            self._notify(request_id)
+
+    async def get_items(self, request_id, cursor:int=0, timeout:float=1.0):
+        if not self._has_new(request_id, cursor):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.setdefault(request_id, []).append(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout=timeout)
+            except asyncio.TimeoutError:
+                waiters = self.waiters.get(request_id, [])
+                if waiter in waiters:
+                    waiters.remove(waiter)
+                if not waiters:
+                    self.waiters.pop(request_id, None)
+        with self.lock:
+            return self._read(request_id, cursor)
+
+    async def stats(self)->Dict[str,Any]:
+        with self.lock:
+            return self._stats()
+
+    async def get_item(self, request_id):
+        '''
+        Deprecated, use `get_items`. Returns the whole text so far, `RUNNING` when
+        nothing is queued yet and None when the stream is finished.
+        '''
+        with self.lock:
+            return self._read_merged(request_id)
+
+
+class _RoutedStreamMethod:
+    def __init__(self, pool:"StreamServerPool", method:str):
+        self.pool = pool
+        self.method = method
+
+    def remote(self, request_id, *args, **kwargs):
+        server = self.pool.get_server(request_id)
+        return getattr(server, self.method).remote(request_id, *args, **kwargs)
+
+
+class StreamServerPool:
+    '''
+    The stream servers of one kind sharded over `num_shards` named detached actors.
+    The actor names carry the protocol version, shard 0 is `{name}_v{VERSION}`
+    (e.g. `BLOCK_VLLM_STREAM_SERVER_v2`) and shard i is `{name}_v{VERSION}_{i}`.
+    The actors are detached and outlive an upgrade of the package, so a server
+    created by an older version (which keeps only the latest chunk and has no
+    `get_items`) is never reused by writers sending deltas.
+
+    A request id always hashes to the same shard, and the pool exposes
+    `add_item`/`mark_done` with the `.remote(request_id,...)` call shape of an actor
+    handle, so writers use it like the single actor. Writers return
+    `shard_name(request_id)` as the `stream_server` in the response metadata, and
+    the client simply calls `ray.get_actor` with it.
+    '''
+    # bump it whenever the stream protocol between writers, servers and clients changes
+    VERSION = 2
+
+    def __init__(self, name:str, num_shards:int=1):
+        self.name = f"{name}_v{self.VERSION}"
+        self.num_shards = max(1, int(num_shards))
+        self.servers = {}
+        self.add_item = _RoutedStreamMethod(self, "add_item")
+        self.mark_done = _RoutedStreamMethod(self, "mark_done")
+
+    def shard_name(self, request_id)->str:
+        if self.num_shards == 1:
+            return self.name
+        shard = zlib.crc32(str(request_id).encode("utf-8")) % self.num_shards
+        return self._name_of(shard)
+
+    def _name_of(self, shard:int)->str:
+        return self.name if shard == 0 else f"{self.name}_{shard}"
+
+    def get_server(self, request_id):
+        import ray
+        name = self.shard_name(request_id)
+        if name not in self.servers:
+            self.servers[name] = ray.get_actor(name)
+        return self.servers[name]
+
+    @classmethod
+    def create(cls, server_class, name:str, num_shards:int=1, max_concurrency:int=1000)->"StreamServerPool":
+        '''
+        create the missing shard actors, other deploys may have created some of them
+        '''
+        import ray
+        pool = cls(name, num_shards)
+        for shard in range(pool.num_shards):
+            shard_name = pool._name_of(shard)
+            try:
+                ray.get_actor(shard_name)
+            except ValueError:
+                try:
+                    ray.remote(server_class).options(name=shard_name,lifetime="detached",max_concurrency=max_concurrency).remote()
+                except Exception:
+                    # another worker created it concurrently
+                    pass
+        return pool
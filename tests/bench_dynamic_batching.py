@@ -0,0 +1,87 @@
+'''
+CPU benchmark of the dynamic batching of the transformers backend (byzerllm.auto).
+
+It builds a tiny randomly initialized GPT2 model, so no download is needed, and
+sends the same concurrent requests through async_stream_chat with and without
+`backend.dynamic_batching`:
+
+    python tests/bench_dynamic_batching.py --requests 32 --max_batch_size 8
+'''
+import argparse
+import asyncio
+import time
+import types
+
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import GPT2Config, GPT2LMHeadModel, GenerationConfig, PreTrainedTokenizerFast
+
+from byzerllm.auto import async_batch_stream_chat, batch_generate, stream_chat
+from byzerllm.utils.dynamic_batching import DynamicBatcher
+from byzerllm.utils.langutil import asyncfy_with_semaphore
+
+
+def build_model(n_layer:int, n_embd:int):
+    words = [f"w{i}" for i in range(1000)]
+    vocab = {"[UNK]":0, "[PAD]":1, **{w:i + 2 for i,w in enumerate(words)}}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="[UNK]", pad_token="[PAD]")
+
+    config = GPT2Config(vocab_size=len(vocab), n_layer=n_layer, n_embd=n_embd, n_head=4, n_positions=1024,
+                        eos_token_id=None, bos_token_id=0)
+    model = GPT2LMHeadModel(config).eval()
+    # never stops early, every request generates max_new_tokens
+    model.generation_config = GenerationConfig(eos_token_id=None, pad_token_id=1)
+    model.stream_chat = types.MethodType(stream_chat, model)
+    model.get_meta = types.MethodType(lambda self: [{"model_deploy_type":"proprietary","backend":"transformers"}], model)
+    return model, tokenizer
+
+
+async def run(model, tokenizer, prompts, max_length:int, batching:bool):
+    if batching:
+        async def chat(ins):
+            return await model.async_stream_chat(tokenizer, ins, [], max_length=max_length, top_p=1.0, temperature=1.0)
+    else:
+        async def chat(ins):
+            return await asyncfy_with_semaphore(lambda: model.stream_chat(tokenizer, ins, [], max_length=max_length,
+                                                                          top_p=1.0, temperature=1.0))()
+    start = time.monotonic()
+    results = await asyncio.gather(*[chat(ins) for ins in prompts])
+    time_taken = time.monotonic() - start
+    tokens = sum(r[0][1]["metadata"]["generated_tokens_count"] for r in results)
+    return time_taken, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--prompt_tokens", type=int, default=32)
+    parser.add_argument("--new_tokens", type=int, default=32)
+    parser.add_argument("--max_batch_size", type=int, default=8)
+    parser.add_argument("--max_batch_wait_ms", type=float, default=10.0)
+    parser.add_argument("--n_layer", type=int, default=4)
+    parser.add_argument("--n_embd", type=int, default=256)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    torch.set_num_threads(4)
+    model, tokenizer = build_model(args.n_layer, args.n_embd)
+    prompts = [" ".join(f"w{(i * 7 + j) % 1000}" for j in range(args.prompt_tokens - i % 4)) for i in range(args.requests)]
+    max_length = args.prompt_tokens + args.new_tokens
+
+    time_taken, tokens = asyncio.run(run(model, tokenizer, prompts, max_length, batching=False))
+    print(f"no batching:      {args.requests} requests {time_taken:.2f}s {tokens / time_taken:.1f} tokens/s")
+
+    model.batch_generate = types.MethodType(batch_generate, model)
+    model.dynamic_batcher = DynamicBatcher(lambda requests: model.batch_generate(tokenizer, requests),
+                                           max_batch_size=args.max_batch_size,
+                                           max_wait_ms=args.max_batch_wait_ms)
+    model.async_stream_chat = types.MethodType(async_batch_stream_chat, model)
+    time_taken, tokens = asyncio.run(run(model, tokenizer, prompts, max_length, batching=True))
+    print(f"dynamic batching: {args.requests} requests {time_taken:.2f}s {tokens / time_taken:.1f} tokens/s "
+          f"{model.dynamic_batcher.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+'''
+Round latency of GroupChatManager.run_chat on a local Ray cluster.
+
+The agents are stub Ray actors whose `receive` takes `--receive_ms`, the
+speaker selection LLM call is replaced by a sleep of `--select_ms`:
+
+    python tests/bench_groupchat.py --agents 12 --rounds 5
+'''
+import argparse
+import time
+
+import ray
+
+from byzerllm.apps.agent.groupchat import GroupChat, GroupChatManager
+
+
+class StubAgent:
+    def __init__(self, name:str, receive_ms:float):
+        self.name = name
+        self.receive_ms = receive_ms
+
+    def get_name(self):
+        return self.name
+
+    def receive(self, message, sender, request_reply=None, silent=False):
+        time.sleep(self.receive_ms / 1000)
+
+    def get_system_message(self):
+        return f"You are {self.name}."
+
+    def can_execute_function(self, name):
+        return False
+
+    def function_map(self):
+        return {}
+
+    def generate_reply(self, raw_message=None, messages=None, sender=None, exclude=None):
+        return {"content":f"reply from {self.name}", "role":"assistant"}
+
+    def send(self, message, recipient, request_reply=None, silent=False):
+        return True
+
+
+class StubManager(GroupChatManager):
+    def __init__(self, groupchat:GroupChat, select_ms:float):
+        super().__init__(groupchat=groupchat, llm=None, retrieval=None)
+        self.select_ms = select_ms
+        self.round = 0
+
+    def generate_llm_reply(self, raw_message=None, messages=None, sender=None, config=None):
+        time.sleep(self.select_ms / 1000)
+        self.round += 1
+        return True, self.groupchat.agent_names[self.round % len(self.groupchat.agents)]
+
+    def last_message(self, agent=None):
+        return {"content":"hello", "role":"user"}
+
+    def __reduce__(self):
+        # generate_reply(sender=self) sends the manager to the stub agents, send its name
+        # instead so the stub actors do not import byzerllm
+        return (str, (self.name,))
+
+
+def run(agents, rounds:int, select_ms:float, overlap:bool):
+    groupchat = GroupChat(agents=agents, messages=[], max_round=rounds, overlap_broadcast=overlap)
+    manager = StubManager(groupchat, select_ms)
+    start = time.monotonic()
+    manager.run_chat(messages=[{"content":"hello", "role":"user"}], sender=agents[0], config=groupchat)
+    return (time.monotonic() - start) / rounds
+
+
+def run_serial(agents, rounds:int, select_ms:float):
+    # the broadcast of the previous implementation: one blocking send per agent
+    groupchat = GroupChat(agents=agents, messages=[], max_round=rounds)
+    manager = StubManager(groupchat, select_ms)
+    start = time.monotonic()
+    speaker = agents[0]
+    message = {"content":"hello", "role":"user"}
+    for _ in range(rounds):
+        for agent in groupchat.agents:
+            if ray.get(agent.get_name.remote()) != ray.get(speaker.get_name.remote()):
+                manager.send(message, agent, request_reply=False, silent=True)
+        speaker = groupchat.select_speaker(speaker, manager)
+    return (time.monotonic() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agents", type=int, default=12)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--receive_ms", type=float, default=20.0)
+    parser.add_argument("--select_ms", type=float, default=100.0)
+    args = parser.parse_args()
+
+    ray.init(include_dashboard=False, log_to_driver=False)
+    agents = [ray.remote(max_concurrency=10)(StubAgent).remote(f"agent_{i}", args.receive_ms) for i in range(args.agents)]
+    ray.get([agent.get_name.remote() for agent in agents])
+
+    print(f"serial broadcast:     {run_serial(agents, args.rounds, args.select_ms) * 1000:.1f} ms/round")
+    print(f"concurrent broadcast: {run(agents, args.rounds, args.select_ms, overlap=False) * 1000:.1f} ms/round")
+    print(f"overlapped broadcast: {run(agents, args.rounds, args.select_ms, overlap=True) * 1000:.1f} ms/round")
+
+
+if __name__ == "__main__":
+    main()
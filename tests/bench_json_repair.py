@@ -0,0 +1,103 @@
+'''
+Repair time of malformed LLM json outputs of growing size, with the previous
+string-copying edits, with the gap buffer only and with JSONParser, which copies
+the string up to GAP_BUFFER_MIN_SIZE (all checked to give the same repaired
+string), plus the extraction of a fenced block and the streaming parser:
+
+    python tests/bench_json_repair.py --sizes 1000,5000,20000
+'''
+import argparse
+import json
+import random
+import time
+
+from byzerllm.utils.json_repaire import JSONParser, JSONStreamParser, extract_json
+
+
+class StringEditJSONParser(JSONParser):
+    # the edits of the previous implementation, every one copies the whole string
+    @property
+    def json_str(self):
+        return self._str
+
+    @json_str.setter
+    def json_str(self, json_str):
+        self._str = json_str
+
+    def _slice(self, start, end):
+        return self._str[start:end]
+
+    def insert_char_at(self, char):
+        self._str = self._str[:self.index] + char + self._str[self.index:]
+        self.index += 1
+
+    def get_char_at(self, count=0):
+        try:
+            return self._str[self.index + count]
+        except IndexError:
+            return False
+
+    def remove_char_at(self, count=0):
+        self._str = self._str[:self.index + count] + self._str[self.index + count + 1:]
+
+
+class GapBufferJSONParser(JSONParser):
+    GAP_BUFFER_MIN_SIZE = 0
+
+
+def malformed_output(items:int, rng:random.Random)->str:
+    # the usual damage: unquoted keys, single quotes, trailing commas, inner quotes, truncation
+    parts = []
+    for i in range(items):
+        kind = rng.randint(0, 3)
+        if kind == 0:
+            parts.append(f'{{id: {i}, "name": "item {i}", "ok": true,}}')
+        elif kind == 1:
+            parts.append(f"{{'id': {i}, 'tags': ['a', 'b',]}}")
+        elif kind == 2:
+            parts.append(f'{{"id": {i}, "quote": "he said "yes" to {i}"}}')
+        else:
+            parts.append(f'{{"id": {i}, "score": {i}.5, "note": null}}')
+    text = '[' + ', '.join(parts)
+    return "Here is the result:\n```json\n" + text[:int(len(text) * 0.98)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    value = fn()
+    return value, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,5000,20000")
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    for items in [int(x) for x in args.sizes.split(",")]:
+        output = malformed_output(items, rng)
+        json_str = output[output.index("\n```json\n") + 9:]
+
+        def repair(cls):
+            p = cls(json_str)
+            p.parse()
+            return p.json_str
+        new, new_ms = timed(lambda: repair(JSONParser))
+        gap, gap_ms = timed(lambda: repair(GapBufferJSONParser))
+        old, old_ms = timed(lambda: repair(StringEditJSONParser))
+        assert new == old == gap
+        _, extract_ms = timed(lambda: extract_json(output))
+
+        def stream():
+            p = JSONStreamParser()
+            for i in range(0, len(output), 16):
+                p.feed(output[i:i + 16])
+            return p.close()
+        _, stream_ms = timed(stream)
+        print(f"{len(output) / 1024:8.1f} KB  string edits {old_ms:9.1f} ms  gap buffer {gap_ms:8.1f} ms"
+              f"  JSONParser {new_ms:8.1f} ms"
+              f"  extract_json {extract_ms:8.1f} ms  stream(16 char chunks) {stream_ms:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
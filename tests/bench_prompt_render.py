@@ -0,0 +1,59 @@
+'''
+Render cost per call of a @byzerllm.prompt function, with the compiled
+template cache and with the previous per-call signature + Template build:
+
+    python tests/bench_prompt_render.py --calls 20000
+'''
+import argparse
+import inspect
+import time
+
+import byzerllm
+from byzerllm.utils import _dedent_doc
+
+
+@byzerllm.prompt()
+def summarize(title:str, paragraphs:list, lang:str="en")->str:
+    '''
+    Summarize the article {{ title }} in {{ lang }}.
+
+    {% for p in paragraphs %}
+    - {{ p }}
+    {% endfor %}
+
+    Keep it under 100 words.
+    '''
+
+
+def render_uncached(func, *args, **kwargs):
+    # what every call did before: signature, dedent and a fresh jinja2 Template
+    from jinja2 import Template
+    signature = inspect.signature(func)
+    arguments = signature.bind(*args, **kwargs)
+    arguments.apply_defaults()
+    input_dict = {param:arguments.arguments[param] for param in signature.parameters}
+    return Template(_dedent_doc(func.__doc__)).render(input_dict)
+
+
+def bench(fn, calls:int)->float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+
+    paragraphs = [f"paragraph {i}" for i in range(5)]
+    func = summarize.func
+    assert summarize.prompt("t", paragraphs) == render_uncached(func, "t", paragraphs)
+
+    print(f"uncached: {bench(lambda: render_uncached(func, 't', paragraphs), args.calls // 10):.1f} us/call")
+    print(f"cached:   {bench(lambda: summarize.prompt('t', paragraphs), args.calls):.1f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import time
+import pytest
+
+pytest.importorskip("llama_index.core")
+from byzerllm.apps.llama_index import byzerai_kvstore
+
+
+class StubRetrieval:
+    '''the text_content table of SimpleRetrieval in a dict'''
+    def __init__(self, **kwargs):
+        self.rows = {}
+        self.commits = 0
+        self.fail_saves = 0
+
+    def save_doc(self, data, owner=None):
+        if self.fail_saves > 0:
+            self.fail_saves -= 1
+            raise Exception("retrieval is down")
+        for doc in data:
+            self.rows[f'{doc["collection"]}/{doc["doc_id"]}'] = doc
+
+    def commit_doc(self):
+        self.commits += 1
+
+    def delete_docs_by_ids(self, doc_ids, collection):
+        for doc_id in doc_ids:
+            self.rows.pop(f"{collection}/{doc_id}", None)
+
+    def get_doc(self, doc_id, collection):
+        return self.rows.get(f"{collection}/{doc_id}")
+
+    def get_docs_by_collection(self, collection, limit=100000):
+        return [doc for doc in self.rows.values() if doc["collection"] == collection]
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(byzerai_kvstore, "SimpleRetrieval", StubRetrieval)
+    return byzerai_kvstore.ByzerAIKVStore(llm=None, retrieval=None, flush_size=100, flush_interval=0)
+
+
+def test_put_is_visible_before_the_flush(store):
+    store.put("a", {"v": 1})
+    assert store.get("a") == {"v": 1}
+    assert store._retrieval.rows == {}
+    store.flush()
+    assert store._retrieval.commits == 1
+    assert store.get("a") == {"v": 1}
+
+
+def test_delete_hides_the_stored_value(store):
+    store.put("a", {"v": 1})
+    store.flush()
+    store.delete("a")
+    assert store.get("a") is None
+    assert store.get_all() == {}
+    store.flush()
+    assert store._retrieval.rows == {}
+
+
+def test_get_all_merges_the_buffer(store):
+    store.put_all([("a", {"v": 1}), ("b", {"v": 2})])
+    store.flush()
+    store.put("b", {"v": 3})
+    store.put("c", {"v": 4})
+    assert store.get_all() == {"a": {"v": 1}, "b": {"v": 3}, "c": {"v": 4}}
+
+
+def test_failed_flush_is_kept_and_retried(store):
+    store._flush_interval = 0.05
+    store._retrieval.fail_saves = 1
+    store.put("a", {"v": 1})
+    with pytest.raises(Exception):
+        store.flush()
+    assert store.get("a") == {"v": 1}
+    # the timer is armed again and retries on its own
+    for _ in range(100):
+        if store._retrieval.rows:
+            break
+        time.sleep(0.05)
+    assert [doc["doc_id"] for doc in store._retrieval.rows.values()] == ["a"]
+    assert store._buffer == {}
+
+
+def test_put_does_not_raise_when_the_flush_is_retried(store):
+    store._flush_size, store._flush_interval = 2, 0.05
+    store._retrieval.fail_saves = 1
+    store.put("a", {"v": 1})
+    store.put("b", {"v": 2})
+    assert store.get("b") == {"v": 2}
+    for _ in range(100):
+        if store._retrieval.rows:
+            break
+        time.sleep(0.05)
+    assert sorted(doc["doc_id"] for doc in store._retrieval.rows.values()) == ["a", "b"]
+
+
+def test_unbuffered_put_raises_and_keeps_nothing(monkeypatch):
+    monkeypatch.setattr(byzerai_kvstore, "SimpleRetrieval", StubRetrieval)
+    store = byzerai_kvstore.ByzerAIKVStore(llm=None, retrieval=None)
+    store._retrieval.fail_saves = 1
+    with pytest.raises(Exception):
+        store.put("a", {"v": 1})
+    assert store._buffer == {} and store.get("a") is None
+    store.put("a", {"v": 2})
+    assert store._retrieval.commits == 1 and store.get("a") == {"v": 2}
@@ -0,0 +1,36 @@
+from tokenizers import Tokenizer, models
+from transformers import PreTrainedTokenizerFast
+from byzerllm.utils.chat_template import chat_template_meta, render_chat_template
+
+TEMPLATE = (
+    "{{ bos_token }}{% for message in messages %}"
+    "{% if message['role'] == 'system' and loop.first %}<<SYS>>{{ message['content'] }}<</SYS>>\n"
+    "{% else %}<|{{ message['role'] }}|>\n{{ message['content'] | trim }}{{ eos_token }}\n{% endif %}"
+    "{% endfor %}{% if add_generation_prompt %}<|assistant|>\n{% endif %}"
+)
+
+
+def build_tokenizer():
+    backend = Tokenizer(models.WordLevel({"<s>":0, "</s>":1, "<unk>":2}, unk_token="<unk>"))
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, bos_token="<s>", eos_token="</s>", unk_token="<unk>")
+    tokenizer.chat_template = TEMPLATE
+    return tokenizer
+
+
+def test_local_rendering_matches_the_tokenizer():
+    tokenizer = build_tokenizer()
+    meta = chat_template_meta(tokenizer)
+    assert meta["chat_template"] == TEMPLATE
+    messages = [{"role":"system","content":"be brief"},
+                {"role":"user","content":"hello "},
+                {"role":"assistant","content":"hi"},
+                {"role":"user","content":"你好"}]
+    expected = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    assert render_chat_template(meta["chat_template"], messages,
+                                special_tokens=meta["chat_template_special_tokens"]) == expected
+
+
+def test_no_template_no_meta():
+    tokenizer = build_tokenizer()
+    tokenizer.chat_template = None
+    assert chat_template_meta(tokenizer) == {}
@@ -0,0 +1,58 @@
+import asyncio
+from byzerllm.utils.dynamic_batching import DynamicBatcher
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_requests_are_batched():
+    batches = []
+    def batch_func(items):
+        batches.append(items)
+        return [item * 2 for item in items]
+
+    async def main():
+        batcher = DynamicBatcher(batch_func,max_batch_size=4,max_wait_ms=50)
+        return await asyncio.gather(*[batcher.submit(i) for i in range(8)])
+
+    assert run(main()) == [i * 2 for i in range(8)]
+    assert [len(b) for b in batches] == [4,4]
+
+def test_groups_and_fifo():
+    batches = []
+    def batch_func(items):
+        batches.append(items)
+        return items
+
+    async def main():
+        batcher = DynamicBatcher(batch_func,max_batch_size=4,max_wait_ms=20)
+        await asyncio.gather(*[batcher.submit(i,group=i % 2) for i in range(4)])
+
+    run(main())
+    # the oldest request's group goes first
+    assert batches == [[0,2],[1,3]]
+
+def test_max_batch_tokens():
+    batches = []
+    def batch_func(items):
+        batches.append(items)
+        return items
+
+    async def main():
+        batcher = DynamicBatcher(batch_func,max_batch_size=8,max_wait_ms=20,max_batch_tokens=100)
+        await asyncio.gather(*[batcher.submit(i,num_tokens=40) for i in range(4)])
+
+    run(main())
+    assert [len(b) for b in batches] == [2,2]
+
+def test_exception_is_propagated():
+    def batch_func(items):
+        raise ValueError("boom")
+
+    async def main():
+        batcher = DynamicBatcher(batch_func,max_wait_ms=1)
+        try:
+            await batcher.submit(1)
+        except ValueError as e:
+            return str(e)
+
+    assert run(main()) == "boom"
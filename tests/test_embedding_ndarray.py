@@ -0,0 +1,31 @@
+import json
+import numpy as np
+from byzerllm.utils.retrieval import _vectors_to_json
+from byzerllm.utils.text_generator import _embedding_result, _predict_output
+from byzerllm.utils.client import ByzerLLM
+
+def test_vectors_to_json_restores_float32():
+    matrix = np.random.rand(3,16).astype(np.float32) - 0.5
+    texts = _vectors_to_json(matrix)
+    assert len(texts) == 3
+    restored = np.array([json.loads(t) for t in texts],dtype=np.float32)
+    assert np.array_equal(restored,matrix)
+
+def test_ndarray_embedding_result_roundtrip():
+    item = {"instruction":["a","b"],"embedding":True,"embed_batch":True,"embedding_format":"ndarray"}
+    embeddings = np.ones((2,4),dtype=np.float32)
+    ndarrays = []
+    results = [_embedding_result(item,(embeddings,{"metadata":{"input_tokens_count":2}}),ndarrays),
+               _embedding_result({"instruction":"c","embedding":True},[0.5,0.5],ndarrays)]
+    output = _predict_output(results,ndarrays)
+    values = ByzerLLM._decode_result(None,output)
+    assert isinstance(values[0]["predict"],np.ndarray) and values[0]["predict"].shape == (2,4)
+    assert values[0]["metadata"]["input_tokens_count"] == 2
+    assert values[1]["predict"] == [0.5,0.5]
+
+def test_batch_metadata_is_counted_once():
+    item = {"input":{"instruction":["a","b","c"],"embedding":True,"embed_batch":True},
+            "predict":[[0.1],[0.2],[0.3]],"metadata":{"input_tokens_count":6}}
+    responses = ByzerLLM._to_emb_responses(None,[item])
+    assert [r.input["instruction"] for r in responses] == ["a","b","c"]
+    assert sum(r.metadata.get("input_tokens_count",0) for r in responses) == 6
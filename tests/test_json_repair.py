@@ -0,0 +1,65 @@
+import json
+import pydantic
+import pytest
+from byzerllm.utils.json_repaire import JSONParser, JSONStreamParser, extract_json, repair_json_str
+
+
+class Answer(pydantic.BaseModel):
+    name: str
+    tags: list
+
+
+def test_repair_edits():
+    assert repair_json_str('{name: "John", age: 30}') == '{"name": "John", "age": 30}'
+    assert json.loads(repair_json_str('[1, 2, {"a": "he said "hi" ok"}]')) == [1, 2, {"a": 'he said "hi" ok'}]
+    assert JSONParser("*** " * 2000 + '{"a": true,').parse() == {"a": True}
+
+
+def test_repair_edits_in_the_gap_buffer(monkeypatch):
+    text = "[" + ", ".join(f"{{id: {i}, 'tags': ['a', 'b',]}}" for i in range(50))
+    plain = JSONParser(text)
+    value = plain.parse()
+    monkeypatch.setattr(JSONParser, "GAP_BUFFER_MIN_SIZE", 0)
+    gap = JSONParser(text)
+    assert gap.parse() == value and gap.json_str == plain.json_str
+    assert not gap._plain and plain._plain
+
+
+def test_extract_json():
+    assert extract_json('Sure!\n```json\n{"a": 1, "b": [1,2,\n```\nthanks') == {"a": 1, "b": [1, 2]}
+    assert extract_json('the answer is {name: "x", "v": true,}') == {"name": "x", "v": True}
+    # a bracket in the prose before the code block is not the json
+    assert extract_json('[Answer] here it is:\n```json\n{"name": "a", "age": 3}\n```') == {"name": "a", "age": 3}
+    with pytest.raises(ValueError):
+        extract_json('```python\nprint({1:2})\n```')
+
+
+def test_stream_parser_stops_when_the_value_closes():
+    output = 'Here:\n```json\n{"name": "a } b \\" {", "tags": ["x", {"y": 1}]}\n```\nmore text'
+    parser = JSONStreamParser(response_class=Answer)
+    fed = 0
+    for i in range(0, len(output), 3):
+        fed = i + 3
+        if parser.feed(output[i:i + 3]):
+            break
+    assert fed < len(output)
+    assert parser.close() == Answer(name='a } b " {', tags=["x", {"y": 1}])
+
+
+def test_stream_parser_repairs_truncated_output():
+    parser = JSONStreamParser(response_class=Answer)
+    parser.feed('{"name": "trunc", "tags": []')
+    assert not parser.done
+    assert parser.close().name == "trunc"
+
+
+def test_stream_parser_skips_brackets_of_the_prose():
+    cases = [('he said "[" then {"a":1}', {"a": 1}),
+             ('x "{" {"a":"}"}', {"a": "}"}),
+             ('Use it like [name:\n```json\n{"a": [1]}\n```', {"a": [1]})]
+    for output, expected in cases:
+        parser = JSONStreamParser()
+        for char in output:
+            if parser.feed(char):
+                break
+        assert parser.close() == expected
@@ -0,0 +1,69 @@
+import time
+from byzerllm.apps.agent.store import Message
+from byzerllm.apps.agent.store.memory_store import MemoryStore
+
+def _message(id, content="hello"):
+    return Message(id=id, m={"content":content}, sender="a", receiver="b", timestamp=time.monotonic())
+
+def test_ring_buffer_keeps_latest_messages():
+    store = MemoryStore(max_messages=3)
+    for i in range(5):
+        store.put(_message("c1", str(i)))
+    assert [m.m["content"] for m in store.get("c1")] == ["2","3","4"]
+    assert store.stats()["dropped_messages"] == 2
+    assert store.stats()["messages"] == 3
+
+def test_sweep_drops_inactive_conversations():
+    store = MemoryStore(ttl=0.05, sweep_interval=0)
+    store.put(_message("old"))
+    time.sleep(0.1)
+    store.put(_message("new"))
+    assert store.get("old") == []
+    assert len(store.get("new")) == 1
+    assert store.stats()["conversations"] == 1
+    assert store.stats()["expired_conversations"] == 1
+
+def test_clear_and_reuse_keeps_one_heap_entry():
+    store = MemoryStore()
+    for _ in range(10):
+        store.put(_message("c1"))
+        store.clear("c1")
+    store.put(_message("c1"))
+    assert store.stats()["expiry_heap_size"] == 1
+
+def test_get_since_returns_only_new_messages():
+    store = MemoryStore(max_messages=3)
+    for i in range(2):
+        store.put(_message("c1", str(i)))
+    messages, offset = store.get_since("c1", 0)
+    assert [m.m["content"] for m in messages] == ["0","1"] and offset == 2
+    for i in range(2,6):
+        store.put(_message("c1", str(i)))
+    # "2" fell out of the ring buffer
+    messages, offset = store.get_since("c1", offset)
+    assert [m.m["content"] for m in messages] == ["3","4","5"] and offset == 6
+    assert store.get_since("c1", offset) == ([], 6)
+
+def test_get_since_waits_for_new_message():
+    import threading
+    store = MemoryStore()
+    store.put(_message("c1"))
+    threading.Timer(0.05, lambda: store.put(_message("c1", "later"))).start()
+    messages, offset = store.get_since("c1", 1, timeout=5)
+    assert [m.m["content"] for m in messages] == ["later"] and offset == 2
+
+def test_async_store_wakes_long_poll_on_put():
+    import asyncio
+    from byzerllm.apps.agent.store.memory_store import AsyncMemoryStore
+    async def run():
+        store = AsyncMemoryStore()
+        await store.put(_message("c1"))
+        poll = asyncio.ensure_future(store.get_since("c1", 1, timeout=5))
+        await asyncio.sleep(0.05)
+        assert not poll.done()
+        await store.put(_message("c1", "later"))
+        messages, offset = await poll
+        assert [m.m["content"] for m in messages] == ["later"] and offset == 2
+        # times out without a new message
+        assert await store.get_since("c1", 2, timeout=0.05) == ([], 2)
+    asyncio.run(run())
@@ -0,0 +1,23 @@
+import time
+from byzerllm.utils.client.meta_registry import ModelMetaRegistry
+
+def test_meta_expires_after_ttl():
+    registry = ModelMetaRegistry(ttl=0.05)
+    registry.put("chat",{"max_model_len":8192})
+    assert registry.get("chat") == {"max_model_len":8192}
+    time.sleep(0.1)
+    assert registry.get("chat") is None
+
+def test_invalidate():
+    registry = ModelMetaRegistry()
+    registry.put("chat",{"backend":"transformers"})
+    registry.invalidate("chat")
+    assert registry.get("chat") is None
+
+def test_callers_get_a_copy():
+    registry = ModelMetaRegistry()
+    meta = {"chat_template_special_tokens":{"bos_token":"<s>"}}
+    registry.put("chat",meta)
+    meta["max_model_len"] = 1
+    registry.get("chat")["chat_template_special_tokens"]["bos_token"] = "x"
+    assert registry.get("chat") == {"chat_template_special_tokens":{"bos_token":"<s>"}}
@@ -0,0 +1,33 @@
+import asyncio
+import json
+import time
+from byzerllm.utils.text_generator import simple_predict_func, _get_generator
+
+
+class SleepyModel:
+    def __init__(self, predict_concurrency:int):
+        self.predict_concurrency = predict_concurrency
+
+    async def async_stream_chat(self, tokenizer, ins, his, **kwargs):
+        await asyncio.sleep(0.05)
+        return [(ins.upper(), {"metadata":{"generated_tokens_count":1}})]
+
+
+def run(model):
+    v = [json.dumps({"instruction":f"q{i}"}) for i in range(8)]
+    start = time.monotonic()
+    output = asyncio.run(simple_predict_func((model, None), v))
+    return time.monotonic() - start, json.loads(output["value"][0])
+
+
+def test_items_are_predicted_concurrently_in_order():
+    elapsed, results = run(SleepyModel(8))
+    assert [r["predict"] for r in results] == [f"Q{i}" for i in range(8)]
+    assert results[0]["metadata"] == {"generated_tokens_count":1}
+    assert elapsed < 0.3
+
+
+def test_generator_is_cached_per_model():
+    model = SleepyModel(1)
+    assert _get_generator(model, None) is _get_generator(model, None)
+    assert _get_generator(SleepyModel(1), None) is not _get_generator(model, None)
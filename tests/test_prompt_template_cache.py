@@ -0,0 +1,25 @@
+from byzerllm.utils import format_prompt_jinja2, get_prompt_template, get_signature
+
+
+def hello(s:str):
+    '''
+    Hello, {{ s }}!
+    '''
+
+
+def test_template_is_compiled_once():
+    tpl = get_prompt_template(hello, "jinja2")
+    assert get_prompt_template(hello, "jinja2") is tpl
+    assert get_signature(hello) is get_signature(hello)
+    assert format_prompt_jinja2(hello, s="world") == "\nHello, world!"
+
+
+def test_template_is_rebuilt_when_doc_changes():
+    def bye(s:str):
+        '''
+        Bye, {{ s }}!
+        '''
+    tpl = get_prompt_template(bye, "jinja2")
+    bye.__doc__ = "Bye bye, {{ s }}!"
+    assert get_prompt_template(bye, "jinja2") is not tpl
+    assert format_prompt_jinja2(bye, s="world") == "Bye bye, world!"
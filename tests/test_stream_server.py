@@ -0,0 +1,112 @@
+import threading
+import time
+from byzerllm.utils.types import BlockVLLMStreamServer,BlockBinaryStreamServer,StreamServerPool,VLLMStreamServer
+
+def consume(server,request_id):
+    cursor = 0
+    result = []
+    while True:
+        batch = server.get_items(request_id,cursor,1.0)
+        if batch is None:
+            break
+        items,cursor,done = batch
+        result.extend(items)
+        if done:
+            break
+    return result
+
+def test_get_items_long_poll():
+    server = BlockVLLMStreamServer()
+    server.add_item("r1","RUNNING")
+
+    def writer():
+        for i in range(5):
+            server.add_item("r1",i)
+            time.sleep(0.01)
+        server.mark_done("r1")
+
+    threading.Thread(target=writer,daemon=True).start()
+    assert consume(server,"r1") == [0,1,2,3,4]
+    assert server.get_items("r1",0,0.01) is None
+
+def test_get_items_timeout():
+    server = BlockBinaryStreamServer()
+    server.add_item("r2","RUNNING")
+    start = time.monotonic()
+    assert server.get_items("r2",0,0.1) == ([],0,False)
+    assert time.monotonic() - start >= 0.1
+
+def test_legacy_get_item():
+    server = BlockBinaryStreamServer()
+    server.add_item("r3",b"a")
+    server.add_item("r3",b"b")
+    server.mark_done("r3")
+    assert server.get_item("r3") == b"a"
+    assert server.get_item("r3") == b"b"
+    assert server.get_item("r3") is None
+
+def test_legacy_get_item_joins_the_deltas():
+    from byzerllm.utils.types import StreamOutputs,SingleOutput
+    server = BlockVLLMStreamServer()
+    server.add_item("r4","RUNNING")
+    assert server.get_item("r4") == "RUNNING"
+    server.add_item("r4",StreamOutputs([SingleOutput("he",delta=True)]))
+    server.add_item("r4",StreamOutputs([SingleOutput("ll",delta=True)]))
+    assert server.get_item("r4").outputs[0].text == "hell"
+    # nothing new, the text so far again
+    assert server.get_item("r4").outputs[0].text == "hell"
+    server.add_item("r4",StreamOutputs([SingleOutput("o",delta=True)]))
+    server.mark_done("r4")
+    assert server.get_item("r4").outputs[0].text == "hello"
+    assert server.get_item("r4") is None
+
+def test_evict_idle_streams():
+    server = BlockVLLMStreamServer(idle_ttl=0.05,reap_interval=0.02)
+    server.add_item("r4","RUNNING")
+    server.add_item("r4",b"abc")
+    time.sleep(0.2)
+    stats = server.stats()
+    assert stats["live_streams"] == 0
+    assert stats["bytes_held"] == 0
+    assert stats["expired_evictions"] == 1
+    assert server.get_items("r4",0,0.01) is None
+
+def test_evict_when_over_max_bytes():
+    server = BlockBinaryStreamServer(max_bytes=10)
+    server.add_item("r5",b"x" * 8)
+    server.add_item("r6",b"y" * 8)
+    stats = server.stats()
+    assert stats["live_streams"] == 1
+    assert stats["bytes_held"] == 8
+    assert stats["evictions"] == 1
+    assert server.get_items("r5",0,0.01) is None
+    assert server.get_items("r6",0,0.01) == ([b"y" * 8],1,False)
+    assert server.stats()["bytes_held"] == 8
+    assert server.get_items("r6",1,0.01) == ([],1,False)
+    assert server.stats()["bytes_held"] == 0
+
+def test_stream_server_pool_shard_name():
+    assert StreamServerPool("BLOCK_VLLM_STREAM_SERVER").shard_name("abc") == "BLOCK_VLLM_STREAM_SERVER_v2"
+    pool = StreamServerPool("BLOCK_VLLM_STREAM_SERVER",num_shards=4)
+    names = set(pool.shard_name(f"request_{i}") for i in range(100))
+    assert names == {"BLOCK_VLLM_STREAM_SERVER_v2"} | {f"BLOCK_VLLM_STREAM_SERVER_v2_{i}" for i in range(1,4)}
+    assert pool.shard_name("request_1") == pool.shard_name("request_1")
+
+def test_async_server_wakes_every_waiter():
+    import asyncio
+    import time
+
+    async def run():
+        server = VLLMStreamServer()
+        await server.add_item("r", b"a")
+        readers = [asyncio.ensure_future(server.get_items("r", 1, timeout=5)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        start = time.monotonic()
+        await server.add_item("r", b"b")
+        results = await asyncio.gather(*readers)
+        assert time.monotonic() - start < 1
+        assert all(items == [b"b"] and end == 2 for items, end, done in results)
+        assert server.waiters == {}
+        server.reaper_task.cancel()
+
+    asyncio.run(run())
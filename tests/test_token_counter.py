@@ -0,0 +1,57 @@
+from byzerllm.utils.client.token_counter import TokenCounter
+
+class FakeTokenizer:
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self,texts):
+        self.texts.extend(texts)
+        return [len(t.split()) for t in texts]
+
+def test_count_is_cached():
+    tokenizer = FakeTokenizer()
+    counter = TokenCounter(tokenizer)
+    assert counter.count("hello world") == 2
+    assert counter.count("hello world") == 2
+    assert tokenizer.texts == ["hello world"]
+
+def test_shared_prefix_is_not_recounted():
+    tokenizer = FakeTokenizer()
+    counter = TokenCounter(tokenizer,block_size=10)
+    history = "\n".join([f"User: question {i}\nAssistant: answer {i}" for i in range(20)])
+    assert counter.count(history) == 120
+    counted = len(tokenizer.texts)
+    assert counter.count(history + "\nUser: one more question") == 124
+    # only the old tail block (which now ends with a newline) and the new block are tokenized
+    assert len(tokenizer.texts) == counted + 2
+
+def test_lru_eviction():
+    counter = TokenCounter(FakeTokenizer(),cache_size=2)
+    for s in ["a","b","c"]:
+        counter.count(s)
+    assert len(counter.cache) == 2
+
+def _client_with_tokenize(tokenize):
+    from byzerllm.utils.client import ByzerLLM
+    llm = ByzerLLM()
+    llm.setup_max_model_length("m",100)
+    # the worker tokenizes every text with a bos token
+    llm._query = lambda model,input_value: [{"predict":[[0]+tokenize(item["instruction"])]} for item in input_value]
+    return llm
+
+def test_remote_count_leaves_out_special_tokens():
+    llm = _client_with_tokenize(lambda s: list(range(len(s.split()))))
+    assert llm.get_token_counter("m").count("hello big world") == 3
+
+def test_only_missing_tokenizer_service_disables_the_check():
+    def fail(s):
+        raise Exception("RayTaskError: timeout")
+    llm = _client_with_tokenize(fail)
+    llm._check_context_length("m",[{"instruction":"hello"}])
+    assert llm.get_token_counter("m") is not None
+
+    def no_tokenizer(s):
+        raise Exception("This model do not support text tokenizer service")
+    llm = _client_with_tokenize(no_tokenizer)
+    llm._check_context_length("m",[{"instruction":"hello"}])
+    assert llm.get_token_counter("m") is None
@@ -0,0 +1,66 @@
+import pytest
+from byzerllm.utils.client.worker_lease import WorkerLease, NoLiveWorkerError
+
+def test_acquire_least_inflight_worker():
+    lease = WorkerLease(None,[(0,"w0"),(1,"w1")],max_inflight=2)
+    assert lease.acquire()[0] == 0
+    assert lease.acquire()[0] == 1
+    lease.release(0)
+    assert lease.acquire()[0] == 0
+
+def test_acquire_timeout_when_full():
+    lease = WorkerLease(None,[(0,"w0")],max_inflight=1)
+    lease.acquire()
+    with pytest.raises(TimeoutError):
+        lease.acquire(timeout=0.01)
+
+def test_invalidate_does_not_give_back_dead_worker():
+    lease = WorkerLease(None,[(0,"w0")],max_inflight=1)
+    index, _ = lease.acquire()
+    lease.invalidate(index)
+    lease.release(index)
+    assert lease.dead == {0}
+    with pytest.raises(NoLiveWorkerError):
+        lease.acquire(timeout=0.01)
+
+def test_query_falls_back_to_master_when_leased_worker_died():
+    import json
+    import ray
+    from byzerllm.utils.client import ByzerLLM
+
+    # defined here so ray ships them by value instead of importing this module
+    @ray.remote
+    class Worker:
+        async def async_apply(self, rows):
+            return {"value":[json.dumps([{"predict":"ok","metadata":{}}])]}
+
+    @ray.remote
+    class Master:
+        def __init__(self):
+            self.workers = [Worker.remote(), Worker.remote()]
+            self.next = 0
+
+        def get(self, index):
+            # the first worker goes to the lease, the second one serves the master queries
+            index = min(self.next, 1)
+            self.next += 1
+            return index, self.workers[index]
+
+        def give_back(self, index):
+            pass
+
+        def kill(self, index):
+            ray.kill(self.workers[index])
+
+    ray.init(num_cpus=1,include_dashboard=False,ignore_reinit_error=True)
+    try:
+        master = Master.options(name="lease_test_model").remote()
+        llm = ByzerLLM(force_skip_context_length_check=True)
+        llm.setup_worker_lease("lease_test_model",num_workers=1)
+        ray.get(master.kill.remote(0))
+        with pytest.raises(ray.exceptions.RayActorError):
+            llm._query("lease_test_model",[{"instruction":"hi"}])
+        assert llm._query("lease_test_model",[{"instruction":"hi"}])[0]["predict"] == "ok"
+        assert "lease_test_model" not in llm.mapping_worker_lease
+    finally:
+        ray.shutdown()